@@ -5,8 +5,13 @@ pwc_meths_fn = 'methods.json'
 pwc_evals_fn = 'evaluation-tables.json'
 pwc_dsets_ext_fn = 'datasets_ext.json'
 pwc_pprs_fn = 'papers-with-abstracts.json'
-pwc_api_base_url = ('https://paperswithcode.com/api/internal/papers/'
+pwc_base_url = 'https://paperswithcode.com'
+pwc_api_base_url = (pwc_base_url + '/api/internal/papers/'
                     '?format=json&paperdataset__dataset_id=')
+# # crawling of the PWC API (see contextgraph.preprocessing.crawler)
+pwc_crawl_concurrency = 4
+pwc_crawl_requests_per_second = 2
+pwc_crawl_max_retries = 5
 
 # unarXive data
 # (see https://github.com/IllDepence/unarXive/tree/legacy_2020
@@ -39,5 +44,16 @@ graph_ppr_to_ppr_fn = 'papers_to_papers.csv'
 # # for intermmediate processing steps
 graph_tasks_pre_fn = 'tasks_pre.jsonl'
 
+# node description embeddings
+# (single row per node matrix + node ID to row index mapping)
+graph_embs_dir = 'combigraph_mpnet-base_embeddings'
+graph_embs_fn = 'embeddings.npy'
+graph_embs_idx_fn = 'nodeid_to_row.json'
+
+# binary snapshots of loaded graphs
+# (invalidated automatically when files in graph_data_dir change,
+#  can be shared between machines with copies of the same data)
+graph_cache_dir = '/tmp/sc_graph_cache'
+
 # datasets for ML
 graph_samples = "/tmp/sc_graph_samples"
@@ -14,7 +14,7 @@ import contextgraph.config as cg_config
 from contextgraph.util.preprocessing import canonicalize_arxiv_id
 
 
-def add_citation_network():
+def add_citation_network(fetch_size=10000):
     pprs_preprocessed_fn = cg_config.graph_pprs_fn
     graph_data_dir = cg_config.graph_data_dir
     cit_fn = cg_config.graph_ppr_to_ppr_fn
@@ -31,33 +31,40 @@ def add_citation_network():
             ppr = json.loads(line)
             if ppr['arxiv_id'] is not None:
                 arxiv_id_to_pwc_id[ppr['arxiv_id']] = ppr['id']
-    pwc_arxiv_ids = set(arxiv_id_to_pwc_id.keys())
+    # citing/cited IDs in unarXive are either canonical or have the
+    # slash of old arXiv IDs removed (see canonicalize_arxiv_id). list
+    # both forms of relevant IDs so that matching happens inside SQLite
+    aliases = dict()
+    for aid, pwc_id in arxiv_id_to_pwc_id.items():
+        for raw_aid in [aid, aid.replace('/', '', 1)]:
+            if canonicalize_arxiv_id(raw_aid) == aid:
+                aliases[raw_aid] = (aid, pwc_id)
 
     # fetch citations from unarXive inside relevant arXiv IDs
     db_con = sqlite3.connect(unarXive_db_path)
     db_cur = db_con.cursor()
+    db_cur.execute('''
+        create temp table pwc_arxiv_id (
+            raw_arxiv_id text primary key,
+            arxiv_id text not null,
+            pwc_id text not null
+        )
+    ''')
+    db_cur.executemany(
+        'insert into pwc_arxiv_id values (?, ?, ?)',
+        ((raw_aid, aid, pwc_id) for raw_aid, (aid, pwc_id) in aliases.items())
+    )
     db_cur.execute('''
         select
-            citing_arxiv_id, cited_arxiv_id, uuid
+            citing.arxiv_id, cited.arxiv_id, bibitem.uuid,
+            citing.pwc_id, cited.pwc_id
         from
             bibitem
-        where
-            citing_arxiv_id not null and cited_arxiv_id not null
+            join pwc_arxiv_id as citing
+                on bibitem.citing_arxiv_id = citing.raw_arxiv_id
+            join pwc_arxiv_id as cited
+                on bibitem.cited_arxiv_id = cited.raw_arxiv_id
     ''')
-    citation_edges = []
-    for row in db_cur:
-        aid_citing = canonicalize_arxiv_id(row[0])
-        aid_cited = canonicalize_arxiv_id(row[1])
-        uuid_citmarker = row[2]
-
-        if aid_citing in pwc_arxiv_ids and aid_cited in pwc_arxiv_ids:
-            citation_edges.append([
-                aid_citing,
-                aid_cited,
-                uuid_citmarker,
-                arxiv_id_to_pwc_id[aid_citing],
-                arxiv_id_to_pwc_id[aid_cited]
-            ])
 
     # write to file
     with open(os.path.join(graph_data_dir, cit_fn), 'w') as f:
@@ -73,5 +80,9 @@ def add_citation_network():
             'citing_pwc_id',
             'cited_pwc_id'
         ])
-        for edge in citation_edges:
-            csv_writer.writerow(edge)
+        while True:
+            rows = db_cur.fetchmany(fetch_size)
+            if len(rows) == 0:
+                break
+            csv_writer.writerows(rows)
+    db_con.close()
@@ -1,47 +1,538 @@
+""" Crawl the papers using each data set from the PWC API
+
+    Data sets are crawled concurrently (bounded by a semaphore), with
+    all requests going through a shared token bucket rate limiter.
+    Blocking requests calls are run in a thread pool, each worker
+    thread with a pooled HTTP session of its own (requests sessions
+    are not thread safe).
+
+    Each finished data set is appended to a JSONL journal (and
+    fsynced), which is replayed when restarting an interrupted crawl
+    and compacted into the final JSON file at the end.
+
+    Data set IDs scraped from data set pages are cached. API responses
+    with an ETag or Last-Modified header are requested conditionally;
+    their validators are journaled and their bodies stored in content
+    addressed files. An incremental crawl only refetches data sets that
+    are new or whose number of papers changed.
+"""
+
+import asyncio
+import hashlib
 import os
 import json
 import random
 import re
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from contextgraph import config as cg_config
 
 
-def _get_dataset_id(url, dataset_id_patt):
-    ret = requests.get(url)
-    m = dataset_id_patt.search(ret.text)
+# HTTP status codes of responses worth retrying
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class _TokenBucket:
+    """ Rate limiter allowing on average rate requests per second,
+        with bursts of up to capacity requests.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.last) * self.rate
+                )
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _ThreadSessions:
+    """ One requests session per thread, all of which are closed when
+        leaving the context.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sessions = []
+
+    def get(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self.local.session = session
+            with self.lock:
+                self.sessions.append(session)
+        return session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.lock:
+            for session in self.sessions:
+                session.close()
+            self.sessions = []
+
+
+class _Fetcher:
+    """ Rate limited GET requests with exponential backoff retries.
+
+        If base_url is given, URLs starting with
+        cg_config.pwc_base_url are redirected to it (e.g. to crawl from
+        a local stand-in server).
+
+        Responses with an ETag or Last-Modified header are requested
+        conditionally the next time. Their validators are kept in
+        http_cache (and appended to the journal http_cache_f), their
+        bodies in files in http_cache_dir named after their SHA-1
+        digest.
+    """
+
+    def __init__(
+        self,
+        sessions,
+        executor,
+        rate_limiter,
+        max_retries,
+        backoff_base,
+        timeout,
+        base_url=None,
+        http_cache=None,
+        http_cache_f=None,
+        http_cache_dir=None
+    ):
+        self.sessions = sessions
+        self.executor = executor
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self.base_url = base_url
+        self.http_cache = http_cache if http_cache is not None else dict()
+        self.http_cache_f = http_cache_f
+        self.http_cache_dir = http_cache_dir
+
+    def _rebase(self, url):
+        if self.base_url is not None and \
+                url.startswith(cg_config.pwc_base_url):
+            return self.base_url + url[len(cg_config.pwc_base_url):]
+        return url
+
+    def _session_get(self, url, headers):
+        # run in a worker thread, using that thread’s own session
+        return self.sessions.get().get(
+            url,
+            headers=headers,
+            timeout=self.timeout
+        )
+
+    def _body_fp(self, digest):
+        return os.path.join(self.http_cache_dir, f'{digest}.txt')
+
+    def _conditional_headers(self, url):
+        cached = self.http_cache.get(url)
+        headers = dict()
+        # only ask for a 304 if the body is at hand
+        if cached is not None and \
+                os.path.isfile(self._body_fp(cached['body'])):
+            if cached['etag'] is not None:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified'] is not None:
+                headers['If-Modified-Since'] = cached['last_modified']
+        return headers
+
+    def _response_text(self, url, resp):
+        if resp.status_code == 304 and url in self.http_cache:
+            body_fp = self._body_fp(self.http_cache[url]['body'])
+            with open(body_fp, encoding='utf-8') as f:
+                return f.read()
+        etag = resp.headers.get('ETag')
+        last_modified = resp.headers.get('Last-Modified')
+        if resp.status_code == 200 and (etag or last_modified) and \
+                self.http_cache_f is not None:
+            text = resp.text
+            digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+            body_fp = self._body_fp(digest)
+            if not os.path.isfile(body_fp):
+                with open(body_fp + '.tmp', 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(body_fp + '.tmp', body_fp)
+            record = {
+                'url': url,
+                'etag': etag,
+                'last_modified': last_modified,
+                'body': digest
+            }
+            self.http_cache[url] = record
+            _append_to_journal(self.http_cache_f, record, fsync=False)
+        return resp.text
+
+    async def get(self, url, cache=True):
+        """ Return the text of the response to a GET request. If cache
+            is False, the request is never conditional and the response
+            not cached.
+        """
+
+        if cache:
+            headers = self._conditional_headers(url)
+        else:
+            headers = dict()
+        cache_url = url
+        url = self._rebase(url)
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire()
+            delay = self.backoff_base * 2**attempt * (1 + random.random())
+            try:
+                resp = await loop.run_in_executor(
+                    self.executor,
+                    partial(self._session_get, url, headers)
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f'\t{e.__class__.__name__} for {url}, retrying')
+            else:
+                if resp.status_code not in RETRY_STATUS_CODES or \
+                        attempt == self.max_retries:
+                    if not cache:
+                        return resp.text
+                    return self._response_text(cache_url, resp)
+                print(f'\tstatus {resp.status_code} for {url}, retrying')
+                retry_after = resp.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            await asyncio.sleep(delay)
+
+
+async def _get_dataset_id(fetcher, url, dataset_id_patt):
+    # pages are not cached, the scraped ID is (see _crawl_dataset)
+    ret = await fetcher.get(url, cache=False)
+    m = dataset_id_patt.search(ret)
     if not m:
         return False
     return m.group(1)
 
 
-def _get_dataset_papers(api_base_url, did):
+async def _get_dataset_papers(fetcher, api_base_url, did):
     paper_dict_list = []
     start_url = f'{api_base_url}{did}'
     # first results page
-    ret = requests.get(start_url).json()
+    ret = json.loads(await fetcher.get(start_url))
     ppr_count = ret.get('count', 0)
-    print(f'\tretrieving data of {ppr_count} papers')
     paper_dict_list.extend(ret.get('results', []))
     next_url = ret.get('next', None)
     # further result pages
     while next_url is not None:
-        ret = requests.get(next_url).json()
+        ret = json.loads(await fetcher.get(next_url))
         paper_dict_list.extend(ret.get('results', []))
         next_url = ret.get('next', None)
-        print(f'\t{ppr_count - len(paper_dict_list)} to go')
-        time.sleep(random.randint(3, 11)/10)
+    print(f'\tretrieved data of {ppr_count} papers')
     return paper_dict_list
 
 
-def crawl_dataset_papers():
-    checkpoint_fn = 'datasets_ext_lastcheckpoint.json'
-    checkpoint_interval = 100
+async def _crawl_dataset(
+    fetcher,
+    semaphore,
+    dataset,
+    dataset_id_patt,
+    api_base_url,
+    dataset_ids,
+    dataset_ids_f
+):
+    """ Return the data set extended with using papers, or None if
+        its ID could not be determined.
+    """
+
+    async with semaphore:
+        print('-=[{}]=-'.format(dataset['name']))
+        # retrieve ID for API query (scraped once, then cached)
+        dataset_id = dataset_ids.get(dataset['url'])
+        if dataset_id is None:
+            dataset_id = await _get_dataset_id(
+                fetcher,
+                dataset['url'],
+                dataset_id_patt
+            )
+            if not dataset_id:
+                return None
+            dataset_ids[dataset['url']] = dataset_id
+            _append_to_journal(
+                dataset_ids_f,
+                {'url': dataset['url'], 'dataset_id': dataset_id},
+                fsync=False
+            )
+        dataset_ext = dataset.copy()
+        # extend with using papers
+        dataset_ext['using_papers'] = await _get_dataset_papers(
+            fetcher,
+            api_base_url,
+            dataset_id
+        )
+        return dataset_ext
+
+
+def _replay_journal(journal_fp):
+    """ Return the records of a JSONL journal as a dict (URL to last
+        record of the URL). An incomplete last record (e.g. after a
+        crash during writing) is dropped from the file.
+    """
+
+    records = dict()
+    if not os.path.isfile(journal_fp):
+        return records
+    with open(journal_fp, 'rb+') as f:
+        journal = f.read()
+        complete_len = journal.rfind(b'\n') + 1
+        if complete_len < len(journal):
+            f.truncate(complete_len)
+    for line in journal[:complete_len].splitlines():
+        record = json.loads(line)
+        records[record['url']] = record
+    return records
+
+
+def _append_to_journal(journal_f, record, fsync=True):
+    """ Append a record to a JSONL journal and (if fsync is True)
+        make sure it is on disk.
+    """
+
+    journal_f.write(json.dumps(record) + '\n')
+    journal_f.flush()
+    if fsync:
+        os.fsync(journal_f.fileno())
+
+
+def _write_journal(journal_fp, records):
+    """ Replace a JSONL journal with the given records (e.g. to drop
+        outdated records of the same URL).
+    """
+
+    tmp_fp = journal_fp + '.tmp'
+    with open(tmp_fp, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_fp, journal_fp)
+
+
+def _compact_journal(datasets, datasets_ext, out_fp):
+    """ Write journaled data sets as a single JSON list (in the order
+        of datasets) to out_fp.
+    """
+
+    dataset_ext_list = [
+        datasets_ext[dataset['url']] for dataset in datasets
+        if dataset['url'] in datasets_ext
+    ]
+    # data sets that are no longer part of datasets go last
+    dataset_urls = set(dataset['url'] for dataset in datasets)
+    dataset_ext_list.extend(
+        dataset_ext for url, dataset_ext in datasets_ext.items()
+        if url not in dataset_urls
+    )
+    tmp_fp = out_fp + '.tmp'
+    with open(tmp_fp, 'w') as f:
+        json.dump(dataset_ext_list, f)
+    os.replace(tmp_fp, out_fp)
+
+
+def _current_datasets_ext(datasets, prev_ext_fp, journaled):
+    """ Return the extended data sets of a previous crawl
+        (prev_ext_fp, updated by journaled ones) that are still
+        current, i.e. in datasets with an unchanged num_papers. Their
+        data set information is taken from datasets.
+    """
+
+    prev_datasets_ext = dict()
+    if os.path.isfile(prev_ext_fp):
+        with open(prev_ext_fp) as f:
+            for dataset_ext in json.load(f):
+                prev_datasets_ext[dataset_ext['url']] = dataset_ext
+    prev_datasets_ext.update(journaled)
+    datasets_ext = dict()
+    for dataset in datasets:
+        prev = prev_datasets_ext.get(dataset['url'])
+        if prev is None or \
+                prev.get('num_papers') != dataset.get('num_papers'):
+            continue
+        datasets_ext[dataset['url']] = dict(
+            dataset,
+            using_papers=prev['using_papers']
+        )
+    print(
+        f'{len(datasets_ext)} of {len(datasets)} data sets unchanged, '
+        f'{len(datasets) - len(datasets_ext)} to crawl'
+    )
+    return datasets_ext
+
+
+async def _crawl_datasets(
+    datasets,
+    datasets_ext,
+    journal_f,
+    dataset_ids_fp,
+    http_cache_fp,
+    http_cache_dir,
+    base_url,
+    concurrency,
+    requests_per_second,
+    max_retries,
+    backoff_base,
+    timeout
+):
+    """ Crawl all data sets not yet in datasets_ext, adding each to
+        datasets_ext and the journal as soon as it is finished.
+
+        Data set IDs and response validators are cached in the
+        journals at dataset_ids_fp and http_cache_fp, response bodies
+        in http_cache_dir.
+    """
+
     dataset_id_patt = re.compile(
         r'^\s*const\s*DATATABLE_PAPERS_FILTER_VALUE\s*=\s*\'(\d+)\';\s*$',
         re.M
     )
     api_base_url = cg_config.pwc_api_base_url
+    semaphore = asyncio.Semaphore(concurrency)
+    todo = []
+    for dataset in datasets:
+        if dataset['url'] in datasets_ext:
+            print('-=[{}]=- already done. skipping ...'.format(
+                dataset['name']
+            ))
+            continue
+        todo.append(dataset)
+
+    dataset_ids = {
+        url: record['dataset_id']
+        for url, record in _replay_journal(dataset_ids_fp).items()
+    }
+    http_cache = {
+        url: record
+        for url, record in _replay_journal(http_cache_fp).items()
+        # (records with the whole body were written by earlier versions)
+        if 'body' in record
+    }
+    # drop outdated validators and bodies of previous crawls
+    _write_journal(http_cache_fp, http_cache.values())
+    os.makedirs(http_cache_dir, exist_ok=True)
+    body_fns = set(f'{record["body"]}.txt' for record in http_cache.values())
+    for fn in os.listdir(http_cache_dir):
+        if fn not in body_fns:
+            os.remove(os.path.join(http_cache_dir, fn))
+
+    errors = []
+    with _ThreadSessions() as sessions, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor, \
+            open(dataset_ids_fp, 'a') as dataset_ids_f, \
+            open(http_cache_fp, 'a') as http_cache_f:
+        fetcher = _Fetcher(
+            sessions,
+            executor,
+            _TokenBucket(requests_per_second),
+            max_retries,
+            backoff_base,
+            timeout,
+            base_url=base_url,
+            http_cache=http_cache,
+            http_cache_f=http_cache_f,
+            http_cache_dir=http_cache_dir
+        )
+        tasks = [
+            asyncio.ensure_future(_crawl_dataset(
+                fetcher,
+                semaphore,
+                dataset,
+                dataset_id_patt,
+                api_base_url,
+                dataset_ids,
+                dataset_ids_f
+            ))
+            for dataset in todo
+        ]
+        for task in asyncio.as_completed(tasks):
+            try:
+                dataset_ext = await task
+            except Exception as e:
+                errors.append(e)
+                continue
+            if dataset_ext is not None:
+                _append_to_journal(journal_f, dataset_ext)
+                datasets_ext[dataset_ext['url']] = dataset_ext
+
+    if errors:
+        print(
+            f'{len(errors)} data sets failed (finished ones are '
+            f'journaled, rerun to continue)'
+        )
+        raise errors[0]
+
+
+def crawl_dataset_papers(
+    base_url=None,
+    concurrency=None,
+    requests_per_second=None,
+    max_retries=None,
+    backoff_base=1,
+    timeout=60,
+    incremental=False
+):
+    """ Extend the PWC data sets with the papers using them (retrieved
+        from the PWC API) and save them as cg_config.pwc_dsets_ext_fn.
+        Progress is journaled in datasets_ext_journal.jsonl, so that
+        rerunning after an interruption only crawls unfinished data
+        sets.
+
+        incremental: if True, update the data sets of a previous crawl
+                     (i.e. the existing cg_config.pwc_dsets_ext_fn and
+                     journal) to a new datasets.json. Only data sets
+                     that are new or whose num_papers changed are
+                     crawled, others keep their using papers. Data sets
+                     no longer in datasets.json are dropped.
+
+        base_url: replaces cg_config.pwc_base_url in all requested URLs
+                  (e.g. http://localhost:8000 for a stand-in server)
+        concurrency: maximum number of data sets crawled at once
+                     (default: cg_config.pwc_crawl_concurrency)
+        requests_per_second: global request rate limit (default:
+                             cg_config.pwc_crawl_requests_per_second)
+        max_retries: retries of failed requests (connection errors and
+                     status codes in RETRY_STATUS_CODES), waiting
+                     backoff_base * 2^attempt seconds (plus jitter)
+                     (default: cg_config.pwc_crawl_max_retries)
+    """
+
+    if concurrency is None:
+        concurrency = cg_config.pwc_crawl_concurrency
+    if requests_per_second is None:
+        requests_per_second = cg_config.pwc_crawl_requests_per_second
+    if max_retries is None:
+        max_retries = cg_config.pwc_crawl_max_retries
+
+    journal_fn = 'datasets_ext_journal.jsonl'
+    legacy_checkpoint_fn = 'datasets_ext_lastcheckpoint.json'
+    dataset_ids_fn = 'datasets_ext_ids.jsonl'
+    http_cache_fn = 'datasets_ext_http_cache.jsonl'
+    http_cache_dn = 'datasets_ext_http_cache'
 
     with open(os.path.join(
         cg_config.pwc_data_dir,
@@ -49,50 +540,52 @@ def crawl_dataset_papers():
     )) as f:
         datasets = json.load(f)
 
-    # incremental crawling if start checkpoint is given
-    start_fp = os.path.join(cg_config.pwc_data_dir, checkpoint_fn)
-    if os.path.isfile(start_fp):
-        print(f'starting from checkpoint "{start_fp}"')
-        with open(start_fp) as f:
-            datasets_ext = json.load(f)
-    else:
+    # incremental crawling if a journal (or old style checkpoint) exists
+    journal_fp = os.path.join(cg_config.pwc_data_dir, journal_fn)
+    legacy_checkpoint_fp = os.path.join(
+        cg_config.pwc_data_dir,
+        legacy_checkpoint_fn
+    )
+    datasets_ext = dict()
+    if os.path.isfile(journal_fp):
+        print(f'replaying journal "{journal_fp}"')
+        datasets_ext = _replay_journal(journal_fp)
+    if os.path.isfile(legacy_checkpoint_fp):
+        # migrate into the journal (journaled data sets are newer)
+        print(f'migrating checkpoint "{legacy_checkpoint_fp}"')
+        with open(legacy_checkpoint_fp) as f:
+            legacy_datasets_ext = json.load(f)
+        legacy_datasets_ext.update(datasets_ext)
+        datasets_ext = legacy_datasets_ext
+        _write_journal(journal_fp, datasets_ext.values())
+        os.remove(legacy_checkpoint_fp)
+    ext_fp = os.path.join(cg_config.pwc_data_dir, cg_config.pwc_dsets_ext_fn)
+    if incremental:
+        datasets_ext = _current_datasets_ext(datasets, ext_fp, datasets_ext)
+    if len(datasets_ext) == 0:
         print('starting without checkpoint')
-        datasets_ext = dict()
 
     # go through all data sets
-    for i, dataset in enumerate(datasets):
-        print('-=[{}]=-'.format(dataset['name']))
-        dataset_url = dataset['url']
-        if dataset_url in datasets_ext:
-            print('already done. skipping ...')
-            continue
-        # retrieve ID for API query
-        dataset_id = _get_dataset_id(dataset_url, dataset_id_patt)
-        if not dataset_id:
-            continue
-        datasets_ext[dataset_url] = dataset.copy()
-        # extend with using papers
-        datasets_ext[dataset_url]['using_papers'] = _get_dataset_papers(
-            api_base_url,
-            dataset_id
-        )
-        # behave
-        time.sleep(random.randint(7, 27)/10)
-        # save checkpoint
-        if checkpoint_interval > 0 and i % checkpoint_interval == 0:
-            print('saving checkpoint')
-            with open(
-                os.path.join(cg_config.pwc_data_dir, checkpoint_fn),
-                'w'
-            ) as f:
-                json.dump(datasets_ext, f)
-
-    # convert from dict to list
-    dataset_ext_list = list(datasets_ext.values())
-    with open(
-        os.path.join(cg_config.pwc_data_dir, cg_config.pwc_dsets_ext_fn),
-        'w'
-    ) as f:
-        json.dump(dataset_ext_list, f)
+    with open(journal_fp, 'a') as journal_f:
+        asyncio.run(_crawl_datasets(
+            datasets,
+            datasets_ext,
+            journal_f,
+            os.path.join(cg_config.pwc_data_dir, dataset_ids_fn),
+            os.path.join(cg_config.pwc_data_dir, http_cache_fn),
+            os.path.join(cg_config.pwc_data_dir, http_cache_dn),
+            base_url,
+            concurrency,
+            requests_per_second,
+            max_retries,
+            backoff_base,
+            timeout
+        ))
+
+    # compact journal into a single list
+    _compact_journal(datasets, datasets_ext, ext_fp)
+    # drop records of data sets that were crawled again or are no
+    # longer part of the output
+    _write_journal(journal_fp, datasets_ext.values())
 
     print('done')
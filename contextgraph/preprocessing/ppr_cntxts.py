@@ -8,14 +8,19 @@
 """
 
 import csv
+import hashlib
+import multiprocessing
 import os
 import json
 import re
 import regex
+from regex._regex import fold_case as regex_fold_case
+import shutil
 from collections import OrderedDict
 from functools import lru_cache
 import contextgraph.config as cg_config
 import numpy as np
+from contextgraph.util.aho_corasick import AhoCorasick
 # import nltk
 # from nltk.tokenize import sent_tokenize
 # nltk.download('punkt')
@@ -94,6 +99,154 @@ def _get_context_by_sent(passage, entity_name, num_pre=1, num_suc=1):
     return context
 
 
+# common words but distinguishable by matching case sensitive
+naughty_entity_names = [
+    'ZeRO', 'Cell', 'ReCoRD', 'Inspired', 'MaSS', 'MuTual', 'IntrA',
+    'Sketch', 'Letter', 'Digits', 'VOICe', 'HoME', 'Places', 'BiRD',
+    'Shifts', 'Finer', 'AND Dataset', 'Electricity', 'Atlas', 'Replica',
+    'GlaS', 'eSCAPE', 'ExPose', 'Torque', 'Finer'
+]
+# common words not even distinguishable when matching case sensitive
+super_naughty_entity_names = [
+    'Google', 'seeds', 'iris', 'SSL', 'E-commerce', 'ACM'
+]
+
+
+@lru_cache(maxsize=None)
+def _get_match_flags(entity_name):
+    """ Return the regex flags to match an entity name with, or None
+        if the entity name should not be matched at all.
+    """
+
+    # skip the few two character entities that do not
+    # include numbers (i.e. not T5)
+    if len(entity_name) < 3 and not re.search(r'\d', entity_name):
+        return None
+    # skip overly ambiguous entity names
+    if entity_name in super_naughty_entity_names:
+        return None
+    # try to match as much as possible case insensitive
+    if re.search(r'\d', entity_name):
+        return re.I  # insensitive if there's a number in it
+    elif (
+        # match case sensitive if all upper case (NICE, SECOND)
+        entity_name.upper() == entity_name or
+        # entity names that resemble common words (ZeRO, ReCoRD)
+        entity_name in naughty_entity_names
+    ):
+        return 0
+    return re.I
+
+
+@lru_cache(maxsize=None)
+def _get_compiled_regex_patt(entity_name, flags):
+    return regex.compile(
+        (
+         r'(?<=\W)'  # expect a preceding non-word character
+         r'({})'     # the entity name itself
+         r'(?=(\W|s\W|ed\W))'  # expect a succeeding non-word character or
+        ).format(re.escape(entity_name)),  # #                 s\W or ed\W
+        flags
+    )
+
+
+@lru_cache(maxsize=None)
+def _is_non_word_char(char):
+    return regex.match(r'\W', char) is not None
+
+
+# regex matches I and i with dotless ı and dotted İ respectively, but not
+# ı with i or İ with I, so no case fold of single characters is the same
+# for exactly the characters regex matches with each other
+_FOLD_TURKIC_I = str.maketrans({'I': 'i', 'İ': 'i', 'ı': 'i'})
+
+
+def _fold_case(text):
+    """ Case fold text without changing character offsets, using the
+        simple case folding of the regex module’s case insensitive
+        matching (e.g. K → k, ſ → s, Σ → σ) plus folding I, İ and ı
+        to i (which matches more than regex does, see _EntityMatcher).
+    """
+
+    return regex_fold_case(regex.I, text).translate(_FOLD_TURKIC_I)
+
+
+def _has_turkic_i(text):
+    return 'İ' in text or 'ı' in text
+
+
+class _EntityMatcher:
+    """ Find entity names in a text in a single pass using an
+        Aho–Corasick automaton over all names.
+
+        Yields the same matches as _get_compiled_regex_patt(name, flags)
+        would for each (name, flags) pair individually, i.e. it applies
+        the same case sensitivity and the same boundary rules (preceded
+        by a non-word character, followed by a non-word character
+        optionally after an "s" or "ed"). Case insensitive matching
+        compares case folded names and texts (see _fold_case); the few
+        such matches involving İ or ı are verified with regex itself.
+    """
+
+    def __init__(self, names_and_flags):
+        self.keys = sorted(set(names_and_flags))
+        # case insensitive automaton, case sensitive
+        # matches are verified against the original text
+        self.automaton = AhoCorasick(
+            [_fold_case(name) for (name, flags) in self.keys]
+        )
+
+    def _boundaries_ok(self, text, text_cmp, start, end):
+        if start == 0 or not _is_non_word_char(text[start-1]):
+            return False
+        for suffix in ['', 's', 'ed']:
+            boundary_pos = end + len(suffix)
+            if boundary_pos < len(text) and \
+                    text_cmp[end:boundary_pos] == suffix and \
+                    _is_non_word_char(text[boundary_pos]):
+                return True
+        return False
+
+    def find(self, text):
+        """ Return a dict mapping (name, flags) to a list of
+            (<start>, <end>) offsets of non overlapping matches.
+        """
+
+        text_folded = _fold_case(text)
+        spans = dict()
+        for (start, end, key_idx) in self.automaton.iter_matches(
+            text_folded
+        ):
+            name, flags = self.keys[key_idx]
+            if flags & re.I:
+                text_cmp = text_folded
+                if _has_turkic_i(name) or _has_turkic_i(text[start:end]):
+                    patt_match = _get_compiled_regex_patt(
+                        name,
+                        flags
+                    ).match(text, start)
+                    if patt_match is None or \
+                            patt_match.span(1) != (start, end):
+                        continue
+            else:
+                text_cmp = text
+                if text[start:end] != name:
+                    continue
+            if self._boundaries_ok(text, text_cmp, start, end):
+                spans.setdefault(key_idx, []).append((start, end))
+        matches = dict()
+        for key_idx, key_spans in spans.items():
+            # like finditer, skip matches overlapping a previous one
+            key_matches = []
+            last_end = -1
+            for (start, end) in sorted(key_spans):
+                if start >= last_end:
+                    key_matches.append((start, end))
+                    last_end = end
+            matches[self.keys[key_idx]] = key_matches
+        return matches
+
+
 def _generate_context_id(ppr_id, e_name, cntxt_start, cntxt_end):
     return 'uxv:context/{}-{}-{}-{}'.format(
         ppr_id,
@@ -103,12 +256,263 @@ def _generate_context_id(ppr_id, e_name, cntxt_start, cntxt_end):
     )
 
 
-def add_paper_contexts(verbose=False, mentioned_contexts=False):
+def _get_paper_text_fp(ppr, unarxive_paper_dir):
+    paper_fn_id = ppr['arxiv_id'].replace('/', '')
+    paper_fn = f'{paper_fn_id}.txt'
+    return os.path.join(unarxive_paper_dir, paper_fn)
+
+
+def _get_paper_contexts(ppr, state):
+    """ Yield (<is used context>, <context entity>) tuples for all
+        entity matches in the given paper’s plaintext.
+
+        state is a dict of the entities, entity-paper links and
+        settings as prepared in add_paper_contexts.
+    """
+
+    # get entities to match
+    ppr_meths = [
+        state['meths_dict'][mid]
+        for mid in state['pprs_to_meths'].get(ppr['id'], [])
+    ]
+    ppr_dsets = [
+        state['dsets_dict'][did]
+        for did in state['pprs_to_dsets'].get(ppr['id'], [])
+    ]
+    ppr_tasks = [
+        state['tasks_dict'][tid]
+        for tid in state['pprs_to_tasks'].get(ppr['id'], [])
+    ]
+    ppr_modls = [
+        state['modls_dict'][mid]
+        for mid in state['pprs_to_modls'].get(ppr['id'], [])
+    ]
+
+    # get plaintext
+    paper_path = _get_paper_text_fp(ppr, state['unarXive_paper_dir'])
+    if not os.path.isfile(paper_path):
+        return
+    with open(paper_path) as f:
+        paper_text = f.read()
+
+    if state['mentioned_contexts']:
+        entity_types = {
+            'method_used': ppr_meths,
+            'dataset_used': ppr_dsets,
+            'task_used': ppr_tasks,
+            'model_used': ppr_modls,
+            'method': state['meths_list'],
+            'dataset': state['dsets_list'],
+            'task': state['tasks_list'],
+            'model': state['modls_list'],
+        }
+    else:
+        entity_types = {
+            'method_used': ppr_meths,
+            'dataset_used': ppr_dsets,
+            'task_used': ppr_tasks,
+            'model_used': ppr_modls,
+        }
+
+    if state['mentioned_contexts']:
+        ppr_matches = state['entity_matcher'].find(paper_text)
+
+    # go through all entities (1) of the paper and (2) in all of pwc
+    for etype, entities in entity_types.items():
+        for entity in entities:
+            # try to match as much as possible case insensitive
+            # (see _get_match_flags for entity names that are skipped
+            #  or matched case sensitive)
+            regex_flags = _get_match_flags(entity['name'])
+            if regex_flags is None:
+                continue
+            if state['mentioned_contexts']:
+                entity_matches = ppr_matches.get(
+                    (entity['name'], regex_flags),
+                    []
+                )
+            else:
+                # only few entities per paper, matching
+                # them individually is faster
+                patt = _get_compiled_regex_patt(
+                    entity['name'],
+                    regex_flags
+                )
+                entity_matches = [
+                    m.span() for m in patt.finditer(paper_text)
+                ]
+            for (entity_offset_start, entity_offset_end) in \
+                    entity_matches:
+                # FIXME: _get_context_by_sent throws errors
+                # context_offset_start = max(
+                #     entity_offset_start-LENGTH_OF_LETTERS,
+                #     0
+                # )
+                # context_offset_end = min(
+                #     entity_offset_end+LENGTH_OF_LETTERS,
+                #     len(paper_text)
+                # )
+                # context_passage = paper_text[
+                #     context_offset_start:context_offset_end
+                # ]
+                # context = _get_context_by_sent(context_passage, m.group(0))
+                context_offset_start = max(
+                    entity_offset_start-100,
+                    0
+                )
+                context_offset_end = min(
+                    entity_offset_end+100,
+                    len(paper_text)
+                )
+                context = paper_text[
+                    context_offset_start:context_offset_end
+                ]
+                # create new context entity
+                context_entity = {
+                    'id': _generate_context_id(
+                        ppr['arxiv_id'],
+                        entity['name'],
+                        context_offset_start,
+                        context_offset_end
+                    ),
+                    'type': 'context',
+                    'paper_arxiv_id': ppr['arxiv_id'],
+                    'paper_pwc_id': ppr['id'],
+                    'entity_id': entity['id'],
+                    'entity_offset_in_context': [
+                        # FIXME: try making this shallow (separate
+                        # attribs for start and end) and see if it
+                        # fixes cytoscape import from JSON
+                        entity_offset_start-context_offset_start,
+                        entity_offset_end-context_offset_end
+                     ],
+                    'entity_offset_in_paper': [
+                        entity_offset_start,
+                        entity_offset_end
+                     ],
+                    'context_offset_in_paper': [
+                        context_offset_start,
+                        context_offset_end
+                     ],
+                    'context': context
+                }
+                yield ('_used' in etype, context_entity)
+
+
+def _init_context_worker(state):
+    global _context_worker_state
+    _context_worker_state = state
+
+
+def _process_context_shard(shard):
+    """ Write the contexts of a shard of papers to its own pair
+        of shard files and return the shard index.
+
+        Contexts are streamed to temporary files which are only
+        renamed once the shard is complete, so a shard either
+        exists in full or not at all.
+    """
+
+    shard_idx, shard_pprs = shard
+    state = _context_worker_state
+    used_fp, mentioned_fp = _get_context_shard_fps(
+        state['shard_dir'],
+        shard_idx
+    )
+    with open(used_fp + '.tmp', 'w') as f_used, \
+            open(mentioned_fp + '.tmp', 'w') as f_mentioned:
+        for ppr in shard_pprs:
+            for (is_used, context) in _get_paper_contexts(ppr, state):
+                f = f_used if is_used else f_mentioned
+                json.dump(context, f)
+                f.write('\n')
+    # used contexts file is renamed last and marks the shard as done
+    os.replace(mentioned_fp + '.tmp', mentioned_fp)
+    os.replace(used_fp + '.tmp', used_fp)
+    return shard_idx
+
+
+def _get_context_shard_fps(shard_dir, shard_idx):
+    return (
+        os.path.join(shard_dir, f'contexts_used.{shard_idx:06d}.jsonl'),
+        os.path.join(shard_dir, f'contexts_mentioned.{shard_idx:06d}.jsonl')
+    )
+
+
+def _get_file_stat(fp):
+    try:
+        stat = os.stat(fp)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _get_input_fingerprint(graph_data_dir, unarxive_paper_dir, pprs):
+    """ Return a digest of the sizes and modification times of all
+        input files, i.e. the PwC papers, entities and entity-paper
+        links as well as the unarXive plain texts of the papers.
+    """
+
+    # files read by _load_pwc_arxiv_papers, _load_pwc_entities
+    # and _load_pwc_entity_links
+    pwc_fns = [
+        'papers.jsonl',
+        'methods.jsonl',
+        'datasets.jsonl',
+        'tasks.jsonl',
+        'models.jsonl',
+        'methods_to_papers.csv',
+        'datasets_to_papers.csv',
+        'tasks_to_papers.csv',
+        'models_to_papers.csv'
+    ]
+    digest = hashlib.sha1()
+    for fn in pwc_fns:
+        fp = os.path.join(graph_data_dir, fn)
+        digest.update(json.dumps([fn, _get_file_stat(fp)]).encode())
+    for ppr in pprs:
+        fp = _get_paper_text_fp(ppr, unarxive_paper_dir)
+        digest.update(
+            json.dumps([os.path.basename(fp), _get_file_stat(fp)]).encode()
+        )
+    return digest.hexdigest()
+
+
+def _prepare_context_shard_dir(shard_dir, shard_params):
+    """ Make sure shard_dir exists and only contains shards
+        created with the given parameters.
+    """
+
+    params_fp = os.path.join(shard_dir, 'params.json')
+    if os.path.isfile(params_fp):
+        with open(params_fp) as f:
+            if json.load(f) == shard_params:
+                return
+    # shards from a run with different parameters (or none at all)
+    if os.path.isdir(shard_dir):
+        shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir)
+    with open(params_fp, 'w') as f:
+        json.dump(shard_params, f)
+
+
+def add_paper_contexts(
+    verbose=False,
+    mentioned_contexts=False,
+    num_workers=1,
+    shard_size=1000
+):
     """ Match entities from Papers With Code in unarXive paper plaintexts.
+
+        Papers are processed in shards of shard_size papers, using
+        num_workers processes. Each shard’s contexts are streamed to
+        separate files in a shard directory and merged in paper order
+        once all shards are done, so the output does not depend on
+        num_workers. Completed shards are kept when a run is
+        interrupted and skipped when it is restarted.
     """
 
     graph_data_dir = cg_config.graph_data_dir
-    unarXive_paper_dir = cg_config.unarxive_paper_dir
 
     # load papers to search in
     pwc_arxiv_pprs = _load_pwc_arxiv_papers(graph_data_dir)
@@ -116,10 +520,10 @@ def add_paper_contexts(verbose=False, mentioned_contexts=False):
     meths_dict, dsets_dict, tasks_dict, modls_dict = _load_pwc_entities(
         graph_data_dir
     )
-    meths_list = meths_dict.values()
-    dsets_list = dsets_dict.values()
-    tasks_list = tasks_dict.values()
-    modls_list = modls_dict.values()
+    meths_list = list(meths_dict.values())
+    dsets_list = list(dsets_dict.values())
+    tasks_list = list(tasks_dict.values())
+    modls_list = list(modls_dict.values())
     # load links
     pprs_to_meths, \
         pprs_to_dsets, \
@@ -127,9 +531,8 @@ def add_paper_contexts(verbose=False, mentioned_contexts=False):
         pprs_to_modls = _load_pwc_entity_links(graph_data_dir)
     # output
     contexts_used_fn = 'contexts_used.jsonl'
-    contexts_used = []
     contexts_mentioned_fn = 'contexts_mentioned.jsonl'
-    contexts_mentioned = []
+    shard_dir = os.path.join(graph_data_dir, 'contexts_shards')
 
     if verbose:
         print(f'{len(pwc_arxiv_pprs):,} papers to get contexts from')
@@ -142,172 +545,91 @@ def add_paper_contexts(verbose=False, mentioned_contexts=False):
         print(f'tasks-paper links for {len(pprs_to_tasks):,} papers')
         print(f'model-paper links for {len(pprs_to_modls):,} papers')
 
-    @lru_cache(maxsize=None)
-    def get_compiled_regext_patt(entity_name, flags):
-        return regex.compile(
-            (
-             r'(?<=\W)'  # expect a preceding non-word character
-             r'({})'     # the entity name itself
-             r'(?=(\W|s\W|ed\W))'  # expect a succeeding non-word character or
-            ).format(re.escape(entity_name)),  # #                 s\W or ed\W
-            regex_flags
+    state = {
+        'unarXive_paper_dir': cg_config.unarxive_paper_dir,
+        'mentioned_contexts': mentioned_contexts,
+        'shard_dir': shard_dir,
+        'meths_dict': meths_dict,
+        'dsets_dict': dsets_dict,
+        'tasks_dict': tasks_dict,
+        'modls_dict': modls_dict,
+        'meths_list': meths_list,
+        'dsets_list': dsets_list,
+        'tasks_list': tasks_list,
+        'modls_list': modls_list,
+        'pprs_to_meths': pprs_to_meths,
+        'pprs_to_dsets': pprs_to_dsets,
+        'pprs_to_tasks': pprs_to_tasks,
+        'pprs_to_modls': pprs_to_modls,
+    }
+    if mentioned_contexts:
+        # all entities of PwC are matched in every paper, so
+        # scan each text once for all of them (see _EntityMatcher)
+        state['entity_matcher'] = _EntityMatcher(
+            (entity['name'], _get_match_flags(entity['name']))
+            for entities in [meths_list, dsets_list, tasks_list, modls_list]
+            for entity in entities
+            if _get_match_flags(entity['name']) is not None
         )
 
-    # common words but distinguishable by matching case sensitive
-    naughty_entity_names = [
-        'ZeRO', 'Cell', 'ReCoRD', 'Inspired', 'MaSS', 'MuTual', 'IntrA',
-        'Sketch', 'Letter', 'Digits', 'VOICe', 'HoME', 'Places', 'BiRD',
-        'Shifts', 'Finer', 'AND Dataset', 'Electricity', 'Atlas', 'Replica',
-        'GlaS', 'eSCAPE', 'ExPose', 'Torque', 'Finer'
-    ]
-    # common words not even distinguishable when matching case sensitive
-    super_naughty_entity_names = [
-        'Google', 'seeds', 'iris', 'SSL', 'E-commerce', 'ACM'
-    ]
+    # determine shards not done in a previous run
+    _prepare_context_shard_dir(
+        shard_dir,
+        {
+            'num_papers': len(pwc_arxiv_pprs),
+            'shard_size': shard_size,
+            'mentioned_contexts': mentioned_contexts,
+            'input_fingerprint': _get_input_fingerprint(
+                graph_data_dir,
+                cg_config.unarxive_paper_dir,
+                pwc_arxiv_pprs
+            )
+        }
+    )
+    num_shards = (len(pwc_arxiv_pprs) + shard_size - 1) // shard_size
+    shard_idxs = range(num_shards)
+    todo_shards = (
+        (
+            shard_idx,
+            pwc_arxiv_pprs[shard_idx*shard_size:(shard_idx+1)*shard_size]
+        )
+        for shard_idx in shard_idxs
+        if not os.path.isfile(
+            _get_context_shard_fps(shard_dir, shard_idx)[0]
+        )
+    )
 
     # go through all papers
-    for i, ppr in enumerate(pwc_arxiv_pprs):
-        if i % 1000 == 0 and verbose:
-            print(i)
-
-        # get entities to match
-        ppr_meths = [
-            meths_dict[mid] for mid in pprs_to_meths.get(ppr['id'], [])
-        ]
-        ppr_dsets = [
-            dsets_dict[did] for did in pprs_to_dsets.get(ppr['id'], [])
-        ]
-        ppr_tasks = [
-            tasks_dict[tid] for tid in pprs_to_tasks.get(ppr['id'], [])
-        ]
-        ppr_modls = [
-            modls_dict[mid] for mid in pprs_to_modls.get(ppr['id'], [])
-        ]
-
-        # get plaintext
-        paper_fn_id = ppr['arxiv_id'].replace('/', '')
-        paper_fn = f'{paper_fn_id}.txt'
-        paper_path = os.path.join(unarXive_paper_dir, paper_fn)
-        if not os.path.isfile(paper_path):
-            continue
-        with open(paper_path) as f:
-            paper_text = f.read()
-
-        if mentioned_contexts:
-            entity_types = {
-                'method_used': ppr_meths,
-                'dataset_used': ppr_dsets,
-                'task_used': ppr_tasks,
-                'model_used': ppr_modls,
-                'method': meths_list,
-                'dataset': dsets_list,
-                'task': tasks_list,
-                'model': modls_list,
-            }
-        else:
-            entity_types = {
-                'method_used': ppr_meths,
-                'dataset_used': ppr_dsets,
-                'task_used': ppr_tasks,
-                'model_used': ppr_modls,
-            }
-
-        # go through all entities (1) of the paper and (2) in all of pwc
-        for etype, entities in entity_types.items():
-            for entity in entities:
-                # skip the few two character entities that do not
-                # include numbers (i.e. not T5)
-                if len(entity['name']) < 3 \
-                        and not re.search(r'\d', entity['name']):
-                    continue
-                # skip overly ambiguous entity names
-                if entity['name'] in super_naughty_entity_names:
-                    continue
-                # try to match as much as possible case insensitive
-                # (set regex flags accordingly)
-                if re.search(r'\d', entity['name']):
-                    regex_flags = re.I  # insensitive if there's a number in it
-                elif (
-                    # match case sensitive if all upper case (NICE, SECOND)
-                    entity['name'].upper() == entity['name'] or
-                    # entity names that resemble common words (ZeRO, ReCoRD)
-                    entity['name'] in naughty_entity_names
-                ):
-                    regex_flags = 0
-                else:
-                    regex_flags = re.I
-                patt = get_compiled_regext_patt(entity['name'], regex_flags)
-                for m in patt.finditer(paper_text):
-                    entity_offset_start = m.start()
-                    entity_offset_end = m.end()
-                    # FIXME: _get_context_by_sent throws errors
-                    # context_offset_start = max(
-                    #     entity_offset_start-LENGTH_OF_LETTERS,
-                    #     0
-                    # )
-                    # context_offset_end = min(
-                    #     entity_offset_end+LENGTH_OF_LETTERS,
-                    #     len(paper_text)
-                    # )
-                    # context_passage = paper_text[
-                    #     context_offset_start:context_offset_end
-                    # ]
-                    # context = _get_context_by_sent(context_passage, m.group(0))
-                    context_offset_start = max(
-                        entity_offset_start-100,
-                        0
-                    )
-                    context_offset_end = min(
-                        entity_offset_end+100,
-                        len(paper_text)
-                    )
-                    context = paper_text[
-                        context_offset_start:context_offset_end
-                    ]
-                    # create new context entity
-                    context_entity = {
-                        'id': _generate_context_id(
-                            ppr['arxiv_id'],
-                            entity['name'],
-                            context_offset_start,
-                            context_offset_end
-                        ),
-                        'type': 'context',
-                        'paper_arxiv_id': ppr['arxiv_id'],
-                        'paper_pwc_id': ppr['id'],
-                        'entity_id': entity['id'],
-                        'entity_offset_in_context': [
-                            # FIXME: try making this shallow (separate
-                            # attribs for start and end) and see if it
-                            # fixes cytoscape import from JSON
-                            entity_offset_start-context_offset_start,
-                            entity_offset_end-context_offset_end
-                         ],
-                        'entity_offset_in_paper': [
-                            entity_offset_start,
-                            entity_offset_end
-                         ],
-                        'context_offset_in_paper': [
-                            context_offset_start,
-                            context_offset_end
-                         ],
-                        'context': context
-                    }
-                    if '_used' in etype:
-                        contexts_used.append(context_entity)
-                    else:
-                        contexts_mentioned.append(context_entity)
+    if num_workers > 1:
+        with multiprocessing.Pool(
+            num_workers,
+            initializer=_init_context_worker,
+            initargs=(state,)
+        ) as pool:
+            for shard_idx in pool.imap_unordered(
+                _process_context_shard,
+                todo_shards
+            ):
+                if verbose:
+                    print(f'shard {shard_idx} done')
+    else:
+        _init_context_worker(state)
+        for shard in todo_shards:
+            shard_idx = _process_context_shard(shard)
+            if verbose:
+                print(f'shard {shard_idx} done')
 
     # persist contexts
-    with open(os.path.join(graph_data_dir, contexts_used_fn), 'w') as f:
-        for context in contexts_used:
-            json.dump(context, f)
-            f.write('\n')
+    merge_fns = [contexts_used_fn]
     if mentioned_contexts:
-        with open(
-            os.path.join(graph_data_dir, contexts_mentioned_fn),
-            'w'
-        ) as f:
-            for context in contexts_mentioned:
-                json.dump(context, f)
-                f.write('\n')
+        merge_fns.append(contexts_mentioned_fn)
+    for merge_idx, merge_fn in enumerate(merge_fns):
+        with open(os.path.join(graph_data_dir, merge_fn), 'w') as f:
+            for shard_idx in shard_idxs:
+                shard_fp = _get_context_shard_fps(
+                    shard_dir,
+                    shard_idx
+                )[merge_idx]
+                with open(shard_fp) as f_shard:
+                    shutil.copyfileobj(f_shard, f)
+    shutil.rmtree(shard_dir)
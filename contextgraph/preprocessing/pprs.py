@@ -14,6 +14,7 @@ import json
 import os
 from contextgraph import config as cg_config
 from contextgraph.util.preprocessing import url_to_pwc_id, name_to_slug
+from contextgraph.preprocessing.util import iter_json_array
 
 
 def preprocess_papers(verbose=False):
@@ -21,13 +22,9 @@ def preprocess_papers(verbose=False):
     out_dir = cg_config.graph_data_dir
 
     pprs_orig_fn = cg_config.pwc_pprs_fn
-    pprs_orig = []
     pprs_new_fn = cg_config.graph_pprs_fn
-    pprs_new = []
     meths_to_pprs_fn = cg_config.graph_meths_to_pprs_fn
-    meths_to_pprs = []
     tasks_to_pprs_fn = cg_config.graph_tasks_to_pprs_fn
-    tasks_to_pprs = []
     meths_orig_fn = cg_config.pwc_meths_fn
     meth_name_to_url = dict()
     meth_full_name_to_url = dict()
@@ -81,82 +78,104 @@ def preprocess_papers(verbose=False):
                 row['paper_url']
             ])
 
-    with open(os.path.join(in_dir, pprs_orig_fn)) as f:
-        pprs_orig = json.load(f)
+    # only papers linked to by models need to be looked up by URL
+    modl_ppr_abs_urls = set(ppr_url for (_, ppr_url) in modls_to_pprs_pre)
 
     invalid_meth_refs = set()
     known_task_refs = set()
     tasks_new = dict()
     id_shiftet_tasks = set()
-    for ppr in pprs_orig:
-        # create paper object
-        ppr_new = {
-            key: val
-            for key, val in ppr.items()
-            if key not in ['tasks', 'methods']  # remove
-        }
-        # add URL slug ID and other attributes
-        ppr_id = url_to_pwc_id(ppr['paper_url'])
-        ppr_new['id'] = ppr_id
-        ppr_new['type'] = 'paper'
-        if len(ppr['date']) > 0:
-            ppr_new['year'] = int(ppr['date'][:4])
-            ppr_new['month'] = int(ppr['date'][5:7])
-            ppr_new['day'] = int(ppr['date'][8:])
-        else:
-            ppr_new['year'] = -1
-            ppr_new['month'] = -1
-            ppr_new['day'] = -1
-        # build paper list
-        pprs_new.append(ppr_new)
-        # build methods->papers
-        for meth in ppr['methods']:
-            if meth['full_name'] in meth_full_name_to_url:
-                meth_url = meth_full_name_to_url[meth['full_name']]
-            elif meth['name'] in meth_name_to_url:
-                meth_url = meth_name_to_url[meth['name']]
-            else:
-                invalid_meth_refs.add(meth['name'])
-            meth_id = url_to_pwc_id(meth_url)
-            meths_to_pprs.append(
-                [meth_id, ppr_id]
-            )
-        # build taks->papers
-        # + extend tasks
-        for task_name in ppr['tasks']:
-            if task_name in task_name_to_id:
-                task_id = task_name_to_id[task_name]
-                known_task_refs.add(task_name)
+    # papers are streamed from the (large) input file, and papers as
+    # well as their links to methods and tasks written as they go
+    with open(os.path.join(out_dir, pprs_new_fn), 'w') as pprs_f, \
+            open(os.path.join(out_dir, meths_to_pprs_fn), 'w') as meths_f, \
+            open(os.path.join(out_dir, tasks_to_pprs_fn), 'w') as tasks_f:
+        meths_to_pprs_writer = csv.writer(
+            meths_f,
+            delimiter=',',
+            quoting=csv.QUOTE_NONE
+        )
+        meths_to_pprs_writer.writerow([
+            'method_id',
+            'paper_id'
+        ])
+        tasks_to_pprs_writer = csv.writer(
+            tasks_f,
+            delimiter=',',
+            quoting=csv.QUOTE_NONE
+        )
+        tasks_to_pprs_writer.writerow([
+            'task_id',
+            'paper_id'
+        ])
+        for ppr in iter_json_array(os.path.join(in_dir, pprs_orig_fn)):
+            # create paper object
+            ppr_new = {
+                key: val
+                for key, val in ppr.items()
+                if key not in ['tasks', 'methods']  # remove
+            }
+            # add URL slug ID and other attributes
+            ppr_id = url_to_pwc_id(ppr['paper_url'])
+            ppr_new['id'] = ppr_id
+            ppr_new['type'] = 'paper'
+            if len(ppr['date']) > 0:
+                ppr_new['year'] = int(ppr['date'][:4])
+                ppr_new['month'] = int(ppr['date'][5:7])
+                ppr_new['day'] = int(ppr['date'][8:])
             else:
-                task_id = 'pwc:task/' + name_to_slug(task_name)
-                try:
-                    assert(task_id not in task_name_to_id.values())
-                except AssertionError:
-                    # problem example:
-                    # Source Code Summarization slug: task/code-summarization
-                    # Code Summarization slug:        task/code-summarization-1
-                    # -.-
-                    id_counter = 1
-                    id_appendage = f'-{id_counter}'
-                    while task_id in task_name_to_id.values():
-                        task_id = task_id + id_appendage
-                        id_counter += 1
+                ppr_new['year'] = -1
+                ppr_new['month'] = -1
+                ppr_new['day'] = -1
+            # write paper
+            json.dump(ppr_new, pprs_f)
+            pprs_f.write('\n')
+            # build methods->papers
+            for meth in ppr['methods']:
+                if meth['full_name'] in meth_full_name_to_url:
+                    meth_url = meth_full_name_to_url[meth['full_name']]
+                elif meth['name'] in meth_name_to_url:
+                    meth_url = meth_name_to_url[meth['name']]
+                else:
+                    invalid_meth_refs.add(meth['name'])
+                meth_id = url_to_pwc_id(meth_url)
+                meths_to_pprs_writer.writerow([meth_id, ppr_id])
+            # build taks->papers
+            # + extend tasks
+            for task_name in ppr['tasks']:
+                if task_name in task_name_to_id:
+                    task_id = task_name_to_id[task_name]
+                    known_task_refs.add(task_name)
+                else:
+                    task_id = 'pwc:task/' + name_to_slug(task_name)
+                    try:
+                        assert(task_id not in task_name_to_id.values())
+                    except AssertionError:
+                        # problem example:
+                        # Source Code Summarization
+                        #   slug: task/code-summarization
+                        # Code Summarization
+                        #   slug: task/code-summarization-1
+                        # -.-
+                        id_counter = 1
                         id_appendage = f'-{id_counter}'
-                    id_shiftet_tasks.add(task_name)
-                # new task entity
-                tasks_new[task_id] = {
-                    'id': task_id,
-                    'type': 'task',
-                    'name': task_name,
-                    'description': None,
-                    'categories': []
-                }
-            tasks_to_pprs.append([
-                task_id,
-                ppr_id
-            ])
-        # prepare mapping to finalize model to paper links
-        ppr_abs_url_to_id[ppr['url_abs']] = ppr_id
+                        while task_id in task_name_to_id.values():
+                            task_id = task_id + id_appendage
+                            id_counter += 1
+                            id_appendage = f'-{id_counter}'
+                        id_shiftet_tasks.add(task_name)
+                    # new task entity
+                    tasks_new[task_id] = {
+                        'id': task_id,
+                        'type': 'task',
+                        'name': task_name,
+                        'description': None,
+                        'categories': []
+                    }
+                tasks_to_pprs_writer.writerow([task_id, ppr_id])
+            # prepare mapping to finalize model to paper links
+            if ppr['url_abs'] in modl_ppr_abs_urls:
+                ppr_abs_url_to_id[ppr['url_abs']] = ppr_id
 
     # create final model to paper links
     num_non_linkable_pprs = 0
@@ -189,42 +208,11 @@ def preprocess_papers(verbose=False):
         print(f'{len(id_shiftet_tasks)} task with shifted ID:')
         print(', '.join(id_shiftet_tasks))
 
-    with open(os.path.join(out_dir, pprs_new_fn), 'w') as f:
-        for ppr in pprs_new:
-            json.dump(ppr, f)
-            f.write('\n')
-
     with open(os.path.join(out_dir, tasks_preprocessed_fn), 'w') as f:
         for task in tasks:
             json.dump(task, f)
             f.write('\n')
 
-    with open(os.path.join(out_dir, meths_to_pprs_fn), 'w') as f:
-        csv_writer = csv.writer(
-            f,
-            delimiter=',',
-            quoting=csv.QUOTE_NONE
-        )
-        csv_writer.writerow([
-            'method_id',
-            'paper_id'
-        ])
-        for (meth_id, ppr_id) in meths_to_pprs:
-            csv_writer.writerow([meth_id, ppr_id])
-
-    with open(os.path.join(out_dir, tasks_to_pprs_fn), 'w') as f:
-        csv_writer = csv.writer(
-            f,
-            delimiter=',',
-            quoting=csv.QUOTE_NONE
-        )
-        csv_writer.writerow([
-            'task_id',
-            'paper_id'
-        ])
-        for (task_id, ppr_id) in tasks_to_pprs:
-            csv_writer.writerow([task_id, ppr_id])
-
     with open(os.path.join(out_dir, modls_to_pprs_fn), 'w') as f:
         csv_writer = csv.writer(
             f,
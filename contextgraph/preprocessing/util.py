@@ -1,9 +1,20 @@
 """ Utility functions for preprocessing
 """
 
+import json
 import os
+import re
 from contextgraph import config as cg_config
 
+try:
+    import ijson
+except ImportError:
+    # fall back to _iter_json_array_raw_decode
+    ijson = None
+
+
+_json_whitespace_patt = re.compile(r'[ \t\n\r]*')
+
 
 def ensure_graph_data_dir():
     """ Ensure the directory where the preprocessed data
@@ -12,3 +23,82 @@ def ensure_graph_data_dir():
 
     if not os.path.exists(cg_config.graph_data_dir):
         os.mkdir(cg_config.graph_data_dir)
+
+
+def _iter_json_array_raw_decode(f, chunk_size):
+    """ Yield the elements of a top-level JSON array read from text
+        file object f, decoding one element at a time with
+        json.JSONDecoder.raw_decode on a buffer of at least chunk_size
+        characters.
+    """
+
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill(min_size):
+        # append to the buffer (dropping what was already consumed)
+        nonlocal buf, pos, eof
+        chunk = f.read(max(chunk_size, min_size))
+        eof = len(chunk) == 0
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            pos = _json_whitespace_patt.match(buf, pos).end()
+            if pos < len(buf) or eof:
+                return
+            fill(0)
+
+    skip_whitespace()
+    if buf[pos:pos+1] != '[':
+        raise ValueError('expected a JSON array')
+    pos += 1
+    skip_whitespace()
+    if buf[pos:pos+1] == ']':
+        return
+    while True:
+        skip_whitespace()
+        try:
+            elem, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # element not completely in the buffer yet. grow the read
+            # size along with the buffer to stay linear in element size
+            fill(len(buf) - pos)
+            continue
+        after = _json_whitespace_patt.match(buf, end).end()
+        if not eof and buf[after:after+1] not in [',', ']']:
+            # element might be cut (e.g. a number "12.5" cut after "12")
+            # -> only accept it once the following separator is read
+            fill(len(buf) - pos)
+            continue
+        pos = end
+        yield elem
+        skip_whitespace()
+        sep = buf[pos:pos+1]
+        pos += 1
+        if sep == ']':
+            return
+        if sep != ',':
+            raise ValueError(f'expected "," or "]" in JSON array, got "{sep}"')
+
+
+def iter_json_array(fp, chunk_size=2**20):
+    """ Iterate over the elements of a file containing a (large)
+        top-level JSON array without loading the whole file.
+
+        Uses ijson if installed, otherwise a buffered
+        json.JSONDecoder.raw_decode based parser.
+    """
+
+    if ijson is not None:
+        with open(fp, 'rb') as f:
+            yield from ijson.items(f, 'item', use_float=True)
+        return
+    with open(fp) as f:
+        yield from _iter_json_array_raw_decode(f, chunk_size)
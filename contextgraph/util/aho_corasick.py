@@ -0,0 +1,87 @@
+""" Aho–Corasick automaton for finding all occurrences of many
+    patterns in a text in a single pass
+"""
+
+from collections import deque
+
+
+# transitions are stored in a single dict keyed by
+# <state> * _KEY_BASE + <code point> to keep memory usage low
+_KEY_BASE = 0x110000
+
+
+class AhoCorasick:
+    """ Automaton over a list of patterns. Matches are reported
+        as (<start>, <end>, <pattern index>) tuples, including
+        overlapping matches.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        goto = dict()
+        children = [[]]  # per state child states (for BFS)
+        depth = [0]
+        outputs = dict()
+        # build trie
+        for pattern_idx, pattern in enumerate(self.patterns):
+            if len(pattern) == 0:
+                continue
+            state = 0
+            for o in map(ord, pattern):
+                key = state * _KEY_BASE + o
+                next_state = goto.get(key)
+                if next_state is None:
+                    next_state = len(depth)
+                    goto[key] = next_state
+                    children.append([])
+                    children[state].append((o, next_state))
+                    depth.append(depth[state] + 1)
+                state = next_state
+            outputs.setdefault(state, []).append(pattern_idx)
+        # compute failure links and merge outputs along them (BFS order)
+        fail = [0] * len(depth)
+        queue = deque(s for (_, s) in children[0])
+        while queue:
+            state = queue.popleft()
+            for (o, child) in children[state]:
+                queue.append(child)
+                fallback = fail[state]
+                while fallback and \
+                        fallback * _KEY_BASE + o not in goto:
+                    fallback = fail[fallback]
+                fail_child = goto.get(fallback * _KEY_BASE + o, 0)
+                fail[child] = fail_child if fail_child != child else 0
+                if fail[child] in outputs:
+                    outputs[child] = \
+                        outputs.get(child, []) + outputs[fail[child]]
+        self._goto = goto
+        self._fail = fail
+        self._outputs = {
+            state: tuple(pattern_idxs)
+            for state, pattern_idxs in outputs.items()
+        }
+
+    def iter_matches(self, text):
+        """ Yield (<start>, <end>, <pattern index>) for all occurrences
+            of all patterns in text (ordered by end position).
+        """
+
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        patterns = self.patterns
+        state = 0
+        for i, o in enumerate(map(ord, text)):
+            next_state = goto.get(state * _KEY_BASE + o)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = goto.get(state * _KEY_BASE + o)
+            state = next_state or 0
+            if state in outputs:
+                end = i + 1
+                for pattern_idx in outputs[state]:
+                    yield (
+                        end - len(patterns[pattern_idx]),
+                        end,
+                        pattern_idx
+                    )
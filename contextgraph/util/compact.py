@@ -0,0 +1,409 @@
+""" Array backed graph representation as a memory efficient
+    alternative to NetworkX
+"""
+
+import json
+import numpy as np
+from contextgraph.util.lazy import lazy_import
+
+nx = lazy_import('networkx')
+
+
+# year/month value of nodes without temporal information
+NO_DATE = np.iinfo(np.int16).min
+
+
+def _to_csr(src, dst, types, num_nodes):
+    """ Return (indptr, indices, types) of the adjacency given
+        by src -> dst, with neighbors in edge order per node.
+    """
+
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+    return indptr, dst[order], types[order]
+
+
+def _json_blob(obj):
+    return np.frombuffer(json.dumps(obj).encode('utf-8'), dtype=np.uint8)
+
+
+def _load_names(arr):
+    """ Return type names saved by CompactGraph.save().
+    """
+
+    if arr.dtype.kind == 'U':
+        # string array (as saved by earlier versions)
+        return arr.tolist()
+    return json.loads(arr.tobytes())
+
+
+class CompactGraph:
+    """ Graph with node IDs interned to int32 indices, node and edge
+        types as uint8 codes and forward/reverse adjacency stored in
+        CSR arrays.
+
+        Only node and edge types (and, where given, the year and month
+        of nodes) are kept. Use to_networkx() to get a (shallow)
+        NetworkX graph.
+    """
+
+    def __init__(
+        self,
+        node_ids,
+        node_type_names,
+        node_types,
+        edge_type_names,
+        src,
+        dst,
+        edge_types,
+        directed=True,
+        node_years=None,
+        node_months=None
+    ):
+        """ Build from node ID list, node type codes and edges given as
+            arrays of node indices and edge type codes.
+
+            As in NetworkX, duplicate edges are merged, and the type of
+            the last duplicate is kept. If directed is False, (u, v)
+            and (v, u) are considered duplicates.
+        """
+
+        self.directed = directed
+        self.node_ids = list(node_ids)
+        self.node_type_names = list(node_type_names)
+        self.edge_type_names = list(edge_type_names)
+        self._node_index = None
+        num_nodes = len(self.node_ids)
+        self.node_types = np.asarray(node_types, dtype=np.uint8)
+        if node_years is None:
+            node_years = np.full(num_nodes, NO_DATE)
+        if node_months is None:
+            node_months = np.full(num_nodes, NO_DATE)
+        self.node_years = np.asarray(node_years, dtype=np.int16)
+        self.node_months = np.asarray(node_months, dtype=np.int16)
+
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        edge_types = np.asarray(edge_types, dtype=np.uint8)
+        if directed:
+            keys = src * num_nodes + dst
+        else:
+            keys = np.minimum(src, dst) * num_nodes + np.maximum(src, dst)
+        # keep last occurrence of duplicate edges
+        _, last_rev = np.unique(keys[::-1], return_index=True)
+        keep = np.sort(len(keys) - 1 - last_rev)
+        src = src[keep].astype(np.int32)
+        dst = dst[keep].astype(np.int32)
+        edge_types = edge_types[keep]
+
+        self.out_indptr, self.out_indices, self.out_types = _to_csr(
+            src, dst, edge_types, num_nodes
+        )
+        self.in_indptr, self.in_indices, self.in_types = _to_csr(
+            dst, src, edge_types, num_nodes
+        )
+
+    @property
+    def node_index(self):
+        """ Mapping from node ID to node index (built on first use).
+        """
+
+        if self._node_index is None:
+            self._node_index = {
+                nid: idx for idx, nid in enumerate(self.node_ids)
+            }
+        return self._node_index
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __iter__(self):
+        return iter(self.node_ids)
+
+    def __contains__(self, node_id):
+        return node_id in self.node_index
+
+    def number_of_nodes(self):
+        return len(self.node_ids)
+
+    def number_of_edges(self):
+        return len(self.out_indices)
+
+    def index(self, node_id):
+        return self.node_index[node_id]
+
+    def node_type(self, node_id):
+        return self.node_type_names[self.node_types[self.index(node_id)]]
+
+    def _type_codes(self, names, vocab):
+        if names is None:
+            return None
+        if isinstance(names, str):
+            names = [names]
+        return np.array(
+            [vocab.index(n) for n in names if n in vocab],
+            dtype=np.uint8
+        )
+
+    def _adjacent(self, idxs, direction='out', edge_types=None):
+        """ Return (seg, nbrs, types) for all edges adjacent to the node
+            indices idxs, where seg gives the position in idxs each
+            edge belongs to.
+
+            direction is one of 'out', 'in' or 'both'.
+        """
+
+        idxs = np.asarray(idxs, dtype=np.int64)
+        if direction == 'both':
+            segs, nbrs, typs = zip(
+                self._adjacent(idxs, 'out', edge_types),
+                self._adjacent(idxs, 'in', edge_types)
+            )
+            return (
+                np.concatenate(segs),
+                np.concatenate(nbrs),
+                np.concatenate(typs)
+            )
+        if direction == 'out':
+            indptr, indices, types = \
+                self.out_indptr, self.out_indices, self.out_types
+        else:
+            indptr, indices, types = \
+                self.in_indptr, self.in_indices, self.in_types
+        starts = indptr[idxs]
+        lens = indptr[idxs + 1] - starts
+        seg = np.repeat(np.arange(len(idxs)), lens)
+        # positions starts[i] .. starts[i]+lens[i]-1 for every i
+        pos = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+        pos += np.repeat(starts, lens)
+        nbrs = indices[pos]
+        typs = types[pos]
+        codes = self._type_codes(edge_types, self.edge_type_names)
+        if codes is not None:
+            mask = np.isin(typs, codes)
+            seg, nbrs, typs = seg[mask], nbrs[mask], typs[mask]
+        return seg, nbrs, typs
+
+    def _neighbor_idxs(self, idx, direction, edge_types=None):
+        _, nbrs, _ = self._adjacent([idx], direction, edge_types)
+        if direction == 'both':
+            nbrs = np.unique(nbrs)
+        return nbrs
+
+    def successors(self, node_id, edge_types=None):
+        """ Return IDs of nodes reached by outgoing edges.
+        """
+
+        nbrs = self._neighbor_idxs(self.index(node_id), 'out', edge_types)
+        return [self.node_ids[i] for i in nbrs]
+
+    def predecessors(self, node_id, edge_types=None):
+        """ Return IDs of nodes reached by incoming edges.
+        """
+
+        nbrs = self._neighbor_idxs(self.index(node_id), 'in', edge_types)
+        return [self.node_ids[i] for i in nbrs]
+
+    def neighbors(self, node_id, edge_types=None):
+        """ Return neighbor IDs. As in NetworkX, these are the successors
+            for directed graphs and all adjacent nodes otherwise.
+        """
+
+        direction = 'out' if self.directed else 'both'
+        nbrs = self._neighbor_idxs(self.index(node_id), direction, edge_types)
+        return [self.node_ids[i] for i in nbrs]
+
+    def degree(self, node_id=None):
+        """ Return the (in + out) degree of a node or, if no node
+            is given, an array of the degrees of all nodes.
+        """
+
+        degs = np.diff(self.out_indptr) + np.diff(self.in_indptr)
+        if node_id is None:
+            return degs
+        return int(degs[self.index(node_id)])
+
+    def edges(self, edge_types=None, data=False):
+        """ Iterate over edges as (<tail ID>, <head ID>) tuples or, if
+            data is True, (<tail ID>, <head ID>, <type>) tuples.
+
+            If edge_types (a type name or list of names) is given, only
+            edges of the given types are returned.
+        """
+
+        src = np.repeat(
+            np.arange(len(self.node_ids)),
+            np.diff(self.out_indptr)
+        )
+        dst = self.out_indices
+        types = self.out_types
+        codes = self._type_codes(edge_types, self.edge_type_names)
+        if codes is not None:
+            mask = np.isin(types, codes)
+            src, dst, types = src[mask], dst[mask], types[mask]
+        for u, v, t in zip(src.tolist(), dst.tolist(), types.tolist()):
+            if data:
+                yield (
+                    self.node_ids[u],
+                    self.node_ids[v],
+                    self.edge_type_names[t]
+                )
+            else:
+                yield (self.node_ids[u], self.node_ids[v])
+
+    def _subgraph_from_mask(self, mask):
+        """ Return the subgraph induced by the nodes where mask is True.
+        """
+
+        keep = np.flatnonzero(mask)
+        new_idx = np.full(len(self.node_ids), -1, dtype=np.int64)
+        new_idx[keep] = np.arange(len(keep))
+        src = np.repeat(
+            np.arange(len(self.node_ids)),
+            np.diff(self.out_indptr)
+        )
+        dst = self.out_indices
+        edge_mask = mask[src] & mask[dst]
+        return CompactGraph(
+            [self.node_ids[i] for i in keep],
+            self.node_type_names,
+            self.node_types[keep],
+            self.edge_type_names,
+            new_idx[src[edge_mask]],
+            new_idx[dst[edge_mask]],
+            self.out_types[edge_mask],
+            directed=self.directed,
+            node_years=self.node_years[keep],
+            node_months=self.node_months[keep]
+        )
+
+    def subgraph(self, node_ids):
+        """ Return the subgraph induced by the given node IDs
+            as a new CompactGraph.
+        """
+
+        mask = np.zeros(len(self.node_ids), dtype=bool)
+        mask[[
+            self.node_index[nid] for nid in node_ids
+            if nid in self.node_index
+        ]] = True
+        return self._subgraph_from_mask(mask)
+
+    def to_networkx(self):
+        """ Return the graph as a NetworkX (Di)Graph with node and
+            edge types (and year/month of nodes where given).
+        """
+
+        if self.directed:
+            G = nx.DiGraph()
+        else:
+            G = nx.Graph()
+        years = self.node_years.tolist()
+        months = self.node_months.tolist()
+        for idx, (nid, t) in enumerate(
+            zip(self.node_ids, self.node_types.tolist())
+        ):
+            node_data = {'type': self.node_type_names[t]}
+            if years[idx] != NO_DATE:
+                node_data['year'] = years[idx]
+                node_data['month'] = months[idx]
+            G.add_node(nid, **node_data)
+        G.add_edges_from(
+            (u, v, {'type': t}) for (u, v, t) in self.edges(data=True)
+        )
+        return G
+
+    @classmethod
+    def from_networkx(cls, G):
+        """ Build from a NetworkX (Di)Graph, keeping node order. Nodes
+            without data get the node type None.
+        """
+
+        node_ids = list(G.nodes)
+        node_index = {nid: idx for idx, nid in enumerate(node_ids)}
+        node_type_names = []
+        node_types = []
+        node_years = []
+        node_months = []
+        for node_data in G.nodes.values():
+            if node_data.get('type') not in node_type_names:
+                node_type_names.append(node_data.get('type'))
+            node_types.append(node_type_names.index(node_data.get('type')))
+            node_years.append(node_data.get('year', NO_DATE))
+            node_months.append(node_data.get('month', NO_DATE))
+        edge_type_names = []
+        src = []
+        dst = []
+        edge_types = []
+        for (u, v, edge_type) in G.edges(data='type'):
+            if edge_type not in edge_type_names:
+                edge_type_names.append(edge_type)
+            src.append(node_index[u])
+            dst.append(node_index[v])
+            edge_types.append(edge_type_names.index(edge_type))
+        return cls(
+            node_ids,
+            node_type_names,
+            node_types,
+            edge_type_names,
+            src,
+            dst,
+            edge_types,
+            directed=G.is_directed(),
+            node_years=node_years,
+            node_months=node_months
+        )
+
+    def save(self, fp):
+        """ Save to a single .npz file.
+        """
+
+        ids_encoded = [nid.encode('utf-8') for nid in self.node_ids]
+        id_offsets = np.zeros(len(ids_encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in ids_encoded], out=id_offsets[1:])
+        src = np.repeat(
+            np.arange(len(self.node_ids), dtype=np.int32),
+            np.diff(self.out_indptr)
+        )
+        with open(fp, 'wb') as f:
+            np.savez(
+                f,
+                directed=np.array(self.directed),
+                node_ids=np.frombuffer(b''.join(ids_encoded), np.uint8),
+                node_id_offsets=id_offsets,
+                # JSON b/c type names can be None (untyped nodes)
+                node_type_names=_json_blob(self.node_type_names),
+                node_types=self.node_types,
+                node_years=self.node_years,
+                node_months=self.node_months,
+                edge_type_names=_json_blob(self.edge_type_names),
+                src=src,
+                dst=self.out_indices,
+                edge_types=self.out_types
+            )
+
+    @classmethod
+    def load(cls, fp):
+        """ Load from a file written by save().
+        """
+
+        with np.load(fp) as arrs:
+            ids_blob = arrs['node_ids'].tobytes()
+            offsets = arrs['node_id_offsets'].tolist()
+            node_ids = [
+                ids_blob[offsets[i]:offsets[i+1]].decode('utf-8')
+                for i in range(len(offsets) - 1)
+            ]
+            return cls(
+                node_ids,
+                _load_names(arrs['node_type_names']),
+                arrs['node_types'],
+                _load_names(arrs['edge_type_names']),
+                arrs['src'],
+                arrs['dst'],
+                arrs['edge_types'],
+                directed=bool(arrs['directed']),
+                node_years=arrs['node_years'],
+                node_months=arrs['node_months']
+            )
@@ -0,0 +1,398 @@
+""" Vectorized computation of entity co-occurrences based on a sparse
+    paper × entity incidence matrix
+"""
+
+import csv
+import json
+import os
+import numpy as np
+from contextgraph import config as cg_config
+from contextgraph.util.lazy import lazy_import
+
+sp = lazy_import('scipy.sparse')
+
+
+# entity type order; determines the orientation of co-occurrence edges
+# (e.g. [method, model] rather than [model, method])
+ENTITY_TYPES = ['method', 'dataset', 'task', 'model']
+
+
+def _pack_date(years, months):
+    """ Pack year and month (both ≥ -1) into a single integer
+        that preserves their lexicographic order.
+    """
+
+    return (np.asarray(years, dtype=np.int64) + 1) * 16 + \
+        (np.asarray(months, dtype=np.int64) + 1)
+
+
+def _unpack_date(packed):
+    return packed // 16 - 1, packed % 16 - 1
+
+
+def _build_incidence(
+    ppr_ids,
+    ppr_years,
+    ppr_months,
+    ent_ids,
+    ent_types,
+    rows,
+    cols
+):
+    """ Bundle paper × entity incidence information.
+
+        ent_types are entity type names, rows/cols paper/entity
+        indices of "used in paper" links. Duplicate links are
+        dropped.
+    """
+
+    type_names = [t for t in ENTITY_TYPES if t in set(ent_types)]
+    type_names += sorted(set(ent_types) - set(type_names))
+    type_codes = {t: i for i, t in enumerate(type_names)}
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    links = np.unique(rows * max(len(ent_ids), 1) + cols)
+    return {
+        'ppr_ids': list(ppr_ids),
+        'ppr_years': np.asarray(ppr_years, dtype=np.int64),
+        'ppr_months': np.asarray(ppr_months, dtype=np.int64),
+        'ent_ids': list(ent_ids),
+        'ent_types': np.array(
+            [type_codes[t] for t in ent_types],
+            dtype=np.int64
+        ),
+        'type_names': type_names,
+        'rows': links // max(len(ent_ids), 1),
+        'cols': links % max(len(ent_ids), 1)
+    }
+
+
+def _incidence_from_graph(G):
+    """ Build the paper × entity incidence from the used_in_paper
+        edges of a NetworkX graph.
+    """
+
+    ppr_index = dict()
+    ppr_years = []
+    ppr_months = []
+    ent_index = dict()
+    ent_types = []
+    rows = []
+    cols = []
+    for (u, v, edge_type) in G.edges(data='type'):
+        if edge_type != 'used_in_paper':
+            continue
+        u_data = G.nodes[u]
+        v_data = G.nodes[v]
+        if v_data.get('type') == 'paper':
+            ppr_id, ppr_data, ent_id, ent_data = v, v_data, u, u_data
+        elif u_data.get('type') == 'paper':
+            ppr_id, ppr_data, ent_id, ent_data = u, u_data, v, v_data
+        else:
+            continue
+        if 'type' not in ent_data:
+            # nodes without any data get created by
+            # adding edges to inexistent nodes
+            continue
+        if ppr_id not in ppr_index:
+            ppr_index[ppr_id] = len(ppr_index)
+            ppr_years.append(ppr_data['year'])
+            ppr_months.append(ppr_data['month'])
+        if ent_id not in ent_index:
+            ent_index[ent_id] = len(ent_index)
+            ent_types.append(ent_data['type'])
+        rows.append(ppr_index[ppr_id])
+        cols.append(ent_index[ent_id])
+    return _build_incidence(
+        ppr_index.keys(),
+        ppr_years,
+        ppr_months,
+        ent_index.keys(),
+        ent_types,
+        rows,
+        cols
+    )
+
+
+def _incidence_from_compact_graph(G):
+    """ Build the paper × entity incidence from the used_in_paper
+        edges of a CompactGraph.
+    """
+
+    if 'used_in_paper' not in G.edge_type_names or \
+            'paper' not in G.node_type_names:
+        return _build_incidence([], [], [], [], [], [], [])
+    src = np.repeat(np.arange(len(G)), np.diff(G.out_indptr))
+    dst = G.out_indices.astype(np.int64)
+    used_in = G.out_types == G.edge_type_names.index('used_in_paper')
+    src, dst = src[used_in], dst[used_in]
+    paper_code = G.node_type_names.index('paper')
+    dst_is_ppr = G.node_types[dst] == paper_code
+    src_is_ppr = G.node_types[src] == paper_code
+    keep = dst_is_ppr | src_is_ppr
+    pprs = np.where(dst_is_ppr, dst, src)[keep]
+    ents = np.where(dst_is_ppr, src, dst)[keep]
+    ppr_idxs, rows = np.unique(pprs, return_inverse=True)
+    ent_idxs, cols = np.unique(ents, return_inverse=True)
+    return _build_incidence(
+        [G.node_ids[i] for i in ppr_idxs.tolist()],
+        G.node_years[ppr_idxs],
+        G.node_months[ppr_idxs],
+        [G.node_ids[i] for i in ent_idxs.tolist()],
+        [G.node_type_names[t] for t in G.node_types[ent_idxs].tolist()],
+        rows,
+        cols
+    )
+
+
+def _incidence_from_files(final_node_set=False):
+    """ Build the paper × entity incidence directly from the
+        preprocessed *_to_papers.csv files and the year/month
+        of papers in papers.jsonl (without loading the full graph).
+
+        If final_node_set is given, links of entities not contained
+        in it are ignored.
+    """
+
+    link_fns = [
+        (cg_config.graph_meths_to_pprs_fn, 'method'),
+        (cg_config.graph_dsets_to_pprs_fn, 'dataset'),
+        (cg_config.graph_tasks_to_pprs_fn, 'task'),
+        (cg_config.graph_modls_to_pprs_fn, 'model'),
+    ]
+    ent_index = dict()
+    ent_types = []
+    link_ppr_ids = []
+    cols = []
+    for (fn, ent_type) in link_fns:
+        with open(os.path.join(cg_config.graph_data_dir, fn)) as f:
+            csv_reader = csv.reader(
+                f,
+                delimiter=',',
+                quoting=csv.QUOTE_NONE
+            )
+            next(csv_reader)  # skip header
+            for row in csv_reader:
+                ent_id = row[0]
+                if final_node_set and ent_id not in final_node_set:
+                    continue
+                if ent_id not in ent_index:
+                    ent_index[ent_id] = len(ent_index)
+                    ent_types.append(ent_type)
+                link_ppr_ids.append(row[1])
+                cols.append(ent_index[ent_id])
+
+    # only keep year and month of linked papers
+    linked_ppr_ids = set(link_ppr_ids)
+    ppr_index = dict()
+    ppr_years = []
+    ppr_months = []
+    with open(os.path.join(
+        cg_config.graph_data_dir,
+        cg_config.graph_pprs_fn
+    )) as f:
+        for line in f:
+            ppr = json.loads(line)
+            if ppr['id'] not in linked_ppr_ids or ppr['id'] in ppr_index:
+                continue
+            ppr_index[ppr['id']] = len(ppr_index)
+            ppr_years.append(ppr['year'])
+            ppr_months.append(ppr['month'])
+    del linked_ppr_ids
+
+    # drop links to papers that do not exist
+    rows = np.fromiter(
+        (ppr_index.get(ppr_id, -1) for ppr_id in link_ppr_ids),
+        dtype=np.int64,
+        count=len(link_ppr_ids)
+    )
+    del link_ppr_ids
+    cols = np.array(cols, dtype=np.int64)
+    exists = rows >= 0
+    return _build_incidence(
+        ppr_index.keys(),
+        ppr_years,
+        ppr_months,
+        ent_index.keys(),
+        ent_types,
+        rows[exists],
+        cols[exists]
+    )
+
+
+def _incidence_matrix(incidence, type_code):
+    """ Return the paper × entity incidence matrix E_t restricted
+        to entities of the given type (as CSR matrix).
+    """
+
+    mask = incidence['ent_types'][incidence['cols']] == type_code
+    rows = incidence['rows'][mask]
+    cols = incidence['cols'][mask]
+    return sp.csr_matrix(
+        (np.ones(len(rows), dtype=np.int64), (rows, cols)),
+        shape=(len(incidence['ppr_ids']), len(incidence['ent_ids']))
+    )
+
+
+def _type_pairs(incidence):
+    n_types = len(incidence['type_names'])
+    for type_a in range(n_types):
+        for type_b in range(type_a + 1, n_types):
+            yield type_a, type_b
+
+
+def _cooc_counts(incidence):
+    """ Return (ent_a, ent_b, counts) for all pairs of entities of
+        dissimilar type with at least one co-occurrence paper,
+        computed as E_a^T · E_b for each pair of types.
+
+        Pairs are grouped by type pair and sorted by (ent_a, ent_b)
+        within each group.
+    """
+
+    mats = [
+        _incidence_matrix(incidence, t)
+        for t in range(len(incidence['type_names']))
+    ]
+    ent_a = []
+    ent_b = []
+    counts = []
+    for type_a, type_b in _type_pairs(incidence):
+        cooc = (mats[type_a].T @ mats[type_b]).tocoo()
+        cooc.sum_duplicates()
+        cooc.eliminate_zeros()
+        order = np.lexsort((cooc.col, cooc.row))
+        ent_a.append(cooc.row[order].astype(np.int64))
+        ent_b.append(cooc.col[order].astype(np.int64))
+        counts.append(cooc.data[order].astype(np.int64))
+    if not counts:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    return (
+        np.concatenate(ent_a),
+        np.concatenate(ent_b),
+        np.concatenate(counts)
+    )
+
+
+def _cooc_pairs(incidence):
+    """ Determine pairs of entities of dissimilar type that are used
+        in at least one common paper, along with their co-occurrence
+        papers and earliest (year, month) of co-occurrence.
+
+        Returns a dict of arrays where the co-occurrence papers of
+        pair i are pprs[ppr_ptr[i]:ppr_ptr[i+1]].
+    """
+
+    rows = incidence['rows']
+    cols = incidence['cols']
+    col_types = incidence['ent_types'][cols]
+    n_pprs = len(incidence['ppr_ids'])
+    n_ents = max(len(incidence['ent_ids']), 1)
+    packed_dates = _pack_date(
+        incidence['ppr_years'],
+        incidence['ppr_months']
+    )
+    ent_a, ent_b, counts = _cooc_counts(incidence)
+
+    pprs = []
+    start_packed = []
+    for type_a, type_b in _type_pairs(incidence):
+        # per paper, all combinations of its type a and type b entities
+        per_type = []
+        for t in [type_a, type_b]:
+            mask = col_types == t
+            t_rows = rows[mask]
+            t_cols = cols[mask]
+            order = np.argsort(t_rows, kind='stable')
+            t_cols = t_cols[order]
+            n_per_ppr = np.bincount(t_rows, minlength=n_pprs)
+            starts = np.cumsum(n_per_ppr) - n_per_ppr
+            per_type.append((t_cols, n_per_ppr, starts))
+        (cols_a, n_a, starts_a), (cols_b, n_b, starts_b) = per_type
+        n_combis = n_a * n_b
+        seg = np.repeat(np.arange(n_pprs), n_combis)
+        pos = np.arange(len(seg)) - np.repeat(
+            np.cumsum(n_combis) - n_combis,
+            n_combis
+        )
+        combi_a = cols_a[starts_a[seg] + pos // n_b[seg]]
+        combi_b = cols_b[starts_b[seg] + pos % n_b[seg]]
+        # group by entity pair. order within a group is by paper index
+        # b/c the sort is stable. group order matches _cooc_counts
+        order = np.argsort(combi_a * n_ents + combi_b, kind='stable')
+        group_pprs = seg[order]
+        pprs.append(group_pprs)
+        if len(group_pprs) > 0:
+            group_starts = np.flatnonzero(np.r_[
+                True,
+                np.diff((combi_a * n_ents + combi_b)[order]) != 0
+            ])
+            start_packed.append(np.minimum.reduceat(
+                packed_dates[group_pprs],
+                group_starts
+            ))
+
+    ppr_ptr = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=ppr_ptr[1:])
+    if start_packed:
+        start_years, start_months = _unpack_date(
+            np.concatenate(start_packed)
+        )
+    else:
+        start_years = start_months = np.zeros(0, dtype=np.int64)
+    return {
+        'ent_a': ent_a,
+        'ent_b': ent_b,
+        'start_year': start_years,
+        'start_month': start_months,
+        'ppr_ptr': ppr_ptr,
+        'pprs': np.concatenate(pprs) if pprs else np.zeros(0, np.int64)
+    }
+
+
+def _cooc_sequences(incidence):
+    """ Determine co-occurrence time sequences of entity pairs (see
+        _cooc_pairs).
+
+        Returns a dict of arrays where the dated co-occurrence papers
+        of pair i are seq_pprs[seq_ptr[i]:seq_ptr[i+1]] (sorted
+        chronologically), and seq_months are their publication months
+        counted from the earliest co-occurrence year
+        (beginning_of_time).
+    """
+
+    cooc_pairs = _cooc_pairs(incidence)
+    num_pairs = len(cooc_pairs['ent_a'])
+    if num_pairs == 0:
+        beginning_of_time = None
+    else:
+        # determine earliest cooc ppr in current data is from 1994
+        beginning_of_time = int(cooc_pairs['start_year'].min())
+    pprs = cooc_pairs['pprs']
+    pair_idxs = np.repeat(
+        np.arange(num_pairs),
+        np.diff(cooc_pairs['ppr_ptr'])
+    )
+    ys = incidence['ppr_years'][pprs]
+    ms = incidence['ppr_months'][pprs]
+    # there is also day info, but mby not so relevant
+    dated = (ys > 0) & (ms > 0)  # is -1 if info not given
+    pprs = pprs[dated]
+    pair_idxs = pair_idxs[dated]
+    months = (ys[dated] - (beginning_of_time or 0)) * 12 + ms[dated]
+    # chronological order within each pair
+    order = np.lexsort((months, pair_idxs))
+    seq_ptr = np.zeros(num_pairs + 1, dtype=np.int64)
+    np.cumsum(
+        np.bincount(pair_idxs, minlength=num_pairs),
+        out=seq_ptr[1:]
+    )
+    return {
+        'ent_a': cooc_pairs['ent_a'],
+        'ent_b': cooc_pairs['ent_b'],
+        'seq_ptr': seq_ptr,
+        'seq_pprs': pprs[order],
+        'seq_months': months[order],
+        'beginning_of_time': beginning_of_time
+    }
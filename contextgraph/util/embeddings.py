@@ -0,0 +1,181 @@
+""" Storage of precomputed node description embeddings as a single
+    memory-mappable matrix
+"""
+
+import os
+import json
+import re
+import numpy as np
+from hashlib import sha1
+from contextgraph import config as cg_config
+
+
+def save_embedding_matrix(node_ids, embeddings, dtype=np.float32):
+    """ Save embeddings (one row per node ID) as a single .npy matrix
+        along with a node ID to row index mapping.
+
+        dtype can be np.float16 to halve the size on disk.
+    """
+
+    emb_dir = cg_config.graph_embs_dir
+    os.makedirs(emb_dir, exist_ok=True)
+    emb_fp = os.path.join(emb_dir, cg_config.graph_embs_fn)
+    idx_fp = os.path.join(emb_dir, cg_config.graph_embs_idx_fn)
+    embeddings = np.asarray(embeddings, dtype=dtype)
+    assert embeddings.shape[0] == len(node_ids)
+    # write to temporary files first to never leave
+    # a matrix and an index that don’t belong together
+    tmp_suffix = f'.{os.getpid()}.tmp'
+    with open(emb_fp + tmp_suffix, 'wb') as f:
+        np.save(f, embeddings)
+    with open(idx_fp + tmp_suffix, 'w') as f:
+        json.dump({nid: row for row, nid in enumerate(node_ids)}, f)
+    os.replace(emb_fp + tmp_suffix, emb_fp)
+    os.replace(idx_fp + tmp_suffix, idx_fp)
+
+
+def load_embedding_matrix():
+    """ Return the embedding matrix (memory-mapped read only) and
+        the node ID to row index mapping.
+    """
+
+    emb_dir = cg_config.graph_embs_dir
+    emb_matrix = np.load(
+        os.path.join(emb_dir, cg_config.graph_embs_fn),
+        mmap_mode='r'
+    )
+    with open(os.path.join(emb_dir, cg_config.graph_embs_idx_fn)) as f:
+        nodeid_to_row = json.load(f)
+    return emb_matrix, nodeid_to_row
+
+
+def get_node_embeddings(node_ids, dtype=np.float32):
+    """ Return a (len(node_ids) × embedding size) array with the
+        embeddings of the given nodes (in the given order).
+    """
+
+    emb_matrix, nodeid_to_row = load_embedding_matrix()
+    rows = np.array([nodeid_to_row[nid] for nid in node_ids], dtype=np.int64)
+    # gather in row order so the memory-mapped file is read sequentially
+    order = np.argsort(rows, kind='stable')
+    embs = np.empty((len(rows), emb_matrix.shape[1]), dtype=dtype)
+    embs[order] = emb_matrix[rows[order]]
+    return embs
+
+
+def _descr_hash(descr):
+    return sha1(descr.encode('utf-8')).hexdigest()
+
+
+def _load_embedding_cache(cache_dir):
+    """ Return a mapping from description hash to embedding for all
+        checkpointed chunks in cache_dir.
+
+        An incomplete last line of the index (e.g. after a crash during
+        writing) is dropped from the file, so that later chunks are not
+        appended to it.
+    """
+
+    cache = dict()
+    index_fp = os.path.join(cache_dir, 'index.jsonl')
+    if not os.path.isfile(index_fp):
+        return cache
+    with open(index_fp, 'rb+') as f:
+        index = f.read()
+        complete_len = index.rfind(b'\n') + 1
+        if complete_len < len(index):
+            f.truncate(complete_len)
+    for line in index[:complete_len].splitlines():
+        try:
+            chunk = json.loads(line)
+        except json.JSONDecodeError:
+            # line damaged by an earlier interrupted run, its
+            # chunk is simply encoded again
+            continue
+        chunk_embs = np.load(
+            os.path.join(cache_dir, chunk['fn']),
+            mmap_mode='r'
+        )
+        for row, descr_hash in enumerate(chunk['hashes']):
+            cache[descr_hash] = chunk_embs[row]
+    return cache
+
+
+def _append_embedding_chunk(cache_dir, descr_hashes, embs):
+    """ Persist a chunk of embeddings and register it in the cache index.
+    """
+
+    index_fp = os.path.join(cache_dir, 'index.jsonl')
+    chunk_fn = 'chunk_{}.npy'.format(descr_hashes[0])
+    chunk_fp = os.path.join(cache_dir, chunk_fn)
+    with open(chunk_fp + '.tmp', 'wb') as f:
+        np.save(f, np.asarray(embs, dtype=np.float32))
+    os.replace(chunk_fp + '.tmp', chunk_fp)
+    # the chunk only counts as done once it is listed in the index
+    with open(index_fp, 'a') as f:
+        json.dump({'fn': chunk_fn, 'hashes': descr_hashes}, f)
+        f.write('\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def compute_description_embeddings(
+    descrs,
+    model_name='all-mpnet-base-v2',
+    batch_size=64,
+    checkpoint_size=4096,
+    verbose=False
+):
+    """ Return a (len(descrs) × embedding size) array of
+        SentenceTransformer embeddings of the given descriptions.
+
+        Embeddings are cached on disk keyed on (model name, description
+        hash), so only new or changed descriptions are encoded. They are
+        encoded in batches of similar length (to minimize padding) and
+        checkpointed every checkpoint_size descriptions, so interrupted
+        runs resume where they stopped.
+    """
+
+    cache_dir = os.path.join(
+        cg_config.graph_embs_dir,
+        'cache',
+        re.sub(r'[^\w\-\.]', '_', model_name)
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    cache = _load_embedding_cache(cache_dir)
+
+    descrs = [descr if descr is not None else '' for descr in descrs]
+    descr_hashes = [_descr_hash(descr) for descr in descrs]
+    pending = dict()
+    for descr_hash, descr in zip(descr_hashes, descrs):
+        if descr_hash not in cache:
+            pending[descr_hash] = descr
+    if verbose:
+        print(f'{len(descrs) - len(pending):,} embeddings cached')
+        print(f'{len(pending):,} descriptions to encode')
+
+    if len(pending) > 0:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name)
+        # sort by length so that batches contain similarly long texts
+        pending_hashes = sorted(
+            pending.keys(),
+            key=lambda h: len(pending[h])
+        )
+        for chunk_start in range(0, len(pending_hashes), checkpoint_size):
+            chunk_hashes = pending_hashes[
+                chunk_start:chunk_start+checkpoint_size
+            ]
+            chunk_embs = model.encode(
+                [pending[h] for h in chunk_hashes],
+                batch_size=batch_size,
+                convert_to_numpy=True
+            )
+            _append_embedding_chunk(cache_dir, chunk_hashes, chunk_embs)
+            for descr_hash, emb in zip(chunk_hashes, chunk_embs):
+                cache[descr_hash] = emb
+            if verbose:
+                print((f'{chunk_start + len(chunk_hashes):,}/'
+                       f'{len(pending_hashes):,} encoded'))
+
+    return np.stack([cache[descr_hash] for descr_hash in descr_hashes])
@@ -1,10 +1,37 @@
 import csv
+import glob
+import hashlib
 import os
 import json
+import multiprocessing
 import random
-import networkx as nx
 import numpy as np
+from array import array
 from contextgraph import config as cg_config
+from contextgraph.util.compact import CompactGraph, NO_DATE
+from contextgraph.util.cooc import _build_incidence,\
+                                   _incidence_from_graph,\
+                                   _incidence_from_compact_graph,\
+                                   _incidence_from_files,\
+                                   _cooc_counts,\
+                                   _cooc_pairs,\
+                                   _cooc_sequences
+from contextgraph.util.neighborhood import get_n_hop_neighborhood,\
+                                           _compact_graph
+from contextgraph.util.samples import PairGraphWriter
+from contextgraph.util.temporal import _temporal_index, _snapshot_node_ids
+from contextgraph.util.lazy import lazy_import
+
+nx = lazy_import('networkx')
+
+
+# base graph shared with pair graph extraction worker processes
+_pair_graph_base_G = None
+
+# bytes read at a time when fingerprinting files
+FINGERPRINT_BLOCK_SIZE = 2**20
+# file fingerprints by (path, size, modification time)
+_file_fingerprints = dict()
 
 
 class cooc_edge_dict(dict):
@@ -12,11 +39,265 @@ class cooc_edge_dict(dict):
             return hash(tuple(sorted(self['edge'])))
 
 
-def _load_node_tuples(with_contexts=False, entities_only=False):
-    """ loads nodes as (<id>, <properties>) tuples
+def _file_fingerprint(fp):
+    """ Return a digest of the contents of a file.
+
+        Unlike paths and modification times, the digest is the same for
+        copies of the file (e.g. the same data on other machines). The
+        file is read in full once and its digest reused for as long as
+        its size and modification time stay the same.
+    """
+
+    stat = os.stat(fp)
+    memo_key = (os.path.abspath(fp), stat.st_size, stat.st_mtime_ns)
+    if memo_key in _file_fingerprints:
+        return _file_fingerprints[memo_key]
+    fingerprint = hashlib.sha1()
+    with open(fp, 'rb') as f:
+        for block in iter(lambda: f.read(FINGERPRINT_BLOCK_SIZE), b''):
+            fingerprint.update(block)
+    _file_fingerprints[memo_key] = fingerprint.hexdigest()
+    return _file_fingerprints[memo_key]
+
+
+def _graph_data_fingerprint():
+    """ Return a digest over the names and file fingerprints (see
+        _file_fingerprint) of all files in the graph data directory.
+
+        Any rewrite of the preprocessed data (e.g. by preprocess.py)
+        therefore results in a new digest, while copies of the same
+        data at other paths or on other machines share it.
+    """
+
+    fingerprint = hashlib.sha1()
+    for entry in sorted(
+        os.scandir(cg_config.graph_data_dir),
+        key=lambda e: e.name
+    ):
+        if not entry.is_file():
+            continue
+        fingerprint.update(
+            f'{entry.name}\t{_file_fingerprint(entry.path)}\n'.encode(
+                'utf-8'
+            )
+        )
+    return fingerprint.hexdigest()
+
+
+def _options_fingerprint(options):
+    """ Return a digest of loader options.
+    """
+
+    return hashlib.sha1(
+        repr(sorted(options.items())).encode('utf-8')
+    ).hexdigest()
+
+
+def _cached(name, options, build_fn, dump_fn, load_fn):
+    """ Return the result of build_fn, using a snapshot in
+        cg_config.graph_cache_dir if one exists for the current
+        graph data and the given options.
+
+        Snapshots are written with dump_fn(obj, fp) and read with
+        load_fn(fp). Snapshots of the same name and options built from
+        other graph data are removed, snapshots with other options
+        are kept.
+    """
+
+    cache_dir = cg_config.graph_cache_dir
+    snapshot_prefix = f'{name}_{_options_fingerprint(options)[:8]}'
+    data_key = _graph_data_fingerprint()[:16]
+    cache_fp = os.path.join(
+        cache_dir,
+        f'{snapshot_prefix}_{data_key}.snapshot'
+    )
+    if os.path.isfile(cache_fp):
+        return load_fn(cache_fp)
+
+    obj = build_fn()
+    os.makedirs(cache_dir, exist_ok=True)
+    stale_fps = glob.glob(
+        os.path.join(cache_dir, f'{snapshot_prefix}_*.snapshot')
+    )
+    # snapshots named with a single key over data and options
+    # (as written by earlier versions)
+    stale_fps += glob.glob(
+        os.path.join(cache_dir, f'{name}_{"?" * 16}.snapshot')
+    )
+    for stale_fp in stale_fps:
+        os.remove(stale_fp)
+    # write to a temporary file first so that concurrently
+    # loading processes never see a partial snapshot
+    tmp_fp = f'{cache_fp}.{os.getpid()}.tmp'
+    dump_fn(obj, tmp_fp)
+    os.replace(tmp_fp, cache_fp)
+    return obj
+
+
+def _dump_columns(prefix, values, arrs):
+    """ Add a list of values to arrs as a column: integers as an
+        int64 array, strings as JSON encoded categories with int32
+        codes, and anything else as a JSON encoded list.
+    """
+
+    if all(type(val) is int for val in values):
+        arrs[f'{prefix}.int'] = np.array(values, dtype=np.int64)
+    elif all(type(val) is str for val in values):
+        codes = dict()
+        arrs[f'{prefix}.codes'] = np.fromiter(
+            (codes.setdefault(val, len(codes)) for val in values),
+            dtype=np.int32,
+            count=len(values)
+        )
+        arrs[f'{prefix}.cats'] = _json_array(list(codes))
+    else:
+        arrs[f'{prefix}.json'] = _json_array(values)
+
+
+def _load_columns(prefix, arrs):
+    """ Return the list of values of a column written by _dump_columns.
+    """
+
+    if f'{prefix}.int' in arrs:
+        return arrs[f'{prefix}.int'].tolist()
+    if f'{prefix}.codes' in arrs:
+        cats = json.loads(arrs[f'{prefix}.cats'].tobytes())
+        return [cats[code] for code in arrs[f'{prefix}.codes'].tolist()]
+    return json.loads(arrs[f'{prefix}.json'].tobytes())
+
+
+def _json_array(values):
+    return np.frombuffer(
+        json.dumps(values, ensure_ascii=False).encode('utf-8'),
+        dtype=np.uint8
+    )
+
+
+def _dump_attr_table(prefix, attr_dicts, arrs):
+    """ Add a list of attribute dicts to arrs as a column store: one
+        column (see _dump_columns) per attribute holding the values of
+        all dicts that have it, plus each dict’s keys (in order) as
+        a code into a list of distinct key lists.
+    """
+
+    key_lists = dict()
+    arrs[f'{prefix}.keys.codes'] = np.fromiter(
+        (
+            key_lists.setdefault(tuple(attrs), len(key_lists))
+            for attrs in attr_dicts
+        ),
+        dtype=np.int32,
+        count=len(attr_dicts)
+    )
+    arrs[f'{prefix}.keys.cats'] = _json_array(list(key_lists))
+    attr_names = dict.fromkeys(
+        name for key_list in key_lists for name in key_list
+    )
+    for (i, name) in enumerate(attr_names):
+        _dump_columns(
+            f'{prefix}.{i}',
+            [attrs[name] for attrs in attr_dicts if name in attrs],
+            arrs
+        )
+
+
+def _load_attr_table(prefix, arrs):
+    """ Return the list of attribute dicts written by _dump_attr_table.
+    """
+
+    key_lists = json.loads(arrs[f'{prefix}.keys.cats'].tobytes())
+    key_codes = arrs[f'{prefix}.keys.codes']
+    attr_names = dict.fromkeys(
+        name for key_list in key_lists for name in key_list
+    )
+    columns = dict()
+    for (i, name) in enumerate(attr_names):
+        has_attr = np.isin(key_codes, [
+            code for (code, key_list) in enumerate(key_lists)
+            if name in key_list
+        ])
+        # position of each dict’s value within the column
+        columns[name] = (
+            _load_columns(f'{prefix}.{i}', arrs),
+            np.cumsum(has_attr) - 1
+        )
+    attr_dicts = [None] * len(key_codes)
+    for (code, key_list) in enumerate(key_lists):
+        rows = np.flatnonzero(key_codes == code)
+        values = []
+        for name in key_list:
+            (column, positions) = columns[name]
+            values.append([column[pos] for pos in positions[rows].tolist()])
+        if len(key_list) == 0:
+            # one empty value tuple per row, i.e. empty dicts
+            values = [[()] * len(rows)]
+        for (row, row_values) in zip(rows.tolist(), zip(*values)):
+            attr_dicts[row] = dict(zip(key_list, row_values))
+    return attr_dicts
+
+
+def _save_graph_tables(graph_tuples, fp):
+    """ Save node and edge tuples to a single .npz file of node and
+        edge tables, with node IDs and edge ends as codes into the
+        distinct node IDs and attributes as column stores.
+    """
+
+    (node_tuples, edge_tuples) = graph_tuples
+    arrs = dict()
+    _dump_columns(
+        'node_ids',
+        [node_id for (node_id, node_attrs) in node_tuples] +
+        [u for (u, v, edge_attrs) in edge_tuples] +
+        [v for (u, v, edge_attrs) in edge_tuples],
+        arrs
+    )
+    _dump_attr_table(
+        'node_attrs',
+        [node_attrs for (node_id, node_attrs) in node_tuples],
+        arrs
+    )
+    _dump_attr_table(
+        'edge_attrs',
+        [edge_attrs for (u, v, edge_attrs) in edge_tuples],
+        arrs
+    )
+    arrs['num_nodes'] = np.array(len(node_tuples))
+    with open(fp, 'wb') as f:
+        np.savez(f, **arrs)
+
+
+def _load_graph_tables(fp):
+    """ Load node and edge tuples from a file written by
+        _save_graph_tables.
+    """
+
+    with np.load(fp) as npz:
+        arrs = {key: npz[key] for key in npz.files}
+    num_nodes = int(arrs['num_nodes'])
+    ids = _load_columns('node_ids', arrs)
+    num_edges = (len(ids) - num_nodes) // 2
+    node_tuples = list(zip(
+        ids[:num_nodes],
+        _load_attr_table('node_attrs', arrs)
+    ))
+    edge_tuples = list(zip(
+        ids[num_nodes:num_nodes+num_edges],
+        ids[num_nodes+num_edges:],
+        _load_attr_table('edge_attrs', arrs)
+    ))
+    return (node_tuples, edge_tuples)
+
+
+def _iter_node_tuples(
+    with_contexts=False,
+    entities_only=False,
+    with_papers=True
+):
+    """ yields nodes as (<id>, <properties>) tuples
+
+        If with_papers is False, paper nodes are skipped.
     """
 
-    entity_tuples = []
     # first all regularly stored entities
     node_fns = [
         cg_config.graph_meths_fn,
@@ -24,7 +305,7 @@ def _load_node_tuples(with_contexts=False, entities_only=False):
         cg_config.graph_tasks_fn,
         cg_config.graph_modls_fn,
     ]
-    if not entities_only:
+    if not entities_only and with_papers:
         node_fns.append(cg_config.graph_pprs_fn)
     if with_contexts:
         node_fns.append(cg_config.graph_cntxts_fn)
@@ -32,10 +313,10 @@ def _load_node_tuples(with_contexts=False, entities_only=False):
         with open(os.path.join(cg_config.graph_data_dir, fn)) as f:
             for line in f:
                 entity = json.loads(line)
-                entity_tuples.append((entity['id'], entity))
+                yield (entity['id'], entity)
     if entities_only:
         # already done, b/c areas and collections will not be added
-        return entity_tuples
+        return
     # then some special processing for the areas to collections data
     with open(os.path.join(
         cg_config.graph_data_dir,
@@ -44,31 +325,43 @@ def _load_node_tuples(with_contexts=False, entities_only=False):
         for line in f:
             # area
             area = json.loads(line)
-            entity_tuples.append((
+            yield (
                 area['id'],
                 {
                     'id': area['id'],
                     'type': area['type'],
                     'name': area['name']
                 }
-            ))
+            )
             # all contained collections
             for coll in area['collections']:
-                entity_tuples.append(
-                    (coll['id'], coll)
-                )
-    return entity_tuples
+                yield (coll['id'], coll)
 
 
-def _load_edge_tuples(with_contexts=False, final_node_set=False):
-    """ loads edges as (<id>, <properties>) tuples
+def _load_node_tuples(with_contexts=False, entities_only=False):
+    """ loads nodes as (<id>, <properties>) tuples
+    """
+
+    return list(_iter_node_tuples(
+        with_contexts=with_contexts,
+        entities_only=entities_only
+    ))
+
+
+def _iter_edge_tuples(
+    with_contexts=False,
+    final_node_set=False,
+    edge_types=None
+):
+    """ yields edges as (<id>, <properties>) tuples
 
         If final_node_set is given, only edges between existing nodes
-        will be returned.
+        will be returned. If edge_types is given, only edges of these
+        types are returned (and files of other edge types not read).
     """
 
     # first all regularly stored edges
-    edge_types = [
+    edge_fns = [
         # used_in_paper
         [cg_config.graph_meths_to_pprs_fn, 'used_in_paper'],
         [cg_config.graph_dsets_to_pprs_fn, 'used_in_paper'],
@@ -95,8 +388,9 @@ def _load_edge_tuples(with_contexts=False, final_node_set=False):
         #                     entity     to context (if param set)
         #                     context    to paper)
     ]
-    edge_tuples = []
-    for (fn, edge_type) in edge_types:
+    for (fn, edge_type) in edge_fns:
+        if edge_types is not None and edge_type not in edge_types:
+            continue
         header_idxs = [0, 1]
         if edge_type == 'cites':
             header_idxs = [3, 4]
@@ -114,13 +408,14 @@ def _load_edge_tuples(with_contexts=False, final_node_set=False):
                         tail_id in final_node_set and
                         head_id in final_node_set
                         ):
-                    edge_tuples.append(
-                        (
-                            tail_id,
-                            head_id,
-                            {'type': edge_type}
-                        )
+                    yield (
+                        tail_id,
+                        head_id,
+                        {'type': edge_type}
                     )
+    if edge_types is not None and 'part_of' not in edge_types:
+        # areas and contexts are only linked with part_of edges
+        return
     # then some special processing for the areas to collections data
     with open(os.path.join(
         cg_config.graph_data_dir,
@@ -135,12 +430,10 @@ def _load_edge_tuples(with_contexts=False, final_node_set=False):
                         tail_id in final_node_set and
                         head_id in final_node_set
                         ):
-                    edge_tuples.append(
-                        (
-                            tail_id,
-                            head_id,
-                            {'type': 'part_of'}
-                        )
+                    yield (
+                        tail_id,
+                        head_id,
+                        {'type': 'part_of'}
                     )
 
     if with_contexts:
@@ -158,12 +451,10 @@ def _load_edge_tuples(with_contexts=False, final_node_set=False):
                         tail_id in final_node_set and
                         head_id in final_node_set
                         ):
-                    edge_tuples.append(
-                        (
-                            tail_id,
-                            head_id,
-                            {'type': 'part_of'}
-                        )
+                    yield (
+                        tail_id,
+                        head_id,
+                        {'type': 'part_of'}
                     )
                 # context to paper
                 tail_id = cntxt['id']
@@ -172,14 +463,58 @@ def _load_edge_tuples(with_contexts=False, final_node_set=False):
                         tail_id in final_node_set and
                         head_id in final_node_set
                         ):
-                    edge_tuples.append(
-                        (
-                            tail_id,
-                            head_id,
-                            {'type': 'part_of'}
-                        )
+                    yield (
+                        tail_id,
+                        head_id,
+                        {'type': 'part_of'}
                     )
-    return edge_tuples
+
+
+def _load_edge_tuples(with_contexts=False, final_node_set=False):
+    """ loads edges as (<id>, <properties>) tuples
+
+        If final_node_set is given, only edges between existing nodes
+        will be returned.
+    """
+
+    return list(_iter_edge_tuples(
+        with_contexts=with_contexts,
+        final_node_set=final_node_set
+    ))
+
+
+def _cooc_edge_dicts(incidence, cooc_pairs, lim=-1):
+    """ Convert co-occurrence pairs as determined by
+        contextgraph.util.cooc._cooc_pairs into a dict of
+        cooc_edge_dicts keyed by the sorted, joined entity IDs.
+    """
+
+    ent_ids = incidence['ent_ids']
+    ppr_ids = incidence['ppr_ids']
+    ppr_ptr = cooc_pairs['ppr_ptr'].tolist()
+    pprs = cooc_pairs['pprs'].tolist()
+    num_pairs = len(cooc_pairs['ent_a'])
+    if lim > 0:
+        num_pairs = min(lim, num_pairs)
+    cooc_edges = dict()
+    for i, (a, b, start_year, start_month) in enumerate(zip(
+        cooc_pairs['ent_a'][:num_pairs].tolist(),
+        cooc_pairs['ent_b'][:num_pairs].tolist(),
+        cooc_pairs['start_year'][:num_pairs].tolist(),
+        cooc_pairs['start_month'][:num_pairs].tolist()
+    )):
+        e1_id = ent_ids[a]
+        e2_id = ent_ids[b]
+        key = '_'.join(sorted([e1_id, e2_id]))
+        cooc_edges[key] = cooc_edge_dict({
+            'edge': [e1_id, e2_id],
+            'cooc_pprs': set(
+                ppr_ids[j] for j in pprs[ppr_ptr[i]:ppr_ptr[i+1]]
+            ),
+            'cooc_start_year': start_year,
+            'cooc_start_month': start_month
+        })
+    return cooc_edges
 
 
 def _get_entity_coocurrence_edges(G, lim=-1):
@@ -188,92 +523,23 @@ def _get_entity_coocurrence_edges(G, lim=-1):
 
         To make subsequent processing steps more efficient,
         also determine all common papers for each entity
-        pair as well as the earliest year in which any of those
-        papers was published.
+        pair as well as the earliest year (and month within
+        that year) in which any of those papers was published.
+
+        Co-occurrences are computed on a sparse paper × entity
+        incidence matrix (see contextgraph.util.cooc). G can be a
+        NetworkX graph or a CompactGraph.
     """
 
-    cooc_edges = dict()
-    # get an undirected view to be able
-    # to go from papers to used enitites
-    uG = G.to_undirected(as_view=True)
-    # for all papers
-    lim_reached = False
-    for (ppr_id, ppr_data) in uG.nodes(data=True):
-        if lim_reached:
-            break
-        if 'type' not in ppr_data:
-            # nodes without any data get created by
-            # adding edges to inexistent nodes
-            continue
-        if ppr_data['type'] != 'paper':
-            continue
-        ppr_used_entities = set()
-        # for all their used entities
-        for (entity_id, edge_data) in uG.adj[ppr_id].items():
-            if edge_data['type'] != 'used_in_paper':
-                continue
-            ppr_used_entities.add(entity_id)
-        # get pairs of entities of dissimilar type
-        for e1_id in ppr_used_entities:
-            if lim_reached:
-                break
-            e1 = G.nodes[e1_id]
-            for e2_id in ppr_used_entities:
-                if lim_reached:
-                    break
-                e2 = G.nodes[e2_id]
-                # only need to check for dissimilar node type
-                # ⇣ because dissimilar ID logically follows
-                if e1['type'] != e2['type'] and \
-                        not (e1['type'] == 'model' and e2['type'] == 'method'):
-                    key = '_'.join(sorted([e1_id, e2_id]))
-                    if key not in cooc_edges:
-                        cooc_edges[key] = cooc_edge_dict({
-                            'edge': [e1_id, e2_id],
-                            'cooc_pprs': set([ppr_id]),
-                            'cooc_start_year': ppr_data['year'],
-                            'cooc_start_month': ppr_data['month']
-                        })
-                    else:
-                        cooc_edges[key]['cooc_pprs'].add(
-                            ppr_id
-                        )
-                        cooc_edges[key]['cooc_start_year'] = min(
-                            ppr_data['year'],
-                            cooc_edges[key]['cooc_start_year']
-                        )
-                        cooc_edges[key]['cooc_start_month'] = min(
-                            ppr_data['year'],
-                            cooc_edges[key]['cooc_start_month']
-                        )
-                    if lim > 0 and len(cooc_edges) >= lim:
-                        lim_reached = True
-
-    return cooc_edges  # 2M edges if lim is not set
-
-
-def _get_two_hop_pair_neighborhood_nodes(cooc_entity_pair, G):
-    """ Get two hop neighborhood for a pair of entities
-        that co-occur in at least one paper.
-    """
-
-    # TODO: generalize to n hops
-
-    keep_node_ids = set()
-
-    # get an undirected view to be able
-    # to go from papers to used enitites
-    uG = G.to_undirected(as_view=True)
-
-    # for both entities
-    for entity in cooc_entity_pair['edge']:
-        # first hop neighborhood
-        for one_hop_neigh in uG.neighbors(entity):
-            keep_node_ids.add(one_hop_neigh)
-            # second hop neighborhood
-            for two_hop_neigh in uG.neighbors(one_hop_neigh):
-                keep_node_ids.add(two_hop_neigh)
-    return G.subgraph(keep_node_ids)
+    if isinstance(G, CompactGraph):
+        incidence = _incidence_from_compact_graph(G)
+    else:
+        incidence = _incidence_from_graph(G)
+    return _cooc_edge_dicts(
+        incidence,
+        _cooc_pairs(incidence),
+        lim
+    )  # 2M edges if lim is not set
 
 
 def _get_pruned_graph(cooc_entity_pair, G):
@@ -284,31 +550,30 @@ def _get_pruned_graph(cooc_entity_pair, G):
         papers before the first co-occurrence paper.
     """
 
-    # TODO: currently takes 4 seconds on full graph -> too long?
-    #       (takes 126 ms on an edge’s two hop neighborhood)
+    # nodes of G are looked up in a temporal index of the full graph
+    # (built once) instead of checking the data of each node
+    return G.subgraph(_snapshot_node_ids(
+        G,
+        cooc_entity_pair['cooc_start_year'],
+        cooc_entity_pair['cooc_start_month']
+    ))
 
-    keep_node_ids = []
 
-    # determine all papers published after earliest cooc ppr
-    for node_id in G.nodes:
-        node_data = G.nodes[node_id]
-        if len(node_data) > 0:
-            if node_data['type'] != 'paper':
-                # not a paper, keep
-                # (TODO: also consider other enitites
-                #  that should be removed)
-                keep_node_ids.append(node_id)
-            elif node_data['year'] < cooc_entity_pair['cooc_start_year'] and \
-                    node_data['month'] < cooc_entity_pair['cooc_start_month']:
-                # a paper but published early enough
-                keep_node_ids.append(node_id)
+def _out_degree(G, node_id):
+    """ Number of successors (neighbors if undirected) of a node in a
+        NetworkX graph or CompactGraph.
+    """
 
-    return G.subgraph(keep_node_ids)
+    if isinstance(G, CompactGraph):
+        direction = 'out' if G.directed else 'both'
+        return len(G._neighbor_idxs(G.index(node_id), direction))
+    return len(G.adj[node_id])
 
 
-def _corrupted_cooc_eges(e1, e2, G):
+def _corrupted_cooc_eges(e1, e2, out_degree):
     """ Return corrupted co-occurrence edges by
-        swapping tail nodes.
+        swapping tail nodes. out_degree(<node ID>) returns the
+        out-degree of an entity in the full graph.
 
         Assumes that
             - earliest co-occurrence paper of e1 and e1
@@ -336,7 +601,7 @@ def _corrupted_cooc_eges(e1, e2, G):
     #  random anymore but determined by publishing month
     #  => likely underirable)
     corr1_edge = [e1['edge'][0], e2['edge'][1]]
-    if len(G.adj[e1['edge'][0]]) > len(G.adj[e2['edge'][1]]):
+    if out_degree(e1['edge'][0]) > out_degree(e2['edge'][1]):
         corr1_month = e1['cooc_start_month']
     else:
         corr1_month = e2['cooc_start_month']
@@ -347,7 +612,7 @@ def _corrupted_cooc_eges(e1, e2, G):
         'cooc_start_month': max(corr1_month, 7),
     })
     corr2_edge = [e2['edge'][0], e1['edge'][1]]
-    if len(G.adj[e2['edge'][0]]) > len(G.adj[e1['edge'][1]]):
+    if out_degree(e2['edge'][0]) > out_degree(e1['edge'][1]):
         corr2_month = e2['cooc_start_month']
     else:
         corr2_month = e1['cooc_start_month']
@@ -360,19 +625,314 @@ def _corrupted_cooc_eges(e1, e2, G):
     return [corr1, corr2]
 
 
-def get_pair_graphs(n_true_pairs, G):
-    """ Return 2 × n_true_pairs graphs with their respective prediction edge.
-            - half are *prunded* graphs of co-occurring entities
-            - the other half are *prunded* graphs of non-co-occurring entities
+def _get_pair_graph(cooc_edge, G, neighborhood_args=None):
+    """ Return the pruned n hop (default: two hop) neighborhood graph of
+        a prediction edge.
 
-        A pair of co-occurring entities are two differently typed entities
-        which have at least one common paper in which they are used.
+        neighborhood_args are passed on to get_n_hop_neighborhood
+        (num_hops, fanouts, strategy, edge_types, seed). Fanouts only
+        apply to the final neighborhood within the pruned graph.
+    """
+
+    if neighborhood_args is None:
+        neighborhood_args = dict()
+    num_hops = neighborhood_args.get('num_hops', 2)
+    edge_types = neighborhood_args.get('edge_types')
+    # reduce to neighborhood that is potentially necessary (speedup)
+    neigh_G = get_n_hop_neighborhood(
+        G,
+        cooc_edge['edge'],
+        num_hops=num_hops,
+        edge_types=edge_types
+    )
+    # remove paper nodes based on time constraint
+    pruned_G = _get_pruned_graph(cooc_edge, neigh_G)
+    # reduce to neighborhood (gets rid of stuff that is onyl
+    # connected in unpruned graph)
+    pruned_neigh_G = get_n_hop_neighborhood(
+        pruned_G,
+        cooc_edge['edge'],
+        **neighborhood_args
+    )
+    return {
+        'prediction_edge': cooc_edge,
+        'graph': pruned_neigh_G
+    }
+
+
+def _init_pair_graph_worker(G):
+    global _pair_graph_base_G
+    if G is not None:
+        _pair_graph_base_G = G
+
+
+def _get_pair_graph_worker(job):
+    is_true_pair, cooc_edge, neighborhood_args = job
+    pair_graph = _get_pair_graph(
+        cooc_edge,
+        _pair_graph_base_G,
+        neighborhood_args
+    )
+    # copy b/c pickling a subgraph view would pickle the whole base graph
+    pair_graph['graph'] = pair_graph['graph'].copy()
+    return is_true_pair, pair_graph
+
+
+def _iter_pair_graphs(jobs, G, num_workers=1, chunksize=16):
+    """ Yield (<is true pair>, <pair graph>) for the given
+        (<is true pair>, <cooc edge>, <neighborhood args>) jobs in order.
+
+        With num_workers > 1 pair graphs are extracted in a process
+        pool. Where possible, workers are forked so that they share G
+        read-only instead of receiving a copy.
+    """
+
+    if num_workers <= 1:
+        for (is_true_pair, cooc_edge, neighborhood_args) in jobs:
+            yield is_true_pair, _get_pair_graph(
+                cooc_edge,
+                G,
+                neighborhood_args
+            )
+        return
+
+    global _pair_graph_base_G
+    # build the temporal index and array adjacency before workers are
+    # forked so that they share them rather than each building their own
+    _temporal_index(G)
+    _compact_graph(G)
+    if 'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+        # inherited by the forked workers
+        _pair_graph_base_G = G
+        initargs = (None,)
+    else:
+        mp_context = multiprocessing.get_context()
+        initargs = (G,)
+    try:
+        with mp_context.Pool(
+            num_workers,
+            initializer=_init_pair_graph_worker,
+            initargs=initargs
+        ) as pool:
+            yield from pool.imap(
+                _get_pair_graph_worker,
+                jobs,
+                chunksize=chunksize
+            )
+    finally:
+        _pair_graph_base_G = None
+
+
+def _sample_year_cluster_edges(
+    cooc_edge_list,
+    sample_size,
+    out_degree,
+    rng,
+    max_attempts_per_sample=20
+):
+    """ For co-occurrence edges with the same co-occurrence start year,
+        sample pairs of edges with disjoint sets of co-occurrence papers
+        and return (<positive edges>, <negative edges>), each of
+        sample_size where possible.
+
+        Positive edges are those of the sampled pairs, negative edges
+        the pairs’ corrupted edges (see _corrupted_cooc_eges).
+
+        Partners of an edge are drawn by rejection sampling against
+        the edges sharing a paper with it, which are determined via a
+        paper → edge inverted index. Sampling stops after
+        max_attempts_per_sample × sample_size attempts, so clusters
+        with too few disjoint pairs yield fewer edges.
+    """
+
+    num_edges = len(cooc_edge_list)
+    ppr_index = dict()
+    for edge_idx, cooc_edge in enumerate(cooc_edge_list):
+        for ppr_id in cooc_edge['cooc_pprs']:
+            ppr_index.setdefault(ppr_id, []).append(edge_idx)
+    conflicts = dict()  # edge idx -> idxs of edges sharing a paper
+    exhausted = set()  # edges that share a paper with all others
+    used_pairs = set()
+    pos = dict()  # edge idx -> edge, ordered by sampling
+    neg = dict()  # sorted entity IDs -> corrupted edge
+    for _ in range(max_attempts_per_sample * sample_size):
+        if len(pos) >= sample_size and len(neg) >= sample_size:
+            break
+        if len(exhausted) == num_edges:
+            break
+        idx1 = rng.randrange(num_edges)
+        if idx1 in exhausted:
+            continue
+        if idx1 not in conflicts:
+            conflicts[idx1] = set().union(*(
+                ppr_index[ppr_id]
+                for ppr_id in cooc_edge_list[idx1]['cooc_pprs']
+            ))
+            # (edges always conflict with themselves)
+            conflicts[idx1].add(idx1)
+        idx1_conflicts = conflicts[idx1]
+        if len(idx1_conflicts) == num_edges:
+            exhausted.add(idx1)
+            continue
+        # rejection sampling of a partner, falling back to drawing from
+        # all possible partners for edges with many conflicts
+        for _ in range(8):
+            idx2 = rng.randrange(num_edges)
+            if idx2 not in idx1_conflicts:
+                break
+        else:
+            idx2 = rng.choice([
+                i for i in range(num_edges) if i not in idx1_conflicts
+            ])
+        pair_key = (min(idx1, idx2), max(idx1, idx2))
+        if pair_key in used_pairs:
+            continue
+        used_pairs.add(pair_key)
+        cooc_edge1 = cooc_edge_list[idx1]
+        cooc_edge2 = cooc_edge_list[idx2]
+        # true prediction edges
+        pos[idx1] = cooc_edge1
+        pos[idx2] = cooc_edge2
+        # false prediction edges
+        for corr in _corrupted_cooc_eges(
+            cooc_edge1,
+            cooc_edge2,
+            out_degree
+        ):
+            if corr['edge'][0] == corr['edge'][1]:
+                # entity shared by both edges (in swapped positions)
+                continue
+            neg.setdefault(tuple(sorted(corr['edge'])), corr)
+    # cut year’s contribution to full sample to size
+    pos = list(pos.values())
+    neg = list(neg.values())
+    return (
+        rng.sample(pos, min(sample_size, len(pos))),
+        rng.sample(neg, min(sample_size, len(neg)))
+    )
+
+
+def _sample_prediction_edges(
+    n_true_pairs,
+    G,
+    rng,
+    max_attempts_per_sample=20
+):
+    """ Return lists of positive (co-occurrence) and negative
+        (corrupted co-occurrence) prediction edges, n_true_pairs each
+        (or, if n_true_pairs < 1, a number proportional to the
+        co-occurrence edges of each year), sampled per co-occurrence
+        start year with the random number generator rng.
+
+        G can be a NetworkX graph or a CompactGraph.
     """
 
     # get positive training examples
     # # don’t apply limit here                          |
     # # b/c it’s fast enough to do the whole graph      V
-    cooc_edges_full = _get_entity_coocurrence_edges(G, -1)
+    return _sample_cooc_prediction_edges(
+        _get_entity_coocurrence_edges(G, -1),
+        lambda node_id: _out_degree(G, node_id),
+        n_true_pairs,
+        rng,
+        max_attempts_per_sample=max_attempts_per_sample
+    )
+
+
+def _entity_out_degrees(incidence):
+    """ Return the out-degrees of the entities of a paper × entity
+        incidence built by _incidence_from_files in the (directed) full
+        graph without contexts, as determined from the link files.
+    """
+
+    ent_index = {
+        ent_id: idx for idx, ent_id in enumerate(incidence['ent_ids'])
+    }
+    # used_in_paper edges (the incidence’s links)
+    degrees = np.bincount(
+        incidence['cols'],
+        minlength=len(ent_index)
+    )
+    # edges to other entities and to collections
+    node_set = set(
+        node_id for (node_id, _) in _iter_node_tuples(with_papers=False)
+    )
+    ent_edges = set(
+        (tail_id, head_id)
+        for (tail_id, head_id, _) in _iter_edge_tuples(
+            final_node_set=node_set,
+            edge_types=['evaluated_on', 'has_task', 'has_subtask', 'part_of']
+        )
+        if tail_id in ent_index
+    )
+    for (tail_id, _) in ent_edges:
+        degrees[ent_index[tail_id]] += 1
+    return degrees
+
+
+def _sample_prediction_edges_from_files(
+    n_true_pairs,
+    rng,
+    max_attempts_per_sample=20
+):
+    """ Same as _sample_prediction_edges on the full graph, but with
+        co-occurrences and out-degrees determined from the preprocessed
+        files without loading the graph.
+    """
+
+    entity_positions = dict()
+    for (node_id, _) in _iter_node_tuples(entities_only=True):
+        # same as building a graph: duplicate IDs keep their position
+        entity_positions.setdefault(node_id, len(entity_positions))
+    incidence = _incidence_from_files(final_node_set=entity_positions)
+    # number entities in graph order, so that co-occurrence edges come
+    # in the same order as when determined on the full graph
+    order = np.argsort(
+        [entity_positions[ent_id] for ent_id in incidence['ent_ids']],
+        kind='stable'
+    )
+    del entity_positions
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    incidence = _build_incidence(
+        incidence['ppr_ids'],
+        incidence['ppr_years'],
+        incidence['ppr_months'],
+        [incidence['ent_ids'][i] for i in order.tolist()],
+        [
+            incidence['type_names'][t]
+            for t in incidence['ent_types'][order].tolist()
+        ],
+        incidence['rows'],
+        rank[incidence['cols']]
+    )
+    degrees = _entity_out_degrees(incidence)
+    ent_index = {
+        ent_id: idx for idx, ent_id in enumerate(incidence['ent_ids'])
+    }
+    return _sample_cooc_prediction_edges(
+        _cooc_edge_dicts(incidence, _cooc_pairs(incidence)),
+        lambda ent_id: int(degrees[ent_index[ent_id]]),
+        n_true_pairs,
+        rng,
+        max_attempts_per_sample=max_attempts_per_sample
+    )
+
+
+def _sample_cooc_prediction_edges(
+    cooc_edges_full,
+    out_degree,
+    n_true_pairs,
+    rng,
+    max_attempts_per_sample=20
+):
+    """ Sample prediction edges (see _sample_prediction_edges) from
+        co-occurrence edges as returned by _cooc_edge_dicts.
+        out_degree(<node ID>) returns the out-degree of an entity in
+        the full graph.
+    """
+
     # generate negative training examples
     # # cluster co-occurrence edges by year of earliest cooc ppr
     edge_year_clusters = dict()
@@ -399,78 +959,119 @@ def get_pair_graphs(n_true_pairs, G):
     if n_true_pairs > 0:
         # # make sure year samples add up to n_true_pairs
         smpl_diff = n_true_pairs - sum(year_smpl_sizes.values())
-        fill_year = list(year_smpl_sizes.keys())[
-            np.argmax(year_smpl_sizes.values())
-        ]
+        fill_year = max(year_smpl_sizes, key=year_smpl_sizes.get)
         year_smpl_sizes[fill_year] += smpl_diff
     # # sample positive and negative prediction edges
-    cooc_edges_pos = set()
-    cooc_edges_neg = set()
+    cooc_edges_pos = []
+    cooc_edges_neg = []
     for cooc_start_year, cooc_edge_list in edge_year_clusters.items():
         sample_size = year_smpl_sizes[cooc_start_year]
         if sample_size < 1:
             continue
-        # create negative samples
-        shuf1 = random.sample(cooc_edge_list, len(cooc_edge_list))
-        shuf2 = random.sample(cooc_edge_list, len(cooc_edge_list))
-        size_reached = False
-        year_smpl_pos = set()
-        year_smpl_neg = set()
-        for cooc_edge1 in shuf1:
-            if size_reached:
-                break
-            for cooc_edge2 in shuf2:
-                if len(year_smpl_pos) >= sample_size and \
-                   len(year_smpl_neg) >= sample_size:
-                    size_reached = True
-                if len(set.intersection(
-                    cooc_edge1['cooc_pprs'],
-                    cooc_edge2['cooc_pprs']
-                )) == 0:
-                    # true prediction edges
-                    year_smpl_pos.add(cooc_edge1)
-                    year_smpl_pos.add(cooc_edge2)
-                    # false prediction edges
-                    corr1, corr2 = _corrupted_cooc_eges(
-                        cooc_edge1, cooc_edge2, G
-                    )
-                    year_smpl_neg.add(corr1)
-                    year_smpl_neg.add(corr2)
-        # cut year’s contribution to full sample to size
-        cooc_edges_pos.update(
-            random.sample(
-                year_smpl_pos,
-                min(sample_size, len(year_smpl_pos))
-                )
-        )
-        cooc_edges_neg.update(
-            random.sample(
-                year_smpl_neg,
-                min(sample_size, len(year_smpl_neg))
-                )
+        year_smpl_pos, year_smpl_neg = _sample_year_cluster_edges(
+            cooc_edge_list,
+            sample_size,
+            out_degree,
+            rng,
+            max_attempts_per_sample=max_attempts_per_sample
         )
+        cooc_edges_pos.extend(year_smpl_pos)
+        cooc_edges_neg.extend(year_smpl_neg)
+    return cooc_edges_pos, cooc_edges_neg
+
+
+def get_pair_graphs(
+    n_true_pairs,
+    G,
+    num_workers=1,
+    chunksize=16,
+    out_dir=None,
+    shard_size=1024,
+    num_hops=2,
+    fanouts=None,
+    strategy='uniform',
+    edge_types=None,
+    seed=None,
+    max_attempts_per_sample=20,
+    verbose=False
+):
+    """ Return 2 × n_true_pairs graphs with their respective prediction edge.
+            - half are *prunded* graphs of co-occurring entities
+            - the other half are *prunded* graphs of non-co-occurring entities
+
+        A pair of co-occurring entities are two differently typed entities
+        which have at least one common paper in which they are used.
+
+        If num_workers > 1, graphs are extracted in parallel, chunksize
+        samples at a time per worker. Graphs are then copies rather than
+        subgraph views of G.
+
+        Pair graphs contain the num_hops neighborhood of the prediction
+        edge’s entities. fanouts (one limit per hop), strategy and
+        edge_types are passed on to get_n_hop_neighborhood to bound the
+        size of pair graphs. Neighbors are sampled with a per pair graph
+        seed drawn from the sampling random number generator.
+
+        Negative examples are corrupted versions of pairs of
+        co-occurrence edges with the same start year and disjoint
+        co-occurrence papers (see _sample_year_cluster_edges). If seed
+        is given, sampling is reproducible, otherwise the random module
+        is used.
+
+        If out_dir is given, pair graphs are written to that directory
+        in shards of shard_size samples (see contextgraph.util.samples)
+        instead of being returned, and two empty lists are returned.
+    """
+
+    if seed is None:
+        rng = random
+    else:
+        rng = random.Random(seed)
+    cooc_edges_pos, cooc_edges_neg = _sample_prediction_edges(
+        n_true_pairs,
+        G,
+        rng,
+        max_attempts_per_sample=max_attempts_per_sample
+    )
     # create graphs
     true_pair_grahps = []
     false_pair_grahps = []
-    for graph_list, edge_list in [
-        (true_pair_grahps, cooc_edges_pos),
-        (false_pair_grahps, cooc_edges_neg)
+    jobs = []
+    for (is_true_pair, cooc_edges) in [
+        (True, cooc_edges_pos),
+        (False, cooc_edges_neg)
     ]:
-        for cooc_edge in edge_list:
-            # reduce to neighborhood that is potentially necessary (speedup)
-            neigh_G = _get_two_hop_pair_neighborhood_nodes(cooc_edge, G)
-            # remove paper nodes based on time constraint
-            pruned_G = _get_pruned_graph(cooc_edge, neigh_G)
-            # reduce to neighborhood (gets rid of stuff that is onyl
-            # connected in unpruned graph)
-            pruned_neigh_G = _get_two_hop_pair_neighborhood_nodes(
-                cooc_edge,
-                pruned_G
-            )
-            graph_list.append({
-                'prediction_edge': cooc_edge,
-                'graph': pruned_neigh_G
-            })
+        for cooc_edge in cooc_edges:
+            neighborhood_args = {
+                'num_hops': num_hops,
+                'fanouts': fanouts,
+                'strategy': strategy,
+                'edge_types': edge_types
+            }
+            if fanouts is not None:
+                # drawn here to not depend on the order of extraction
+                neighborhood_args['seed'] = rng.getrandbits(64)
+            jobs.append((is_true_pair, cooc_edge, neighborhood_args))
+    pair_graphs = _iter_pair_graphs(
+        jobs,
+        G,
+        num_workers=num_workers,
+        chunksize=chunksize
+    )
+    if out_dir is not None:
+        with PairGraphWriter(out_dir, shard_size=shard_size) as writer:
+            for i, (is_true_pair, pair_graph) in enumerate(pair_graphs):
+                if verbose and (i + 1) % 1000 == 0:
+                    print(f'{i + 1:,}/{len(jobs):,} pair graphs extracted')
+                writer.add(pair_graph, is_true_pair)
+        return true_pair_grahps, false_pair_grahps
+    for i, (is_true_pair, pair_graph) in enumerate(pair_graphs):
+        if verbose and (i + 1) % 1000 == 0:
+            print(f'{i + 1:,}/{len(jobs):,} pair graphs extracted')
+        if is_true_pair:
+            true_pair_grahps.append(pair_graph)
+        else:
+            false_pair_grahps.append(pair_graph)
     # test for n_true_pairs = 200:
     #
     # In [204]: np.mean([len(x['graph'].nodes) for x in fls])
@@ -512,54 +1113,49 @@ def _load_entity_combi_edge_tuples(final_node_set=False, scheme='sequence'):
         schemes:
             - sequence: time sequence of co-occurences
             - weight: number of co-occurences
+
+        Co-occurrences are determined directly from the entity to
+        paper links (see contextgraph.util.cooc._incidence_from_files)
+        rather than the full graph.
     """
 
-    # not the most time efficient, but simply
-    # go from the full graph using existing code
-    G = load_full_graph()
-    cooc_edges_full = _get_entity_coocurrence_edges(G, -1)
-    # create combi edges
+    incidence = _incidence_from_files(final_node_set=final_node_set)
+    ent_ids = incidence['ent_ids']
+    if scheme == 'weight':
+        # only counts needed, no co-occurrence papers
+        ent_a, ent_b, counts = _cooc_counts(incidence)
+        return [
+            (ent_ids[a], ent_ids[b], {'weight': count})
+            for (a, b, count) in zip(
+                ent_a.tolist(),
+                ent_b.tolist(),
+                counts.tolist()
+            )
+        ]
+    elif scheme != 'sequence':
+        raise ValueError(f'unknown scheme "{scheme}"')
+
+    cooc_seqs = _cooc_sequences(incidence)
+    seq_ptr = cooc_seqs['seq_ptr'].tolist()
+    pprs = cooc_seqs['seq_pprs'].tolist()
+    months_in_cooc_time = cooc_seqs['seq_months'].tolist()
+    ppr_ids = incidence['ppr_ids']
     edge_tuples = []
-    # determine earliest cooc ppr in current data is from 1994
-    cooc_years = []
-    for k, ce in cooc_edges_full.items():
-        cooc_years.append(ce['cooc_start_year'])
-    beginning_of_time = min(cooc_years)
-    for key, cooc_edge in cooc_edges_full.items():
-        ppr_a_id = cooc_edge['edge'][0]
-        ppr_b_id = cooc_edge['edge'][1]
-        if scheme == 'sequence':
-            # build co-occurrence time sequence
-            cooc_time_sequence = []
-            cooc_ppr_sequence = []
-            for ppr_id in cooc_edge['cooc_pprs']:
-                y = G.nodes[ppr_id]['year']
-                m = G.nodes[ppr_id]['month']
-                # there is also day info, but mby not so relevant
-                if y > 0 and m > 0:  # is -1 if info not given
-                    year_in_cooc_time = y - beginning_of_time
-                    month_in_cooc_time = (year_in_cooc_time * 12) + m
-                    cooc_time_sequence.append(month_in_cooc_time)
-                    cooc_ppr_sequence.append(ppr_id)
-            edge_property = {
-                'interaction_sequence': cooc_time_sequence,
-                'linker_sequence': cooc_ppr_sequence
-            }
-        elif scheme == 'weight':
-            # TODO:
-            # consider then using add_weighted_edges_from later
-            edge_property = {'weight': len(cooc_edge['cooc_pprs'])}
-        if not final_node_set or \
-                (final_node_set and
-                 ppr_a_id in final_node_set and
-                 ppr_b_id in final_node_set):
-            edge_tuples.append(
-                (
-                    ppr_a_id,
-                    ppr_b_id,
-                    edge_property
-                )
+    for i, (a, b) in enumerate(zip(
+        cooc_seqs['ent_a'].tolist(),
+        cooc_seqs['ent_b'].tolist()
+    )):
+        start, end = seq_ptr[i], seq_ptr[i+1]
+        edge_tuples.append(
+            (
+                ent_ids[a],
+                ent_ids[b],
+                {
+                    'interaction_sequence': months_in_cooc_time[start:end],
+                    'linker_sequence': [ppr_ids[j] for j in pprs[start:end]]
+                }
             )
+        )
     return edge_tuples
 
 
@@ -585,11 +1181,63 @@ def load_entity_combi_graph(scheme='sequence'):
     return G
 
 
-def load_full_graph(shallow=False, directed=True, with_contexts=False):
-    """ Load nodes and edges into a NetworkX digraph.
+def _load_compact_graph(directed=True, with_contexts=False):
+    """ Load nodes and edges into a CompactGraph without
+        materializing per node or per edge dicts.
+    """
 
-        If shallow is True, all node and edge features
-        except for type will be discarded.
+    node_ids = []
+    node_index = dict()
+    node_type_names = []
+    node_types = array('B')
+    node_years = array('h')
+    node_months = array('h')
+    for (nid, ndata) in _iter_node_tuples(with_contexts=with_contexts):
+        if ndata['type'] not in node_type_names:
+            node_type_names.append(ndata['type'])
+        if nid in node_index:
+            # same as NetworkX: keep position, update data
+            idx = node_index[nid]
+            node_types[idx] = node_type_names.index(ndata['type'])
+            node_years[idx] = ndata.get('year', NO_DATE)
+            node_months[idx] = ndata.get('month', NO_DATE)
+            continue
+        node_index[nid] = len(node_ids)
+        node_ids.append(nid)
+        node_types.append(node_type_names.index(ndata['type']))
+        node_years.append(ndata.get('year', NO_DATE))
+        node_months.append(ndata.get('month', NO_DATE))
+
+    edge_type_names = []
+    src = array('i')
+    dst = array('i')
+    edge_types = array('B')
+    for (tail_id, head_id, edata) in _iter_edge_tuples(
+        with_contexts=with_contexts,
+        final_node_set=node_index
+    ):
+        if edata['type'] not in edge_type_names:
+            edge_type_names.append(edata['type'])
+        src.append(node_index[tail_id])
+        dst.append(node_index[head_id])
+        edge_types.append(edge_type_names.index(edata['type']))
+
+    return CompactGraph(
+        node_ids,
+        node_type_names,
+        np.frombuffer(node_types, dtype=np.uint8),
+        edge_type_names,
+        np.frombuffer(src, dtype=np.int32),
+        np.frombuffer(dst, dtype=np.int32),
+        np.frombuffer(edge_types, dtype=np.uint8),
+        directed=directed,
+        node_years=np.frombuffer(node_years, dtype=np.int16),
+        node_months=np.frombuffer(node_months, dtype=np.int16)
+    )
+
+
+def _full_graph_tuples(shallow=False, with_contexts=False):
+    """ Return the node and edge tuples of the full graph.
     """
 
     node_tuples = _load_node_tuples(
@@ -617,6 +1265,81 @@ def load_full_graph(shallow=False, directed=True, with_contexts=False):
             ))
         node_tuples = shallow_node_tuples
         edge_tuples = shallow_edge_tuples
+    return (node_tuples, edge_tuples)
+
+
+def load_full_graph(
+    shallow=False,
+    directed=True,
+    with_contexts=False,
+    use_cache=True,
+    backend='networkx'
+):
+    """ Load nodes and edges into a NetworkX digraph.
+
+        If shallow is True, all node and edge features
+        except for type will be discarded.
+
+        If use_cache is True (the default), the graph is written to
+        a snapshot in cg_config.graph_cache_dir on first load and read
+        from there afterwards. Snapshots are .npz files of node and
+        edge tables (no pickles) and are rebuilt whenever files in
+        cg_config.graph_data_dir change. With use_cache=False, no
+        files are written.
+
+        If backend is 'csr', a CompactGraph is returned instead.
+        CompactGraphs are always shallow (except for node year and
+        month).
+    """
+
+    if backend not in ['networkx', 'csr']:
+        raise ValueError(f'unknown backend "{backend}"')
+
+    if backend == 'csr':
+        if use_cache:
+            name = 'full_graph_csr_d{:d}_c{:d}'.format(
+                directed, with_contexts
+            )
+            return _cached(
+                name,
+                {
+                    'shallow': True,
+                    'directed': directed,
+                    'with_contexts': with_contexts,
+                    'backend': backend
+                },
+                lambda: _load_compact_graph(
+                    directed=directed,
+                    with_contexts=with_contexts
+                ),
+                dump_fn=lambda G, fp: G.save(fp),
+                load_fn=CompactGraph.load
+            )
+        return _load_compact_graph(
+            directed=directed,
+            with_contexts=with_contexts
+        )
+
+    if use_cache:
+        # directed and undirected graphs are built from the same tuples
+        name = 'full_graph_tables_s{:d}_c{:d}'.format(
+            shallow, with_contexts
+        )
+        (node_tuples, edge_tuples) = _cached(
+            name,
+            {'shallow': shallow, 'with_contexts': with_contexts},
+            lambda: _full_graph_tuples(
+                shallow=shallow,
+                with_contexts=with_contexts
+            ),
+            dump_fn=_save_graph_tables,
+            load_fn=_load_graph_tables
+        )
+    else:
+        (node_tuples, edge_tuples) = _full_graph_tuples(
+            shallow=shallow,
+            with_contexts=with_contexts
+        )
     if directed:
         G = nx.DiGraph()
     else:
@@ -0,0 +1,44 @@
+""" Deferred imports of heavy dependencies (torch, NetworkX, ...), so
+    that importing contextgraph modules stays fast for code paths that
+    do not use them
+"""
+
+import importlib
+import sys
+
+
+class LazyModule:
+    """ Stand-in for a module that is imported on first attribute
+        access (e.g. nx.Graph). Import errors are raised at that point.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        # only called for attributes not set in __init__
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<lazy module {self._name} ({state})>'
+
+
+def lazy_import(name):
+    """ Return a LazyModule for the (dotted) module name. Modules that
+        are already imported are returned directly.
+    """
+
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
@@ -0,0 +1,203 @@
+""" n-hop neighborhood extraction with optional per-hop fanout limits,
+    implemented as a frontier BFS over CSR adjacency arrays
+"""
+
+import random
+import weakref
+import numpy as np
+from contextgraph.util.compact import CompactGraph, NO_DATE
+from contextgraph.util.temporal import _root_graph
+
+
+SAMPLING_STRATEGIES = ['uniform', 'recency', 'degree']
+
+# array adjacency of NetworkX graphs, dropped along with their graph
+_compact_graphs = weakref.WeakKeyDictionary()
+
+
+def _compact_graph(G):
+    """ Return a (cached) CompactGraph of a NetworkX graph. For graph
+        views, the CompactGraph of the underlying graph is used.
+
+        The CompactGraph is rebuilt if the number of nodes changed, but
+        otherwise assumes that the graph is not modified.
+    """
+
+    G = _root_graph(G)
+    CG = _compact_graphs.get(G)
+    if CG is None or len(CG) != len(G):
+        CG = CompactGraph.from_networkx(G)
+        _compact_graphs[G] = CG
+    return CG
+
+
+def _sampling_weights(CG, nbrs, strategy, recency_half_life=2):
+    """ Return sampling weights of neighbors.
+
+        uniform: all neighbors are equally likely
+        recency: neighbors’ weights halve every recency_half_life years
+                 before the most recent dated node (nodes without
+                 a date get the maximum weight)
+        degree:  neighbors are sampled proportionally to their degree
+    """
+
+    if strategy == 'uniform':
+        return np.ones(len(nbrs))
+    if strategy == 'recency':
+        years = CG.node_years[nbrs].astype(np.float64)
+        months = CG.node_months[nbrs].astype(np.float64)
+        dated = (years != NO_DATE) & (years >= 0)
+        all_dated = (CG.node_years != NO_DATE) & (CG.node_years >= 0)
+        if not all_dated.any():
+            return np.ones(len(nbrs))
+        latest = CG.node_years[all_dated].max() + 1
+        times = years + np.maximum(months - 1, 0) / 12
+        weights = np.ones(len(nbrs))
+        weights[dated] = 0.5 ** ((latest - times[dated]) / recency_half_life)
+        return weights
+    if strategy == 'degree':
+        return np.maximum(CG.degree()[nbrs], 1).astype(np.float64)
+    raise ValueError(
+        f'Unknown sampling strategy {strategy}, expected one of '
+        f'{SAMPLING_STRATEGIES}'
+    )
+
+
+def _sample_per_segment(seg, weights, fanout, rng):
+    """ Return a mask selecting at most fanout entries per segment,
+        sampled without replacement proportionally to weights
+        (Efraimidis–Spirakis: keep the fanout largest u^(1/w)).
+    """
+
+    keys = np.log(rng.random(len(seg))) / weights
+    order = np.lexsort((-keys, seg))
+    seg_sorted = seg[order]
+    seg_starts = np.searchsorted(seg_sorted, seg_sorted, side='left')
+    rank = np.arange(len(seg)) - seg_starts
+    mask = np.zeros(len(seg), dtype=bool)
+    mask[order[rank < fanout]] = True
+    return mask
+
+
+def _n_hop_idxs(
+    CG,
+    seed_idxs,
+    num_hops,
+    fanouts=None,
+    strategy='uniform',
+    edge_types=None,
+    direction='both',
+    node_mask=None,
+    rng=None
+):
+    """ Return the sorted indices of all nodes within num_hops of
+        seed_idxs (including the seeds) as a numpy array.
+
+        If node_mask is given, only nodes where it is True are
+        traversed.
+    """
+
+    visited = np.zeros(len(CG), dtype=bool)
+    frontier = np.unique(np.asarray(seed_idxs, dtype=np.int64))
+    visited[frontier] = True
+    for hop in range(num_hops):
+        if len(frontier) == 0:
+            break
+        seg, nbrs, _ = CG._adjacent(frontier, direction, edge_types)
+        if node_mask is not None:
+            allowed = node_mask[nbrs]
+            seg, nbrs = seg[allowed], nbrs[allowed]
+        fanout = fanouts[hop] if fanouts is not None else None
+        if fanout is not None and len(nbrs) > 0:
+            # undirected graphs store each edge once, so a neighbor can
+            # appear twice per node for direction 'both'
+            pair_keys = np.unique(seg * len(CG) + nbrs)
+            seg, nbrs = pair_keys // len(CG), pair_keys % len(CG)
+            keep = _sample_per_segment(
+                seg,
+                _sampling_weights(CG, nbrs, strategy),
+                fanout,
+                rng
+            )
+            nbrs = nbrs[keep]
+        frontier = np.unique(nbrs[~visited[nbrs]])
+        visited[frontier] = True
+    return np.flatnonzero(visited)
+
+
+def get_n_hop_neighborhood(
+    G,
+    node_ids,
+    num_hops=2,
+    fanouts=None,
+    strategy='uniform',
+    edge_types=None,
+    direction='both',
+    seed=None
+):
+    """ Return the subgraph of G induced by the given nodes and all
+        nodes within num_hops of them.
+
+        G can be a NetworkX graph (or node induced subgraph view) or a
+        CompactGraph. For NetworkX graphs a subgraph view is returned,
+        for CompactGraphs a new CompactGraph.
+
+        fanouts: optional list of per hop limits (int or None) of how
+                 many neighbors of each frontier node are followed
+        strategy: how limited neighbors are sampled (see
+                  SAMPLING_STRATEGIES and _sampling_weights)
+        edge_types: optional edge type name or list of names to
+                    restrict traversal to
+        direction: 'both' (ignore edge direction), 'out' or 'in'
+        seed: seed for sampling neighbors (drawn from the random
+              module if not given)
+    """
+
+    if fanouts is not None and len(fanouts) != num_hops:
+        raise ValueError(
+            f'Expected {num_hops} fanouts but got {len(fanouts)}'
+        )
+    if strategy not in SAMPLING_STRATEGIES:
+        raise ValueError(
+            f'Unknown sampling strategy {strategy}, expected one of '
+            f'{SAMPLING_STRATEGIES}'
+        )
+    rng = None
+    if fanouts is not None:
+        if seed is None:
+            seed = random.getrandbits(64)
+        rng = np.random.default_rng(seed)
+    if isinstance(G, CompactGraph):
+        CG = G
+        node_mask = None
+    else:
+        CG = _compact_graph(G)
+        node_mask = None
+        if len(G) != len(CG):
+            # node induced subgraph view of the graph CG was built from
+            node_mask = np.zeros(len(CG), dtype=bool)
+            node_mask[[CG.node_index[nid] for nid in G.nodes]] = True
+    if not CG.directed:
+        direction = 'both'
+    seed_idxs = [
+        CG.node_index[nid] for nid in node_ids
+        if nid in CG.node_index and (
+            node_mask is None or node_mask[CG.node_index[nid]]
+        )
+    ]
+    idxs = _n_hop_idxs(
+        CG,
+        seed_idxs,
+        num_hops,
+        fanouts=fanouts,
+        strategy=strategy,
+        edge_types=edge_types,
+        direction=direction,
+        node_mask=node_mask,
+        rng=rng
+    )
+    if isinstance(G, CompactGraph):
+        mask = np.zeros(len(CG), dtype=bool)
+        mask[idxs] = True
+        return CG._subgraph_from_mask(mask)
+    return G.subgraph([CG.node_ids[idx] for idx in idxs.tolist()])
@@ -0,0 +1,306 @@
+""" Sharded on-disk storage of link prediction pair graph samples
+    (as generated by contextgraph.util.graph.get_pair_graphs)
+
+    Layout of a sample directory:
+        manifest.json    number of samples, shards, type vocabularies
+        node_ids.json    global node ID table
+        node_types.npy   type code of each node in the global table
+        shard_<n>/       one directory per shard of samples with
+            nodes.npy             global node indices of all samples
+            node_ptr.npy          sample i’s nodes are
+                                  nodes[node_ptr[i]:node_ptr[i+1]]
+            edges.npy             (E × 2) edges as local node indices
+                                  (i.e. positions in the sample’s nodes)
+            edge_types.npy        type code of each edge
+            edge_ptr.npy          same as node_ptr, for edges
+            labels.npy            1 for co-occurring pairs, 0 otherwise
+            prediction_edges.npy  (n × 2) global node indices
+            cutoffs.npy           (n × 2) year and month of the
+                                  prediction edge’s co-occurrence start
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+from contextgraph import config as cg_config
+from contextgraph.util.lazy import lazy_import
+
+nx = lazy_import('networkx')
+
+
+class PairGraphWriter:
+    """ Stream pair graph samples into fixed-size shards.
+
+        Use as a context manager or call close() when done. The
+        manifest of samples already in out_dir is removed when writing
+        starts and a new one is only written by close() (which is not
+        called if the with block is left with an error), so an
+        incomplete directory is never read as a complete one.
+    """
+
+    def __init__(self, out_dir=None, shard_size=1024):
+        if out_dir is None:
+            out_dir = cg_config.graph_samples
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        self.node_ids = []
+        self.node_index = dict()
+        self.node_types = []
+        self.node_type_names = []
+        self.edge_type_names = []
+        self.shards = []
+        self.directed = None
+        self._buffer = []
+        os.makedirs(out_dir, exist_ok=True)
+        manifest_fp = os.path.join(out_dir, 'manifest.json')
+        if os.path.isfile(manifest_fp):
+            os.remove(manifest_fp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def _intern_node(self, node_id, node_type):
+        idx = self.node_index.get(node_id)
+        if idx is None:
+            idx = len(self.node_ids)
+            self.node_index[node_id] = idx
+            self.node_ids.append(node_id)
+            self.node_types.append(self._type_code(
+                node_type,
+                self.node_type_names
+            ))
+        return idx
+
+    def _type_code(self, type_name, vocab):
+        if type_name not in vocab:
+            vocab.append(type_name)
+        return vocab.index(type_name)
+
+    def add(self, pair_graph, label):
+        """ Add a {'prediction_edge': ..., 'graph': ...} sample with the
+            given label (True/1 for co-occurring entity pairs).
+        """
+
+        G = pair_graph['graph']
+        if self.directed is None:
+            self.directed = G.is_directed()
+        local_index = dict()
+        nodes = []
+        for node_id, node_type in G.nodes(data='type'):
+            local_index[node_id] = len(nodes)
+            nodes.append(self._intern_node(node_id, node_type))
+        edges = []
+        edge_types = []
+        for u, v, edge_type in G.edges(data='type'):
+            edges.append((local_index[u], local_index[v]))
+            edge_types.append(self._type_code(
+                edge_type,
+                self.edge_type_names
+            ))
+        prediction_edge = pair_graph['prediction_edge']
+        self._buffer.append((
+            nodes,
+            edges,
+            edge_types,
+            int(label),
+            [
+                # entities of the prediction edge might have been pruned
+                self._intern_node(entity_id, None)
+                if entity_id not in self.node_index
+                else self.node_index[entity_id]
+                for entity_id in prediction_edge['edge']
+            ],
+            [
+                prediction_edge['cooc_start_year'],
+                prediction_edge['cooc_start_month']
+            ]
+        ))
+        if len(self._buffer) >= self.shard_size:
+            self._flush()
+
+    def _flush(self):
+        if len(self._buffer) == 0:
+            return
+        shard_dn = 'shard_{:05d}'.format(len(self.shards))
+        shard_dir = os.path.join(self.out_dir, shard_dn)
+        # shards are written to a temporary directory first, so that
+        # no shard of an earlier run is ever partially overwritten
+        tmp_shard_dir = shard_dir + '.tmp'
+        if os.path.isdir(tmp_shard_dir):
+            shutil.rmtree(tmp_shard_dir)
+        os.makedirs(tmp_shard_dir)
+        nodes, edges, edge_types, labels, pred_edges, cutoffs = zip(
+            *self._buffer
+        )
+        arrays = {
+            'nodes': np.fromiter(
+                (n for sample_nodes in nodes for n in sample_nodes),
+                dtype=np.int32
+            ),
+            'node_ptr': np.cumsum(
+                [0] + [len(sample_nodes) for sample_nodes in nodes]
+            ).astype(np.int64),
+            'edges': np.array(
+                [e for sample_edges in edges for e in sample_edges],
+                dtype=np.int32
+            ).reshape(-1, 2),
+            'edge_types': np.fromiter(
+                (t for sample_types in edge_types for t in sample_types),
+                dtype=np.uint8
+            ),
+            'edge_ptr': np.cumsum(
+                [0] + [len(sample_edges) for sample_edges in edges]
+            ).astype(np.int64),
+            'labels': np.array(labels, dtype=np.int8),
+            'prediction_edges': np.array(pred_edges, dtype=np.int32),
+            'cutoffs': np.array(cutoffs, dtype=np.int16),
+        }
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp_shard_dir, f'{name}.npy'), arr)
+        if os.path.isdir(shard_dir):
+            shutil.rmtree(shard_dir)
+        os.replace(tmp_shard_dir, shard_dir)
+        self.shards.append({
+            'dir': shard_dn,
+            'num_samples': len(self._buffer)
+        })
+        self._buffer = []
+
+    def close(self):
+        """ Write the remaining samples, the global ID table and the
+            manifest, and remove shards of earlier runs that are not
+            part of the manifest.
+        """
+
+        self._flush()
+        node_ids_fp = os.path.join(self.out_dir, 'node_ids.json')
+        with open(node_ids_fp + '.tmp', 'w') as f:
+            json.dump(self.node_ids, f)
+        os.replace(node_ids_fp + '.tmp', node_ids_fp)
+        node_types_fp = os.path.join(self.out_dir, 'node_types.npy')
+        with open(node_types_fp + '.tmp', 'wb') as f:
+            np.save(f, np.array(self.node_types, dtype=np.uint8))
+        os.replace(node_types_fp + '.tmp', node_types_fp)
+        # the manifest is written last and marks the samples as complete
+        manifest_fp = os.path.join(self.out_dir, 'manifest.json')
+        with open(manifest_fp + '.tmp', 'w') as f:
+            json.dump(
+                {
+                    'num_samples': sum(s['num_samples'] for s in self.shards),
+                    'directed': bool(self.directed),
+                    'node_type_names': self.node_type_names,
+                    'edge_type_names': self.edge_type_names,
+                    'shards': self.shards
+                },
+                f
+            )
+        os.replace(manifest_fp + '.tmp', manifest_fp)
+        shard_dns = set(s['dir'] for s in self.shards)
+        for dn in os.listdir(self.out_dir):
+            if dn.startswith('shard_') and dn not in shard_dns:
+                shutil.rmtree(os.path.join(self.out_dir, dn))
+
+
+class PairGraphReader:
+    """ Random access to and iteration over pair graph samples written
+        by PairGraphWriter. Shards are memory-mapped on first access.
+
+        Samples are returned as dicts with keys label, prediction_edge
+        (global node indices), cutoff ((year, month)), nodes (global node
+        indices), edges (E × 2 local node indices) and edge_types.
+    """
+
+    def __init__(self, in_dir=None, mmap=True):
+        if in_dir is None:
+            in_dir = cg_config.graph_samples
+        self.in_dir = in_dir
+        self.mmap_mode = 'r' if mmap else None
+        with open(os.path.join(in_dir, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(in_dir, 'node_ids.json')) as f:
+            self.node_ids = json.load(f)
+        self.node_types = np.load(os.path.join(in_dir, 'node_types.npy'))
+        self.node_type_names = self.manifest['node_type_names']
+        self.edge_type_names = self.manifest['edge_type_names']
+        self._shard_offsets = np.cumsum(
+            [0] + [s['num_samples'] for s in self.manifest['shards']]
+        )
+        self._shards = dict()
+
+    def __len__(self):
+        return self.manifest['num_samples']
+
+    def _shard(self, shard_idx):
+        if shard_idx not in self._shards:
+            shard_dir = os.path.join(
+                self.in_dir,
+                self.manifest['shards'][shard_idx]['dir']
+            )
+            self._shards[shard_idx] = {
+                fn[:-len('.npy')]: np.load(
+                    os.path.join(shard_dir, fn),
+                    mmap_mode=self.mmap_mode
+                )
+                for fn in os.listdir(shard_dir)
+                if fn.endswith('.npy')
+            }
+        return self._shards[shard_idx]
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        shard_idx = int(
+            np.searchsorted(self._shard_offsets, idx, side='right') - 1
+        )
+        shard = self._shard(shard_idx)
+        i = idx - self._shard_offsets[shard_idx]
+        node_start, node_end = shard['node_ptr'][i:i+2]
+        edge_start, edge_end = shard['edge_ptr'][i:i+2]
+        return {
+            'label': int(shard['labels'][i]),
+            'prediction_edge': tuple(shard['prediction_edges'][i].tolist()),
+            'cutoff': tuple(shard['cutoffs'][i].tolist()),
+            'nodes': shard['nodes'][node_start:node_end],
+            'edges': shard['edges'][edge_start:edge_end],
+            'edge_types': shard['edge_types'][edge_start:edge_end]
+        }
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def to_networkx(self, sample):
+        """ Return a sample’s graph as a (shallow) NetworkX graph.
+        """
+
+        if self.manifest['directed']:
+            G = nx.DiGraph()
+        else:
+            G = nx.Graph()
+        node_ids = [self.node_ids[n] for n in sample['nodes'].tolist()]
+        G.add_nodes_from(
+            (
+                node_id,
+                {'type': self.node_type_names[self.node_types[n]]}
+            )
+            for node_id, n in zip(node_ids, sample['nodes'].tolist())
+        )
+        G.add_edges_from(
+            (
+                node_ids[u],
+                node_ids[v],
+                {'type': self.edge_type_names[t]}
+            )
+            for (u, v), t in zip(
+                sample['edges'].tolist(),
+                sample['edge_types'].tolist()
+            )
+        )
+        return G
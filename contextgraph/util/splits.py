@@ -0,0 +1,154 @@
+""" Chronological train/validation/test splits of entity co-occurrence
+    edges, computed on flat arrays of interaction months
+"""
+
+import numpy as np
+from contextgraph.util.cooc import _incidence_from_files, _cooc_sequences
+from contextgraph.util.lazy import lazy_import
+
+nx = lazy_import('networkx')
+torch = lazy_import('torch')
+
+
+SPLIT_OUTPUTS = ['numpy', 'torch', 'networkx']
+
+
+class TemporalEdgeSplitter:
+    """ All co-occurrence interactions of entity pairs packed into flat
+        arrays, from which splits for arbitrary cutoff months are
+        derived with vectorized operations.
+
+        Months are counted as in the interaction_sequence of
+        contextgraph.util.graph.load_entity_combi_graph (i.e. from the
+        earliest co-occurrence year, see month_index). Only dated
+        co-occurrence papers are considered.
+
+        node_ids: optional list of entity IDs that determines the
+                  numerical node IDs used in splits (e.g. data.node_ids
+                  of contextgraph.util.torch.load_entity_combi_graph).
+                  Pairs with entities not in the list are dropped. By
+                  default, all entities of the incidence are used.
+    """
+
+    def __init__(self, final_node_set=False, node_ids=None):
+        incidence = _incidence_from_files(final_node_set=final_node_set)
+        cooc_seqs = _cooc_sequences(incidence)
+        self.beginning_of_time = cooc_seqs['beginning_of_time']
+        self.seq_ptr = cooc_seqs['seq_ptr']
+        self.seq_months = cooc_seqs['seq_months']
+        if node_ids is None:
+            node_ids = incidence['ent_ids']
+        self.node_ids = list(node_ids)
+        node_index = {node_id: idx for idx, node_id in enumerate(node_ids)}
+        ent_to_node = np.array(
+            [node_index.get(ent_id, -1) for ent_id in incidence['ent_ids']],
+            dtype=np.int64
+        )
+        self.src = ent_to_node[cooc_seqs['ent_a']]
+        self.dst = ent_to_node[cooc_seqs['ent_b']]
+        self.valid = (self.src >= 0) & (self.dst >= 0)
+        # interactions as sorted (pair, month) keys, so that the number
+        # of interactions of each pair before a month is a single
+        # searchsorted away
+        num_pairs = len(self.src)
+        self._stride = int(self.seq_months.max()) + 2 \
+            if len(self.seq_months) > 0 else 1
+        self._pair_offsets = np.arange(num_pairs) * self._stride
+        self._keys = np.repeat(
+            self._pair_offsets,
+            np.diff(self.seq_ptr)
+        ) + self.seq_months
+
+    def month_index(self, year, month):
+        """ Return the month index of (year, month).
+        """
+
+        return (year - (self.beginning_of_time or 0)) * 12 + month
+
+    def _to_month_index(self, cutoff):
+        if isinstance(cutoff, tuple):
+            return self.month_index(*cutoff)
+        return cutoff
+
+    def counts_before(self, cutoff):
+        """ Return the number of interactions of each pair before
+            cutoff (a month index or a (year, month) tuple).
+        """
+
+        cutoff = min(max(self._to_month_index(cutoff), 0), self._stride - 1)
+        return np.searchsorted(
+            self._keys,
+            self._pair_offsets + cutoff,
+            side='left'
+        ) - self.seq_ptr[:-1]
+
+    def split(
+        self,
+        val_start,
+        test_start,
+        test_end=None,
+        new_edges_only=False,
+        output='numpy'
+    ):
+        """ Split edges chronologically into
+            train: interactions before val_start
+            val:   interactions from val_start up to test_start
+            test:  interactions from test_start (up to test_end)
+            Cutoffs are month indices or (year, month) tuples. Edge
+            weights are the number of interactions within the split.
+
+            If new_edges_only is True, val and test only contain pairs
+            that did not interact before the split started.
+
+            Returns a dict with the keys train, val and test, holding
+            dicts of edge_index (2 × num edges) and edge_weight
+            (output numpy or torch), or nx.Graphs with a weight edge
+            attribute and all nodes (output networkx).
+        """
+
+        if output not in SPLIT_OUTPUTS:
+            raise ValueError(
+                f'Unknown output {output}, expected one of {SPLIT_OUTPUTS}'
+            )
+        before_val = self.counts_before(val_start)
+        before_test = self.counts_before(test_start)
+        if test_end is None:
+            before_end = np.diff(self.seq_ptr)
+        else:
+            before_end = self.counts_before(test_end)
+        weights = {
+            'train': before_val,
+            'val': before_test - before_val,
+            'test': before_end - before_test
+        }
+        masks = {name: self.valid & (w > 0) for name, w in weights.items()}
+        if new_edges_only:
+            masks['val'] &= before_val == 0
+            masks['test'] &= before_test == 0
+        splits = {}
+        for name, mask in masks.items():
+            splits[name] = self._split_output(
+                self.src[mask],
+                self.dst[mask],
+                weights[name][mask],
+                output
+            )
+        return splits
+
+    def _split_output(self, src, dst, weights, output):
+        if output == 'networkx':
+            G = nx.Graph()
+            G.add_nodes_from(self.node_ids)
+            G.add_weighted_edges_from(zip(
+                [self.node_ids[i] for i in src.tolist()],
+                [self.node_ids[i] for i in dst.tolist()],
+                weights.tolist()
+            ))
+            return G
+        edge_index = np.stack([src, dst])
+        if output == 'torch':
+            return {
+                'edge_index': torch.from_numpy(edge_index),
+                'edge_weight': torch.from_numpy(weights)
+            }
+        return {'edge_index': edge_index, 'edge_weight': weights}
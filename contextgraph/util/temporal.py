@@ -0,0 +1,157 @@
+""" Temporal index over the paper nodes of a graph for fast
+    "graph as of month M" views
+"""
+
+import weakref
+import numpy as np
+from contextgraph.util.compact import CompactGraph
+from contextgraph.util.cooc import _pack_date
+from contextgraph.util.lazy import lazy_import
+
+nx = lazy_import('networkx')
+
+
+# packed dates of nodes that are never (non-paper nodes) or always
+# (nodes without any data) removed from a snapshot
+# (TODO: also consider other enitites that should be removed)
+_ALWAYS_KEEP = -1
+_NEVER_KEEP = np.iinfo(np.int64).max
+
+# temporal indices of graphs, dropped along with their graph
+_temporal_indices = weakref.WeakKeyDictionary()
+
+
+def _root_graph(G):
+    """ Return the graph a NetworkX graph view is based on
+        (or the graph itself).
+    """
+
+    while hasattr(G, '_graph'):
+        G = G._graph
+    return G
+
+
+def _build_temporal_index(G):
+    """ Build a temporal index of a NetworkX graph or CompactGraph.
+
+        Returns a dict containing each node’s packed publication date
+        (node_dates), a mask of the nodes kept in every snapshot
+        (always_keep), and indices of paper nodes sorted by publication
+        date (paper_order, paper_dates). For NetworkX graphs, the node
+        IDs in index order are included as a list (node_ids) and an
+        object array (node_id_array), along with a node ID to index
+        mapping (node_index).
+    """
+
+    if isinstance(G, CompactGraph):
+        node_ids = None
+        node_id_array = None
+        node_index = None
+        node_dates = np.full(len(G), _ALWAYS_KEEP, dtype=np.int64)
+        if 'paper' in G.node_type_names:
+            is_paper = G.node_types == G.node_type_names.index('paper')
+            node_dates[is_paper] = _pack_date(
+                G.node_years[is_paper],
+                G.node_months[is_paper]
+            )
+    else:
+        node_ids = list(G.nodes)
+        node_id_array = np.fromiter(node_ids, dtype=object, count=len(G))
+        node_index = {node_id: idx for idx, node_id in enumerate(node_ids)}
+        node_dates = np.fromiter(
+            (
+                _NEVER_KEEP if len(node_data) == 0 else
+                _ALWAYS_KEEP if node_data['type'] != 'paper' else
+                (node_data['year'] + 1) * 16 + (node_data['month'] + 1)
+                for node_data in G.nodes.values()
+            ),
+            dtype=np.int64,
+            count=len(node_ids)
+        )
+    is_paper = (node_dates != _ALWAYS_KEEP) & (node_dates != _NEVER_KEEP)
+    paper_idxs = np.flatnonzero(is_paper)
+    order = np.argsort(node_dates[paper_idxs], kind='stable')
+    return {
+        'num_nodes': len(node_dates),
+        'node_ids': node_ids,
+        'node_id_array': node_id_array,
+        'node_index': node_index,
+        'node_dates': node_dates,
+        'always_keep': node_dates == _ALWAYS_KEEP,
+        'paper_order': paper_idxs[order],
+        'paper_dates': node_dates[paper_idxs][order]
+    }
+
+
+def _temporal_index(G):
+    """ Return the (cached) temporal index of G. For NetworkX graph
+        views, the index of the underlying graph is used.
+
+        The index is rebuilt if the number of nodes changed, but
+        otherwise assumes that the graph is not modified.
+    """
+
+    if not isinstance(G, CompactGraph):
+        G = _root_graph(G)
+    index = _temporal_indices.get(G)
+    if index is None or index['num_nodes'] != len(G):
+        index = _build_temporal_index(G)
+        _temporal_indices[G] = index
+    return index
+
+
+def _snapshot_mask(index, year, month):
+    """ Return a boolean mask over the indexed nodes that is True for
+        all nodes except papers published in or after (year, month).
+    """
+
+    mask = index['always_keep'].copy()
+    num_before = np.searchsorted(
+        index['paper_dates'],
+        _pack_date(year, month),
+        side='left'
+    )
+    mask[index['paper_order'][:num_before]] = True
+    return mask
+
+
+def snapshot(G, year, month):
+    """ Return the graph G as of (year, month), i.e. without papers
+        published in or after that month.
+
+        For NetworkX graphs (and graph views) a read-only subgraph view
+        is returned, for CompactGraphs a new CompactGraph.
+    """
+
+    index = _temporal_index(G)
+    mask = _snapshot_mask(index, year, month)
+    if isinstance(G, CompactGraph):
+        return G._subgraph_from_mask(mask)
+    node_index = index['node_index']
+    return nx.subgraph_view(
+        G,
+        filter_node=lambda node_id: mask[node_index[node_id]]
+    )
+
+
+def _snapshot_node_ids(G, year, month):
+    """ Return the nodes of NetworkX graph (view) G that are part
+        of its snapshot as of (year, month).
+    """
+
+    index = _temporal_index(G)
+    if _root_graph(G) is G:
+        # all indexed nodes are in G, select with a binary search
+        # over the paper dates instead of going through the nodes
+        mask = _snapshot_mask(index, year, month)
+        return index['node_id_array'][mask].tolist()
+    # graph views only contain some of the indexed nodes
+    node_index = index['node_index']
+    node_ids = list(G.nodes)
+    idxs = np.fromiter(
+        (node_index[node_id] for node_id in node_ids),
+        dtype=np.int64,
+        count=len(node_ids)
+    )
+    keep = index['node_dates'][idxs] < _pack_date(year, month)
+    return [node_id for node_id, k in zip(node_ids, keep.tolist()) if k]
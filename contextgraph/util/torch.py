@@ -2,20 +2,155 @@
 """
 
 import os
-import json
 import numpy as np
-import networkx as nx
-from torch_geometric.utils.convert import from_networkx
-from contextgraph.util.graph import _load_node_tuples,\
-                                    _load_entity_combi_edge_tuples
-from sklearn.feature_extraction.text import TfidfVectorizer
+from array import array
+from contextgraph import config as cg_config
+from contextgraph.util.compact import NO_DATE
+from contextgraph.util.graph import _iter_node_tuples,\
+                                    _load_node_tuples,\
+                                    _iter_edge_tuples,\
+                                    _file_fingerprint,\
+                                    _cached
+from contextgraph.util.cooc import _incidence_from_files,\
+                                   _cooc_counts,\
+                                   _cooc_pairs,\
+                                   _pack_date
+from contextgraph.util.embeddings import get_node_embeddings
+from contextgraph.util.lazy import lazy_import
 
+nx = lazy_import('networkx')
+sp = lazy_import('scipy.sparse')
+torch = lazy_import('torch')
+pyg_data = lazy_import('torch_geometric.data')
+sk_text = lazy_import('sklearn.feature_extraction.text')
 
-def load_full_graph():
-    """ Return full graph in a form usable with torch geometric.
+
+# version of the processed PyG graph objects;
+# increase when changing how they are built to invalidate caches
+PROCESSED_VERSION = 1
+
+
+def _embeddings_fingerprint():
+    """ Return a string identifying the current state of the
+        description embedding matrix files.
+    """
+
+    parts = []
+    for fn in [cg_config.graph_embs_fn, cg_config.graph_embs_idx_fn]:
+        fp = os.path.join(cg_config.graph_embs_dir, fn)
+        if os.path.isfile(fp):
+            parts.append(f'{fn}\t{_file_fingerprint(fp)}')
+        else:
+            parts.append(f'{fn}\tmissing')
+    return '\n'.join(parts)
+
+
+def _cached_pyg(name, options, build_fn):
+    """ Return the result of build_fn, using a processed PyG graph
+        object in cg_config.graph_cache_dir if one exists for the
+        current graph data, the given options and PROCESSED_VERSION.
     """
 
-    raise NotImplementedError
+    options = dict(options, version=PROCESSED_VERSION)
+    return _cached(
+        name,
+        options,
+        build_fn,
+        dump_fn=lambda data, fp: torch.save(data, fp),
+        # graph objects rather than plain tensors
+        load_fn=lambda fp: torch.load(fp, weights_only=False)
+    )
+
+
+def load_full_graph(with_contexts=False, use_cache=True):
+    """ Return full graph in a form usable with torch geometric,
+        i.e. as a HeteroData object with one node store per node
+        type (paper, method, dataset, task, model, area, connection
+        (i.e. collection) and, if with_contexts is True, context) and
+        one edge_index per (<tail type>, <edge type>, <head type>).
+
+        Nodes get type-local numerical IDs in the order they are
+        read; data[<node type>].node_ids maps them back to node IDs.
+        Node types with dates also get year and month (-1 if unknown).
+
+        If use_cache is True, the processed HeteroData object is stored
+        in and loaded from cg_config.graph_cache_dir, and rebuilt
+        whenever files in cg_config.graph_data_dir change.
+    """
+
+    if use_cache:
+        return _cached_pyg(
+            f'pyg_full_graph_c{with_contexts:d}',
+            {'with_contexts': with_contexts},
+            lambda: load_full_graph(
+                with_contexts=with_contexts,
+                use_cache=False
+            )
+        )
+
+    # assign type-local IDs in a single pass over the nodes
+    node_index = dict()  # node ID -> (node type, type-local ID)
+    node_ids = dict()  # node type -> node IDs
+    node_years = dict()  # node type -> array of years
+    node_months = dict()  # node type -> array of months
+    for (node_id, node_attrs) in _iter_node_tuples(
+        with_contexts=with_contexts
+    ):
+        if node_id in node_index:
+            # keep first occurrence of duplicate IDs
+            continue
+        node_type = node_attrs['type']
+        if node_type not in node_ids:
+            node_ids[node_type] = []
+            node_years[node_type] = array('h')
+            node_months[node_type] = array('h')
+        node_index[node_id] = (node_type, len(node_ids[node_type]))
+        node_ids[node_type].append(node_id)
+        node_years[node_type].append(node_attrs.get('year', NO_DATE))
+        node_months[node_type].append(node_attrs.get('month', NO_DATE))
+    # collect edges per (tail type, edge type, head type)
+    edges = dict()  # edge store key -> (tail IDs, head IDs)
+    for (tail_id, head_id, edge_attrs) in _iter_edge_tuples(
+        with_contexts=with_contexts,
+        final_node_set=node_index
+    ):
+        tail_type, tail_idx = node_index[tail_id]
+        head_type, head_idx = node_index[head_id]
+        key = (tail_type, edge_attrs['type'], head_type)
+        if key not in edges:
+            edges[key] = (array('q'), array('q'))
+        edges[key][0].append(tail_idx)
+        edges[key][1].append(head_idx)
+    del node_index
+
+    data = pyg_data.HeteroData()
+    for node_type, type_node_ids in node_ids.items():
+        data[node_type].num_nodes = len(type_node_ids)
+        data[node_type].node_ids = type_node_ids
+        years = np.frombuffer(node_years[node_type], dtype=np.int16)
+        if (years != NO_DATE).any():
+            months = np.frombuffer(node_months[node_type], dtype=np.int16)
+            data[node_type].year = torch.from_numpy(
+                np.where(years == NO_DATE, -1, years).astype(np.int64)
+            )
+            data[node_type].month = torch.from_numpy(
+                np.where(months == NO_DATE, -1, months).astype(np.int64)
+            )
+    for key, (tails, heads) in edges.items():
+        edge_index = np.stack([
+            np.frombuffer(tails, dtype=np.int64),
+            np.frombuffer(heads, dtype=np.int64)
+        ])
+        # same as NetworkX: merge duplicate edges
+        num_heads = len(node_ids[key[2]])
+        _, first = np.unique(
+            edge_index[0] * num_heads + edge_index[1],
+            return_index=True
+        )
+        data[key].edge_index = torch.from_numpy(
+            edge_index[:, np.sort(first)]
+        )
+    return data
 
 
 def _get_artifact_description(node_attrs, G):
@@ -54,14 +189,32 @@ def _get_artifact_description(node_attrs, G):
     return descr
 
 
-def _embed_string_atrs_tfidf(node_attrs):
+def _embed_string_atrs_tfidf(
+    node_attrs,
+    max_features=None,
+    hash_features=None,
+    dtype=np.float32
+):
     """ Transform a list of node string attributes (one attr per node)
-        into tfidf vectors
+        into tfidf vectors (returned as a scipy CSR matrix)
+
+        max_features caps the vocabulary to the most frequent terms.
+        If hash_features is given, terms are instead hashed into that
+        many features, which needs no vocabulary at all.
     """
 
-    vectorizer = TfidfVectorizer(
-        max_features=None,
+    if hash_features is not None:
+        counts = sk_text.HashingVectorizer(
+            n_features=hash_features,
+            alternate_sign=False,
+            norm=None,
+            dtype=dtype
+        ).transform(node_attrs)
+        return sk_text.TfidfTransformer().fit_transform(counts).astype(dtype)
+    vectorizer = sk_text.TfidfVectorizer(
+        max_features=max_features,
         stop_words=None,
+        dtype=dtype
         # consider limiting the number of features to reduce embeding
         # size. NOTE however, that vocab cut-off is done based on
         # term frequency (might remove important but rare words (proper
@@ -73,90 +226,239 @@ def _embed_string_atrs_tfidf(node_attrs):
     return tfidf_vectors
 
 
-def load_entity_combi_graph():
-    """ Return entity combi graph in a form usable with torch geometric.
+def _entity_descriptions():
+    """ Return descriptions of all entity nodes (same order as
+        _iter_node_tuples(entities_only=True)).
     """
 
-    # load node and edge tuples (with full, non-numeric features)
     node_tuples = _load_node_tuples(entities_only=True)
+    G_lookup = nx.Graph()
+    G_lookup.add_nodes_from(node_tuples)
+    return [
+        _get_artifact_description(ntup[1], G_lookup) or ''
+        for ntup in node_tuples
+    ]
+
+
+def _sparse_to_torch(mat, layout='csr'):
+    """ Convert a scipy sparse matrix into a torch sparse tensor
+        with the given layout ('csr' or 'coo').
+    """
+
+    if layout == 'csr':
+        mat = mat.tocsr()
+        return torch.sparse_csr_tensor(
+            torch.from_numpy(mat.indptr.astype(np.int64)),
+            torch.from_numpy(mat.indices.astype(np.int64)),
+            torch.from_numpy(mat.data),
+            size=mat.shape
+        )
+    if layout == 'coo':
+        mat = mat.tocoo()
+        return torch.sparse_coo_tensor(
+            torch.from_numpy(np.stack([mat.row, mat.col]).astype(np.int64)),
+            torch.from_numpy(mat.data),
+            size=mat.shape
+        ).coalesce()
+    raise ValueError(f'unknown sparse layout "{layout}"')
+
+
+# numerical codes of entity types in node features
+ENTITY_TYPE_CODES = {
+    'dataset': 0,
+    'method': 1,
+    'model': 2,
+    'task': 3
+}
+
+
+def _entity_combi_graph_arrays(with_edge_times=False, with_embeddings=True):
+    """ Return the entity combi graph as a dict of numpy arrays
+
+        node_ids:     entity IDs (position = numerical node ID)
+        node_types:   entity type codes (see ENTITY_TYPE_CODES)
+        descr_embs:   (only if with_embeddings is True) (num nodes ×
+                      embedding size) description embeddings
+        edge_index:   (2 × num edges) directed edges, i.e. both
+                      directions of each co-occurrence, ordered as
+                      in torch_geometric’s from_networkx
+        edge_weight:  number of co-occurrence papers of each edge
+        edge_time:    (only if with_edge_times is True) packed (year,
+                      month) of each edge’s earliest co-occurrence paper
+                      (see contextgraph.util.cooc._pack_date)
+        edge_pair:    (only if with_edge_times is True) entity pair of
+                      each edge, the packed dates of whose co-occurrence
+                      papers are cooc_dates[cooc_ptr[p]:cooc_ptr[p+1]]
+                      (sorted)
+    """
+
+    # only IDs and types of nodes needed
+    node_ids = []
+    node_types = []
+    for (node_id, node_attrs) in _iter_node_tuples(entities_only=True):
+        node_ids.append(node_id)
+        node_types.append(ENTITY_TYPE_CODES[node_attrs['type']])
+    # same as building a graph: duplicate IDs map to their last node
+    node_index = {node_id: idx for idx, node_id in enumerate(node_ids)}
     # combi_edge: transform paper nodes into relationship between artifacts
     # (method, model, dataset, task)
-    edge_tuples = _load_entity_combi_edge_tuples(
-        final_node_set=set([ntup[0] for ntup in node_tuples]),
-        scheme='weight'  # use weight scheme b/c it gives us a single integer
-        #                  feature for edges rather than a variable length list
+    # use weight scheme b/c it gives us a single integer feature
+    # for edges rather than a variable length list
+    incidence = _incidence_from_files(final_node_set=node_index)
+    if with_edge_times:
+        # same pairs in the same order, plus co-occurrence papers
+        cooc_pairs = _cooc_pairs(incidence)
+        ent_a = cooc_pairs['ent_a']
+        ent_b = cooc_pairs['ent_b']
+        weights = np.diff(cooc_pairs['ppr_ptr'])
+        times = _pack_date(
+            cooc_pairs['start_year'],
+            cooc_pairs['start_month']
+        )
+        cooc_dates = _pack_date(
+            incidence['ppr_years'][cooc_pairs['pprs']],
+            incidence['ppr_months'][cooc_pairs['pprs']]
+        )
+        cooc_dates = cooc_dates[np.lexsort((
+            cooc_dates,
+            np.repeat(np.arange(len(weights)), weights)
+        ))]
+    else:
+        ent_a, ent_b, weights = _cooc_counts(incidence)
+    ent_to_node = np.array(
+        [node_index[ent_id] for ent_id in incidence['ent_ids']],
+        dtype=np.int64
     )
-    # build networkx graph for later conversion
-    G = nx.Graph()
-    # convert node features
-    node_tuples_numerical = []
-    node_id_numerical_map = {}
-    node_type_map = {
-        'dataset': 0,
-        'method': 1,
-        'model': 2,
-        'task': 3
+    src = ent_to_node[ent_a]
+    dst = ent_to_node[ent_b]
+    # an undirected graph’s edges per node are in order of insertion;
+    # from_networkx lists them node by node in both directions
+    tails = np.concatenate([src, dst])
+    heads = np.concatenate([dst, src])
+    edge_pos = np.concatenate([np.arange(len(src))] * 2)
+    order = np.lexsort((edge_pos, tails))
+    arrays = {
+        'node_ids': node_ids,
+        'node_types': np.array(node_types, dtype=np.int64),
+        'edge_index': np.stack([tails[order], heads[order]]),
+        'edge_weight': np.concatenate([weights, weights])[order]
     }
-    # # prepare LLM node description embeddings
-    emb_dir = 'combigraph_mpnet-base_embeddings'
-    idmap_fn = 'nodeid_to_fn.json'
-    with open(os.path.join(emb_dir, idmap_fn)) as f:
-        nodeid_to_fn = json.load(f)
-    # # # prepare tfidf node description embeddings
-    # G_lookup = nx.Graph()
-    # G_lookup.add_nodes_from(node_tuples)
-    # node_descrs = [
-    #     _get_artifact_description(ntup[1], G_lookup)
-    #     for ntup in node_tuples
-    # ]
-    # node_descr_vecs = _embed_string_atrs_tfidf(node_descrs)
-    # # covert other feautures
-    for new_node_id, ntup in enumerate(node_tuples):
-        old_node_id = ntup[0]
-        nattrs = ntup[1]
-        node_id_numerical_map[old_node_id] = new_node_id  # assign numerical ID
-        emb_fp = os.path.join(
-            emb_dir,
-            nodeid_to_fn[old_node_id]
+    if with_embeddings:
+        # LLM node description embeddings
+        # (gathered from the memory-mapped embedding matrix in one go)
+        arrays['descr_embs'] = get_node_embeddings(node_ids)
+    if with_edge_times:
+        arrays['edge_time'] = np.concatenate([times, times])[order]
+        arrays['edge_pair'] = edge_pos[order]
+        arrays['cooc_ptr'] = cooc_pairs['ppr_ptr']
+        arrays['cooc_dates'] = cooc_dates
+    return arrays
+
+
+def _entity_combi_node_features(arrays):
+    """ Return node features [numerical ID, type code, description
+        embedding] for _entity_combi_graph_arrays’ output.
+    """
+
+    return torch.cat(
+        [
+            torch.arange(len(arrays['node_ids'])).view(-1, 1),
+            torch.from_numpy(arrays['node_types']).view(-1, 1),
+            torch.from_numpy(arrays['descr_embs'])
+        ],
+        dim=-1
+    )
+
+
+def load_entity_combi_graph(
+    use_cache=True,
+    features='embedding',
+    tfidf_max_features=None,
+    tfidf_hash_features=None,
+    sparse_layout='csr'
+):
+    """ Return entity combi graph in a form usable with torch geometric.
+
+        Node features x are [numerical ID, type code, description
+        features], the edge feature edge_attr is the number of
+        co-occurrence papers. data.node_ids maps numerical node IDs
+        back to entity IDs.
+
+        features:
+            - embedding: precomputed transformer based description
+              embeddings (dense)
+            - tfidf: tfidf vectors of descriptions, kept sparse
+              throughout; x is a torch sparse tensor (sparse_layout
+              'csr' or 'coo'). The vocabulary can be capped with
+              tfidf_max_features or replaced by hashing terms into
+              tfidf_hash_features features.
+
+        If use_cache is True, the processed Data object is stored in
+        and loaded from cg_config.graph_cache_dir, and rebuilt whenever
+        files in cg_config.graph_data_dir or (for embedding features)
+        the description embedding matrix change.
+    """
+
+    if features not in ['embedding', 'tfidf']:
+        raise ValueError(f'unknown features "{features}"')
+
+    if use_cache:
+        options = {'features': features}
+        if features == 'embedding':
+            options['embeddings'] = _embeddings_fingerprint()
+        else:
+            options.update({
+                'tfidf_max_features': tfidf_max_features,
+                'tfidf_hash_features': tfidf_hash_features,
+                'sparse_layout': sparse_layout
+            })
+        return _cached_pyg(
+            f'pyg_entity_combi_graph_{features}',
+            options,
+            lambda: load_entity_combi_graph(
+                use_cache=False,
+                features=features,
+                tfidf_max_features=tfidf_max_features,
+                tfidf_hash_features=tfidf_hash_features,
+                sparse_layout=sparse_layout
+            )
         )
-        descr_emb = np.load(emb_fp)
-        attribs_num = {
-            'id': new_node_id,  # needed as explicit attribute here?
-            'type': node_type_map[nattrs['type']],
-            'description': descr_emb
-            # 'description': 0
-            # 'description': node_descr_vecs[new_node_id].todense()
-            # ^ currently fails with
-            # AttributeError: 'matrix' object has no attribute 'dim'
-            # see:
-            # https://github.com/pyg-team/pytorch_geometric/issues/4445
-            # https://github.com/pyg-team/pytorch_geometric/pull/4486
-
-            # 'num_papers': nattrs.get('num_papers', -1)  # only meths & dsets
-            # TODO: figure out/discuss how to handle different node types
-            #       (i.e. a heterogeneous graph)
-        }
-        node_tuples_numerical.append(
-            (new_node_id, attribs_num)
+
+    arrays = _entity_combi_graph_arrays(
+        with_embeddings=(features == 'embedding')
+    )
+    # # TODO: figure out/discuss how to handle different node types
+    # #       (i.e. a heterogeneous graph)
+    # #       and other features (e.g. num_papers of meths & dsets)
+    if features == 'embedding':
+        x = _entity_combi_node_features(arrays)
+    else:
+        node_descr_vecs = _embed_string_atrs_tfidf(
+            _entity_descriptions(),
+            max_features=tfidf_max_features,
+            hash_features=tfidf_hash_features
         )
-    G.add_nodes_from(node_tuples_numerical)
-    # convert edge features
-    edge_tuples_numerical = []
-    for etup in edge_tuples:
-        attribs_num = {
-            'weight': etup[2].get('weight', -1)
-        }
-        edge_tuples_numerical.append(
-            (
-                node_id_numerical_map[etup[0]],  # numerical node ID
-                node_id_numerical_map[etup[1]],  # numerical node ID
-                attribs_num
-            )
+        x = _sparse_to_torch(
+            sp.hstack(
+                [
+                    sp.csr_matrix(np.stack(
+                        [
+                            np.arange(len(arrays['node_ids'])),
+                            arrays['node_types']
+                        ],
+                        axis=1
+                    ).astype(np.float32)),
+                    node_descr_vecs
+                ],
+                format='csr',
+                dtype=np.float32
+            ),
+            layout=sparse_layout
         )
-    G.add_edges_from(edge_tuples_numerical)
-    data = from_networkx(
-        G,
-        group_node_attrs=['id', 'type', 'description'],
-        group_edge_attrs=['weight']
+    data = pyg_data.Data(
+        x=x,
+        edge_index=torch.from_numpy(arrays['edge_index']),
+        edge_attr=torch.from_numpy(arrays['edge_weight']).view(-1, 1)
     )
+    data.node_ids = arrays['node_ids']
     return data
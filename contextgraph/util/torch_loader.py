@@ -0,0 +1,394 @@
+""" Neighbor-sampled mini-batches for temporal link prediction with
+    pytorch geometric, over the entity combi graph or the full graph
+    (optionally with contexts)
+"""
+
+import random
+import numpy as np
+from contextgraph.util.cooc import _pack_date
+from contextgraph.util.graph import load_full_graph,\
+                                    _sample_prediction_edges_from_files
+from contextgraph.util.neighborhood import _sample_per_segment
+from contextgraph.util.temporal import _temporal_index
+from contextgraph.util.torch import _entity_combi_graph_arrays,\
+                                    _entity_combi_node_features,\
+                                    ENTITY_TYPE_CODES
+from contextgraph.util.lazy import lazy_import
+
+torch = lazy_import('torch')
+torch_data = lazy_import('torch.utils.data')
+pyg_data = lazy_import('torch_geometric.data')
+
+
+SAMPLING_GRAPHS = ['combi', 'full']
+
+
+def _to_sampling_csr(src, dst, num_nodes, edge_arrays):
+    """ Return CSR arrays (indptr, nbrs) of the edges src -> dst, i.e.
+        the neighbors of node u are nbrs[indptr[u]:indptr[u+1]], along
+        with the per edge arrays in edge_arrays in the same order.
+    """
+
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+    return (
+        indptr,
+        dst[order],
+        {name: arr[order] for (name, arr) in edge_arrays.items()}
+    )
+
+
+def _combi_sampling_graph():
+    """ Return the entity combi graph as sampling arrays (see
+        LinkNeighborSampler). Edges exist from their earliest
+        co-occurrence paper on.
+    """
+
+    arrays = _entity_combi_graph_arrays(with_edge_times=True)
+    indptr, nbrs, nbr_arrays = _to_sampling_csr(
+        arrays['edge_index'][0],
+        arrays['edge_index'][1],
+        len(arrays['node_ids']),
+        {'times': arrays['edge_time'], 'pairs': arrays['edge_pair']}
+    )
+    return {
+        # same as building a graph: duplicate IDs map to their last node
+        'entity_index': {
+            node_id: idx for idx, node_id in enumerate(arrays['node_ids'])
+        },
+        'x': _entity_combi_node_features(arrays),
+        'indptr': indptr,
+        'nbrs': nbrs,
+        'nbr_times': nbr_arrays['times'],
+        'nbr_pairs': nbr_arrays['pairs'],
+        'cooc_ptr': arrays['cooc_ptr'],
+        'cooc_dates': arrays['cooc_dates']
+    }
+
+
+def _full_sampling_graph(with_contexts=False):
+    """ Return the full graph as undirected sampling arrays (see
+        LinkNeighborSampler). Papers are dated as in
+        contextgraph.util.temporal.snapshot, contexts as their paper,
+        and all other nodes exist from the start. Edges exist from the
+        later date of their two nodes on.
+    """
+
+    CG = load_full_graph(backend='csr', with_contexts=with_contexts)
+    num_nodes = len(CG)
+    src = np.repeat(
+        np.arange(num_nodes, dtype=np.int64),
+        np.diff(CG.out_indptr)
+    )
+    dst = CG.out_indices.astype(np.int64)
+    node_dates = _temporal_index(CG)['node_dates'].copy()
+    if 'context' in CG.node_type_names:
+        # contexts are part_of the paper they appear in
+        in_paper = (
+            CG.node_types[src] == CG.node_type_names.index('context')
+        ) & (
+            CG.node_types[dst] == CG.node_type_names.index('paper')
+        )
+        node_dates[src[in_paper]] = node_dates[dst[in_paper]]
+    times = np.maximum(node_dates[src], node_dates[dst])
+    indptr, nbrs, nbr_arrays = _to_sampling_csr(
+        np.concatenate([src, dst]),
+        np.concatenate([dst, src]),
+        num_nodes,
+        {
+            'times': np.concatenate([times, times]),
+            'types': np.concatenate([CG.out_types, CG.out_types])
+        }
+    )
+    entity_codes = [
+        code for (code, name) in enumerate(CG.node_type_names)
+        if name in ENTITY_TYPE_CODES
+    ]
+    entity_idxs = np.flatnonzero(np.isin(CG.node_types, entity_codes))
+    return {
+        'entity_index': {
+            CG.node_ids[idx]: idx for idx in entity_idxs.tolist()
+        },
+        'node_types': CG.node_types,
+        'indptr': indptr,
+        'nbrs': nbrs.astype(np.int32),
+        'nbr_times': nbr_arrays['times'].astype(np.int32),
+        'nbr_types': nbr_arrays['types']
+    }
+
+
+def _cooc_count_keys(cooc_ptr, cooc_dates):
+    """ Return sorted search keys <pair> × stride + <date> of all
+        co-occurrence papers, and the stride.
+    """
+
+    stride = int(cooc_dates.max()) + 2 if len(cooc_dates) > 0 else 1
+    pairs = np.repeat(np.arange(len(cooc_ptr) - 1), np.diff(cooc_ptr))
+    return pairs * stride + cooc_dates, stride
+
+
+def _cooc_counts_before(keys, stride, cooc_ptr, pairs, cutoffs):
+    """ Return the number of co-occurrence papers of each pair that
+        were published before the respective cutoff.
+    """
+
+    cutoffs = np.clip(cutoffs, 0, stride - 1)
+    return np.searchsorted(
+        keys,
+        pairs * stride + cutoffs,
+        side='left'
+    ) - cooc_ptr[pairs]
+
+
+class LinkNeighborSampler:
+    """ Collate function that turns a list of prediction edge indices
+        into a mini-batch.
+
+        graph is a dict of sampling arrays
+            indptr, nbrs    CSR adjacency, the neighbors of node u are
+                            nbrs[indptr[u]:indptr[u+1]]
+            nbr_times       packed (year, month) from which each
+                            adjacency entry exists (see
+                            contextgraph.util.cooc._pack_date)
+        and optionally
+            x               node features
+            node_types      node type codes
+            nbr_types       edge type codes of adjacency entries
+            nbr_pairs,      co-occurrence pair of each adjacency entry,
+            cooc_ptr,       the packed dates of whose papers are
+            cooc_dates      cooc_dates[cooc_ptr[p]:cooc_ptr[p+1]]
+                            (sorted)
+
+        For each prediction edge, the neighborhood of its two nodes is
+        sampled separately (fanouts[i] neighbors per node in hop i,
+        None for all), only following edges that existed before the
+        prediction edge’s cutoff date (the same constraint
+        get_pair_graphs applies when pruning pair graphs). Batches are
+        Data objects with
+            x / node_type     features / type codes of sampled nodes
+                              (if given)
+            edge_index        sampled edges (messages flow from
+                              neighbors to the nodes they were sampled
+                              for)
+            edge_type         edge type codes (if given)
+            edge_attr         number of co-occurrence papers of each
+                              edge published before the prediction
+                              edge’s cutoff (if co-occurrences given)
+            n_id              graph node index of each node
+            batch             prediction edge of each node
+            edge_label_index  local indices of the prediction edges’
+                              nodes
+            edge_label        1 for co-occurring pairs, else 0
+    """
+
+    def __init__(
+        self,
+        graph,
+        pred_edge_index,
+        pred_labels,
+        pred_times,
+        fanouts
+    ):
+        self.num_nodes = len(graph['indptr']) - 1
+        self.indptr = graph['indptr']
+        self.nbrs = graph['nbrs']
+        self.nbr_times = graph['nbr_times']
+        self.x = graph.get('x')
+        self.node_types = graph.get('node_types')
+        self.nbr_types = graph.get('nbr_types')
+        self.nbr_pairs = graph.get('nbr_pairs')
+        if self.nbr_pairs is not None:
+            self.cooc_ptr = graph['cooc_ptr']
+            self.cooc_keys, self.cooc_stride = _cooc_count_keys(
+                graph['cooc_ptr'],
+                graph['cooc_dates']
+            )
+        self.pred_edge_index = pred_edge_index
+        self.pred_labels = pred_labels
+        self.pred_times = pred_times
+        self.fanouts = fanouts
+
+    def __len__(self):
+        return len(self.pred_labels)
+
+    def __call__(self, idxs):
+        # seeded from torch so that DataLoader worker seeding applies
+        rng = np.random.default_rng(int(torch.randint(2**62, ())))
+        idxs = np.asarray(idxs, dtype=np.int64)
+        num_preds = len(idxs)
+        cutoffs = self.pred_times[idxs]
+        # nodes are identified by <prediction edge> × num_nodes + <node>
+        # so that neighborhoods of prediction edges stay disjoint
+        frontier_ex = np.concatenate([np.arange(num_preds)] * 2)
+        frontier = np.concatenate([
+            self.pred_edge_index[0][idxs],
+            self.pred_edge_index[1][idxs]
+        ])
+        seed_keys = frontier_ex * self.num_nodes + frontier
+        node_keys = [np.unique(seed_keys)]
+        visited = node_keys[0]
+        frontier_ex = visited // self.num_nodes
+        frontier = visited % self.num_nodes
+        edge_srcs = []
+        edge_dsts = []
+        edge_pos = []
+        for fanout in self.fanouts:
+            if len(frontier) == 0:
+                break
+            starts = self.indptr[frontier]
+            lens = self.indptr[frontier + 1] - starts
+            seg = np.repeat(np.arange(len(frontier)), lens)
+            pos = np.arange(lens.sum()) - np.repeat(
+                np.cumsum(lens) - lens,
+                lens
+            )
+            pos += np.repeat(starts, lens)
+            # only edges that existed before the cutoff
+            before = self.nbr_times[pos] < cutoffs[frontier_ex[seg]]
+            seg, pos = seg[before], pos[before]
+            if fanout is not None and len(seg) > 0:
+                keep = _sample_per_segment(
+                    seg,
+                    np.ones(len(seg)),
+                    fanout,
+                    rng
+                )
+                seg, pos = seg[keep], pos[keep]
+            ex = frontier_ex[seg]
+            nbr_keys = ex * self.num_nodes + self.nbrs[pos]
+            edge_srcs.append(nbr_keys)
+            edge_dsts.append(ex * self.num_nodes + frontier[seg])
+            edge_pos.append(pos)
+            new_keys = np.unique(nbr_keys)
+            new_keys = new_keys[~np.isin(new_keys, visited)]
+            node_keys.append(new_keys)
+            visited = np.concatenate([visited, new_keys])
+            frontier_ex = new_keys // self.num_nodes
+            frontier = new_keys % self.num_nodes
+
+        node_keys = np.concatenate(node_keys)
+        key_order = np.argsort(node_keys)
+        sorted_keys = node_keys[key_order]
+
+        def local(keys):
+            return key_order[np.searchsorted(sorted_keys, keys)]
+
+        if edge_pos:
+            edge_srcs = np.concatenate(edge_srcs)
+            edge_dsts = np.concatenate(edge_dsts)
+            edge_pos = np.concatenate(edge_pos)
+        else:
+            edge_srcs = edge_dsts = edge_pos = np.zeros(0, dtype=np.int64)
+        n_id = torch.from_numpy(node_keys % self.num_nodes)
+        batch = pyg_data.Data(
+            edge_index=torch.from_numpy(
+                np.stack([local(edge_srcs), local(edge_dsts)])
+            ),
+            n_id=n_id,
+            batch=torch.from_numpy(node_keys // self.num_nodes),
+            edge_label_index=torch.from_numpy(
+                local(seed_keys).reshape(2, -1)
+            ),
+            edge_label=torch.from_numpy(self.pred_labels[idxs])
+        )
+        if self.x is not None:
+            batch.x = self.x[n_id]
+        if self.node_types is not None:
+            batch.node_type = torch.from_numpy(
+                self.node_types[n_id.numpy()].astype(np.int64)
+            )
+        if self.nbr_types is not None:
+            batch.edge_type = torch.from_numpy(
+                self.nbr_types[edge_pos].astype(np.int64)
+            )
+        if self.nbr_pairs is not None:
+            # messages flow along edge_srcs -> edge_dsts, whose
+            # prediction edge is the same
+            batch.edge_attr = torch.from_numpy(_cooc_counts_before(
+                self.cooc_keys,
+                self.cooc_stride,
+                self.cooc_ptr,
+                self.nbr_pairs[edge_pos],
+                cutoffs[edge_dsts // self.num_nodes]
+            )).view(-1, 1)
+        return batch
+
+
+def get_link_prediction_loader(
+    n_true_pairs=-1,
+    graph='combi',
+    with_contexts=False,
+    fanouts=(10, 5),
+    batch_size=256,
+    shuffle=True,
+    num_workers=0,
+    seed=None,
+    max_attempts_per_sample=20,
+    **loader_args
+):
+    """ Return a DataLoader of neighbor-sampled link prediction
+        mini-batches (see LinkNeighborSampler).
+
+        graph:
+            - combi: the entity combi graph, with node features as in
+              load_entity_combi_graph and the number of co-occurrence
+              papers before each prediction edge’s cutoff as edge_attr;
+              n_id indexes _entity_combi_graph_arrays’ node_ids
+            - full: the full graph (with_contexts: including contexts)
+              with node and edge type codes; n_id indexes the node_ids
+              of load_full_graph(backend='csr')
+
+        Positive and negative prediction edges are sampled as in
+        get_pair_graphs (n_true_pairs, seed, max_attempts_per_sample),
+        directly from the graph data files. With num_workers > 0,
+        batches are sampled and prefetched in worker processes.
+        Further arguments (e.g. prefetch_factor) are passed on to
+        the DataLoader.
+    """
+
+    if graph not in SAMPLING_GRAPHS:
+        raise ValueError(f'unknown graph "{graph}"')
+
+    if graph == 'combi':
+        sampling_graph = _combi_sampling_graph()
+    else:
+        sampling_graph = _full_sampling_graph(with_contexts=with_contexts)
+    entity_index = sampling_graph.pop('entity_index')
+    if seed is None:
+        rng = random
+    else:
+        rng = random.Random(seed)
+    cooc_edges_pos, cooc_edges_neg = _sample_prediction_edges_from_files(
+        n_true_pairs,
+        rng,
+        max_attempts_per_sample=max_attempts_per_sample
+    )
+    pred_edges = []
+    pred_labels = []
+    pred_years = []
+    pred_months = []
+    for (label, cooc_edges) in [(1, cooc_edges_pos), (0, cooc_edges_neg)]:
+        for cooc_edge in cooc_edges:
+            if not all(ent_id in entity_index for ent_id in cooc_edge['edge']):
+                continue
+            pred_edges.append([entity_index[e] for e in cooc_edge['edge']])
+            pred_labels.append(label)
+            pred_years.append(cooc_edge['cooc_start_year'])
+            pred_months.append(cooc_edge['cooc_start_month'])
+    sampler = LinkNeighborSampler(
+        sampling_graph,
+        np.array(pred_edges, dtype=np.int64).reshape(-1, 2).T,
+        np.array(pred_labels, dtype=np.int64),
+        _pack_date(pred_years, pred_months),
+        fanouts
+    )
+    return torch_data.DataLoader(
+        range(len(sampler)),
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=num_workers,
+        collate_fn=sampler,
+        persistent_workers=num_workers > 0,
+        **loader_args
+    )
@@ -1,43 +1,32 @@
 """ Script for pre computation of node description embeddings
 """
 
-import os
-import json
-import networkx as nx
 import numpy as np
-from hashlib import md5
-from sentence_transformers import SentenceTransformer
-from contextgraph.util.graph import _load_node_tuples
-from contextgraph.util.torch import _get_artifact_description
+from contextgraph.util.graph import _iter_node_tuples
+from contextgraph.util.torch import _entity_descriptions
+from contextgraph.util.embeddings import save_embedding_matrix,\
+                                         compute_description_embeddings
 
 
-node_tuples = _load_node_tuples(entities_only=True)
+model_name = 'all-mpnet-base-v2'
+batch_size = 64
+# set to np.float16 to halve the size of the embedding matrix
+emb_dtype = np.float32
 
-G_lookup = nx.Graph()
-G_lookup.add_nodes_from(node_tuples)
 # get node descriptions
-node_descrs = [
-    _get_artifact_description(ntup[1], G_lookup)
-    for ntup in node_tuples
-]
+node_descrs = _entity_descriptions()
 
-model = SentenceTransformer('all-mpnet-base-v2')
-nodeid_to_fn = {}
-base_dir = 'combigraph_mpnet-base_embeddings'
-for i, ntup in enumerate(node_tuples):
-    node_id = ntup[0]
-    node_descr = node_descrs[i]
-    fn = md5(node_id.encode('utf-8')).hexdigest()
-    fn += '.npy'
-    nodeid_to_fn[node_id] = fn
-    fp = os.path.join(base_dir, fn)
-    # get embedding
-    embedding = model.encode(node_descr)
-    # save to disk
-    np.save(fp, embedding)
-    # if i % 100 == 0:
-    #     print(i)
+# get embeddings (only encodes descriptions not yet in the cache)
+embeddings = compute_description_embeddings(
+    node_descrs,
+    model_name=model_name,
+    batch_size=batch_size,
+    verbose=True
+)
 
-# save node ID to fn map to disk
-with open(os.path.join(base_dir, 'nodeid_to_fn.json'), 'w') as f:
-    json.dump(nodeid_to_fn, f)
+# save embeddings as a single matrix with a node ID to row index map
+save_embedding_matrix(
+    [ntup[0] for ntup in _iter_node_tuples(entities_only=True)],
+    embeddings,
+    dtype=emb_dtype
+)
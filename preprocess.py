@@ -31,4 +31,4 @@ preprocess_papers()
 print('adding citation network')
 add_citation_network()
 print('adding paper contexts')
-add_paper_contexts()
+add_paper_contexts(num_workers=os.cpu_count())
@@ -0,0 +1,88 @@
+""" Benchmark of the cold-start import time of contextgraph modules
+
+    Every module is imported in a fresh interpreter. Exits with a
+    non-zero status if a module exceeds the import time budget or
+    eagerly imports one of the heavy dependencies.
+
+    Run from anywhere as
+        $ python3 scripts/benchmark_imports.py
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+
+modules = [
+    'contextgraph.util.cooc',
+    'contextgraph.util.compact',
+    'contextgraph.util.temporal',
+    'contextgraph.util.neighborhood',
+    'contextgraph.util.samples',
+    'contextgraph.util.splits',
+    'contextgraph.util.embeddings',
+    'contextgraph.util.graph',
+    'contextgraph.util.torch',
+    'contextgraph.util.torch_loader'
+]
+# dependencies that should only be imported on first use
+heavy_modules = [
+    'networkx',
+    'scipy.sparse',
+    'torch',
+    'torch_geometric',
+    'sklearn',
+    'sentence_transformers'
+]
+# median import time budget per module in milliseconds
+budget_ms = 300
+num_runs = 5
+# modules are imported relative to the repository root
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+measure_code = (
+    'import sys, time\n'
+    't = time.perf_counter()\n'
+    'import {module}\n'
+    'print(time.perf_counter() - t)\n'
+    'print(",".join(m for m in {heavy_modules} if m in sys.modules))\n'
+)
+
+
+def measure(module):
+    """ Return the median import time (ms) of module and the heavy
+        dependencies it imported.
+    """
+
+    times = []
+    for i in range(num_runs):
+        out = subprocess.run(
+            [
+                sys.executable,
+                '-c',
+                measure_code.format(
+                    module=module,
+                    heavy_modules=heavy_modules
+                )
+            ],
+            cwd=repo_root,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.splitlines()
+        times.append(float(out[0]) * 1000)
+        loaded = [m for m in out[1].split(',') if len(m) > 0]
+    return statistics.median(times), loaded
+
+
+failed = False
+for module in modules:
+    ms, loaded = measure(module)
+    ok = ms <= budget_ms and len(loaded) == 0
+    failed = failed or not ok
+    print(
+        f'{"ok  " if ok else "FAIL"} {module:<35} {ms:7.1f} ms'
+        + (f'  (imports {", ".join(loaded)})' if loaded else '')
+    )
+sys.exit(1 if failed else 0)
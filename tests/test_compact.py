@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from contextgraph.util.compact import CompactGraph
+
+
+def _assert_same_graph(CG, loaded):
+    assert loaded.directed == CG.directed
+    assert loaded.node_ids == CG.node_ids
+    assert loaded.node_type_names == CG.node_type_names
+    assert loaded.edge_type_names == CG.edge_type_names
+    for attr in [
+        'node_types', 'node_years', 'node_months',
+        'out_indptr', 'out_indices', 'out_types',
+        'in_indptr', 'in_indices', 'in_types'
+    ]:
+        assert np.array_equal(getattr(loaded, attr), getattr(CG, attr))
+
+
+def test_save_load_untyped_node(tmp_path):
+    CG = CompactGraph(
+        ['uxv:paper/1', 'uxv:task/ä', 'untyped'],
+        ['paper', 'task', None],
+        [0, 1, 2],
+        ['has_task', None],
+        [0, 2],
+        [1, 0],
+        [0, 1],
+        node_years=[2019, -1, 0],
+        node_months=[5, -1, 0]
+    )
+    fp = tmp_path / 'graph.npz'
+    CG.save(fp)
+    loaded = CompactGraph.load(fp)
+    _assert_same_graph(CG, loaded)
+    assert loaded.node_type('untyped') is None
+
+
+def test_save_load_from_networkx_untyped_node(tmp_path):
+    nx = pytest.importorskip('networkx')
+    G = nx.DiGraph()
+    G.add_node('a', type='method')
+    G.add_edge('a', 'b', type='used_in_paper')
+    CG = CompactGraph.from_networkx(G)
+    assert CG.node_type('b') is None
+    fp = tmp_path / 'graph.npz'
+    CG.save(fp)
+    _assert_same_graph(CG, CompactGraph.load(fp))